@@ -0,0 +1,155 @@
+"""Hourly and daily activity counts, for the admin activity page.
+
+Counting messages, likes, follows, signups and active users per hour or
+day from the base tables means scanning them, so they're counted as they
+happen instead: the write routes call `record_activity` in the same
+transaction as the write, which adds to that hour's and day's rows in
+`activity_counts`. `/admin/activity` only reads those rows.
+
+Every write in an hour would otherwise update the same row, so each count
+is split into ACTIVITY_SHARDS rows (by the acting user's id), summed when
+read. A user is counted as active in an hour or day the first time they
+post, like or follow in it, which `active_users` keeps track of; its rows
+are only needed until the day is over, so prune them daily with
+`flask activity prune`.
+
+Counts start from when this was deployed, and count events: an unlike
+doesn't take back a like.
+"""
+
+from collections import Counter
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app
+from sqlalchemy import delete, func, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from models import db, ActiveUser, ActivityCount
+
+DEFAULT_CONFIG = {
+    "ACTIVITY_SHARDS": 8,
+    # days of active_users rows to keep
+    "ACTIVITY_KEEP_DAYS": 2,
+}
+
+GRANULARITIES = {
+    "hour": lambda when: when.replace(minute=0, second=0, microsecond=0),
+    "day": lambda when: when.replace(
+        hour=0, minute=0, second=0, microsecond=0),
+}
+
+METRICS = ("messages", "likes", "follows", "signups", "active_users")
+
+# metrics that make a user active
+ACTIONS = ("messages", "likes", "follows")
+
+
+def add_counts(counts, shard):
+    """Add `counts`, {(granularity, period start, metric): n}, to
+    `shard`'s rows.
+    """
+
+    stmt = pg_insert(ActivityCount).values([
+        {"granularity": granularity, "period_start": start,
+         "metric": metric, "shard": shard, "count": n}
+        for (granularity, start, metric), n in sorted(counts.items())
+    ])
+    db.session.execute(stmt.on_conflict_do_update(
+        index_elements=["granularity", "period_start", "metric", "shard"],
+        set_={"count": ActivityCount.count + stmt.excluded.count}))
+
+
+def mark_active(user_id, when):
+    """Record `user_id` as active at `when`.
+
+    Returns the (granularity, period start)s they weren't already active
+    in.
+    """
+
+    stmt = pg_insert(ActiveUser).values([
+        {"granularity": granularity, "period_start": start(when),
+         "user_id": user_id}
+        for granularity, start in GRANULARITIES.items()
+    ])
+    return db.session.execute(
+        stmt.on_conflict_do_nothing()
+        .returning(ActiveUser.granularity, ActiveUser.period_start)).all()
+
+
+def record_activity(metric, user_id, whens=None):
+    """Count `metric` for `user_id`, once per time in `whens` (default,
+    once now). Call it in the write's transaction.
+    """
+
+    now = datetime.utcnow()
+    if whens is None:
+        whens = [now]
+    elif not whens:
+        return
+
+    counts = Counter()
+    for when in whens:
+        for granularity, start in GRANULARITIES.items():
+            counts[granularity, start(when), metric] += 1
+
+    if metric in ACTIONS:
+        for granularity, start in mark_active(user_id, now):
+            counts[granularity, start, "active_users"] += 1
+
+    add_counts(counts, user_id % current_app.config["ACTIVITY_SHARDS"])
+
+
+def activity_table(granularity, periods, now=None):
+    """Return the last `periods` hours or days of counts, newest first, as
+    (period start, {metric: count})s.
+    """
+
+    now = now or datetime.utcnow()
+    latest = GRANULARITIES[granularity](now)
+    step = timedelta(hours=1) if granularity == "hour" else timedelta(days=1)
+    starts = [latest - step * i for i in range(periods)]
+
+    table = {start: dict.fromkeys(METRICS, 0) for start in starts}
+    for start, metric, count in db.session.execute(
+            select(ActivityCount.period_start,
+                   ActivityCount.metric,
+                   func.sum(ActivityCount.count))
+            .where(ActivityCount.granularity == granularity,
+                   ActivityCount.period_start >= starts[-1])
+            .group_by(ActivityCount.period_start, ActivityCount.metric)):
+        if start in table and metric in table[start]:
+            table[start][metric] = count
+
+    return list(table.items())
+
+
+def prune(keep_days, now=None):
+    """Delete active_users rows older than `keep_days`; return how many."""
+
+    cutoff = (now or datetime.utcnow()) - timedelta(days=keep_days)
+    result = db.session.execute(
+        delete(ActiveUser).where(ActiveUser.period_start < cutoff))
+    db.session.commit()
+    return result.rowcount
+
+
+def init_activity(app):
+    """Set up `app`'s activity settings and CLI."""
+
+    for key, value in DEFAULT_CONFIG.items():
+        app.config.setdefault(key, value)
+
+    @app.cli.group("activity")
+    def activity_cli():
+        """Activity count commands."""
+
+    @activity_cli.command("prune")
+    @click.option("--days", type=int, default=None,
+                  help="Days to keep (default ACTIVITY_KEEP_DAYS).")
+    def prune_command(days):
+        """Delete old active user rows."""
+
+        if days is None:
+            days = app.config["ACTIVITY_KEEP_DAYS"]
+        click.echo(f"deleted {prune(days)} rows")
@@ -0,0 +1,288 @@
+"""JSON API for the home timeline, a user's messages and a user's likes,
+for importing messages in bulk (see ingest.py), and for username
+autocomplete (see usernames.py).
+
+Every list endpoint returns up to `limit` (default 20, at most 100)
+messages, newest first, with the users who wrote them sent once each:
+
+    {
+        "messages": [
+            {"id": 7, "user_id": 2, "text": "...",
+             "timestamp": "2023-06-01T12:00:00Z", "likes": 3, "liked": false},
+            ...
+        ],
+        "users": {"2": {"username": "...", "image_url": "..."}},
+        "more": true
+    }
+
+Pass `before_id` (the oldest id you have) to page back, or `since_id` (the
+newest id you have) to fetch only what's new. When there are more than
+`limit` new messages, a `since_id` fetch returns the oldest of them and
+"more" is true: fetch again with the newest id you got, and you won't miss
+any.
+
+Responses carry an ETag over the messages, their like counts and whether
+you liked them; send it back as If-None-Match to get an empty 304 when none
+of that has changed. The home timeline's usual requests are answered from
+the timeline cache (timeline.py).
+"""
+
+import hashlib
+
+from flask import Blueprint, current_app, g, jsonify, request
+from sqlalchemy import func, select, tuple_
+from sqlalchemy.orm import selectinload
+from werkzeug.exceptions import (
+    HTTPException, BadRequest, RequestEntityTooLarge, Unauthorized,
+    UnsupportedMediaType)
+
+from ingest import CONTENT_TYPES, IngestError, ingest
+from models import db, Like, Message, User
+from replicas import read_only
+from timeline import get_timelines
+from usernames import COMPLETE_LIMIT, complete_username
+
+API_PAGE_SIZE = 20
+API_MAX_PAGE_SIZE = 100
+
+api = Blueprint("api", __name__, url_prefix="/api")
+
+
+@api.errorhandler(HTTPException)
+def json_error(e):
+    response = jsonify(error=e.description)
+    response.status_code = e.code
+    # e.g. Retry-After
+    for name, value in e.get_headers():
+        if name != "Content-Type":
+            response.headers[name] = value
+    return response
+
+
+@api.before_request
+def require_user():
+    if not g.user:
+        raise Unauthorized("Log in first.")
+
+
+def int_arg(name, default=None):
+    value = request.args.get(name)
+    if value is None:
+        return default
+
+    try:
+        return int(value)
+    except ValueError:
+        raise BadRequest(f"{name} must be an integer.")
+
+
+def page_args():
+    """Return the request's (since_id, before_id, limit)."""
+
+    limit = min(int_arg("limit", API_PAGE_SIZE), API_MAX_PAGE_SIZE)
+    if limit < 1:
+        raise BadRequest("limit must be positive.")
+
+    return int_arg("since_id"), int_arg("before_id"), limit
+
+
+def keyset_page(query, key, since=None, before=None, limit=API_PAGE_SIZE):
+    """Page through `query` by `key`, a list of columns, newest first.
+
+    `since` and `before` are values of `key`. The last column of `key` is
+    the message id. Returns (message ids, whether there are more).
+    """
+
+    key_expr = tuple_(*key) if len(key) > 1 else key[0]
+    query = query.add_columns(*key)
+
+    if before is not None:
+        query = query.where(key_expr < before)
+
+    if since is not None:
+        # the oldest new ones first, so following pages leave no gaps
+        query = query.where(key_expr > since).order_by(*key)
+    else:
+        query = query.order_by(*[column.desc() for column in key])
+
+    rows = db.session.execute(query.limit(limit + 1)).all()
+    ids = [row[-1] for row in rows[:limit]]
+
+    if since is not None:
+        ids.reverse()
+    return ids, len(rows) > limit
+
+
+def messages_query(*where):
+    return (select()
+            .select_from(Message)
+            .join(Message.user)
+            .where(User.deleted_at.is_(None), *where))
+
+
+def cached_timeline_page(user, since_id, limit):
+    """The home timeline page from the timeline cache, if it has it all.
+
+    Returns (ids, more), or None.
+    """
+
+    cached = sorted(get_timelines().message_ids(user), reverse=True)
+    complete = len(cached) < current_app.config["TIMELINE_LENGTH"]
+
+    if since_id is None:
+        if complete or len(cached) > limit:
+            return cached[:limit], len(cached) > limit
+        return None
+
+    newer = [id for id in cached if id > since_id]
+    if complete or len(newer) < len(cached):
+        return newer[-limit:], len(newer) > limit
+    return None
+
+
+def messages_response(ids, more):
+    """Return the JSON response for the messages with `ids`, in order."""
+
+    counts = dict(db.session.execute(
+        select(Like.message_id, func.count())
+        .where(Like.message_id.in_(ids))
+        .group_by(Like.message_id)).all())
+
+    liked = set(db.session.scalars(
+        select(Like.message_id)
+        .where(Like.user_id == g.user.id, Like.message_id.in_(ids))))
+
+    etag = hashlib.md5(
+        repr((ids, sorted(counts.items()), sorted(liked), more)).encode()
+    ).hexdigest()
+    if etag in request.if_none_match:
+        response = current_app.response_class(status=304)
+        response.set_etag(etag)
+        return response
+
+    messages = db.session.scalars(
+        select(Message)
+        .where(Message.id.in_(ids))
+        .options(selectinload(Message.user))).all()
+    by_id = {message.id: message for message in messages}
+
+    payload = []
+    users = {}
+    for id in ids:
+        message = by_id.get(id)
+        if message is None:
+            continue
+
+        payload.append({
+            "id": message.id,
+            "user_id": message.user_id,
+            "text": message.text,
+            "timestamp": message.timestamp.isoformat() + "Z",
+            "likes": counts.get(id, 0),
+            "liked": id in liked,
+        })
+        users.setdefault(str(message.user_id), {
+            "username": message.user.username,
+            "image_url": message.user.image_url,
+        })
+
+    response = jsonify(messages=payload, users=users, more=more)
+    response.set_etag(etag)
+    return response
+
+
+@api.get("/timeline")
+@read_only
+def timeline():
+    """Messages by the current user and the users they follow."""
+
+    since_id, before_id, limit = page_args()
+
+    page = None
+    if before_id is None:
+        page = cached_timeline_page(g.user, since_id, limit)
+
+    if page is None:
+        user_ids = g.user.following_ids()
+        user_ids.append(g.user.id)
+        page = keyset_page(
+            messages_query(Message.user_id.in_(user_ids)),
+            [Message.id], since_id, before_id, limit)
+
+    return messages_response(*page)
+
+
+@api.get("/users/<int:user_id>/messages")
+@read_only
+def user_messages(user_id):
+    """A user's messages."""
+
+    User.get_active_or_404(user_id)
+    since_id, before_id, limit = page_args()
+
+    return messages_response(*keyset_page(
+        messages_query(Message.user_id == user_id),
+        [Message.id], since_id, before_id, limit))
+
+
+@api.get("/users/<int:user_id>/likes")
+@read_only
+def user_likes(user_id):
+    """The messages a user has liked, most recently liked first.
+
+    `since_id` and `before_id` are ids of messages on this list.
+    """
+
+    User.get_active_or_404(user_id)
+    since_id, before_id, limit = page_args()
+
+    def like_key(message_id):
+        if message_id is None:
+            return None
+
+        like = db.session.get(Like, (message_id, user_id))
+        if like is None:
+            raise BadRequest(f"Message {message_id} isn't liked any more.")
+        return (like.liked_at, like.message_id)
+
+    return messages_response(*keyset_page(
+        messages_query(Like.user_id == user_id)
+        .join(Like, Like.message_id == Message.id),
+        [Like.liked_at, Like.message_id],
+        like_key(since_id), like_key(before_id), limit))
+
+
+@api.post("/messages/import")
+def import_messages():
+    """Import a batch of the current user's messages; see ingest.py."""
+
+    format = CONTENT_TYPES.get(request.mimetype)
+    if format is None:
+        raise UnsupportedMediaType(
+            f"Send one of {', '.join(CONTENT_TYPES)}.")
+
+    max_bytes = current_app.config["INGEST_MAX_BYTES"]
+    if request.content_length is None or request.content_length > max_bytes:
+        raise RequestEntityTooLarge(f"Send at most {max_bytes} bytes.")
+
+    try:
+        ids = ingest(g.user.id, request.stream, format)
+    except IngestError as e:
+        return jsonify(errors=e.errors), 400
+
+    return jsonify(created=len(ids)), 201
+
+
+@api.get("/users/autocomplete")
+def autocomplete_users():
+    """Usernames starting with `q`, ignoring case, in alphabetical order."""
+
+    prefix = request.args.get("q", "").strip()
+    limit = min(int_arg("limit", COMPLETE_LIMIT), COMPLETE_LIMIT)
+    if not prefix or limit < 1:
+        return jsonify(users=[])
+
+    return jsonify(users=[
+        {"id": user_id, "username": username}
+        for user_id, username in complete_username(prefix, limit)
+    ])
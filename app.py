@@ -1,35 +1,134 @@
 import os
+from datetime import datetime
+
 from dotenv import load_dotenv
 
-from flask import Flask, render_template, request, flash, redirect, session, g
-from flask_debugtoolbar import DebugToolbarExtension
+from flask import (
+    Blueprint, Flask, render_template, request, flash, redirect, session, g,
+    abort, current_app, jsonify, stream_with_context)
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import selectinload
 from sqlalchemy.orm.exc import StaleDataError
 from werkzeug.exceptions import Unauthorized
 
+import signals
+import tasks  # noqa: F401 (registers the background tasks)
+from activity import (
+    METRICS, activity_table, init_activity, record_activity)
+from api import api
+from archive import get_archive, init_archive
+from cache import cache_is_shared, cache_model, cached_get, init_cache
+from export import FORMATS, USER_SECTIONS, export_user, init_export
 from forms import UserAddForm, LoginForm, MessageForm, CsrfForm, UserUpdateForm
-from models import db, connect_db, User, Message
-
-load_dotenv()
+from graph import init_graph
+from ingest import init_ingest
+from jobs import enqueue, init_jobs
+from live import init_live
+from models import db, connect_db, User, Message, Like
+from notifications import (
+    init_notifications, mark_read, notifications_page, queue_notification)
+from pooling import (
+    init_pgbouncer, init_pool, init_pool_recycle, pool_config_from_env)
+from profiling import init_profiling
+from ratelimit import init_ratelimit
+from replicas import init_replicas, read_only
+from suggestions import init_suggestions
+from templating import init_templating, warm_templates
+from timeline import get_timelines, init_timeline
+from trending import (
+    PERIODS, init_trending, record_like, record_unlike, trending_messages)
+from uniqueness import init_uniqueness, taken_fields
+from usernames import init_usernames
 
 CURR_USER_KEY = "curr_user"
+LIKES_PER_PAGE = 20
+FOLLOWS_PER_PAGE = 24
+MESSAGE_CARDS_LIMIT = 50
+
+bp = Blueprint("warbler", __name__)
+
 
+def config_from_env(environ):
+    """Return app config read from environment variables."""
 
-app = Flask(__name__)
+    config = {
+        'SQLALCHEMY_DATABASE_URI': environ.get('DATABASE_URL'),
+        'SQLALCHEMY_REPLICA_URLS': [
+            url for url in environ.get('DATABASE_REPLICA_URLS', '').split(',')
+            if url
+        ],
+        'SQLALCHEMY_ECHO': False,
+        'DEBUG_TB_INTERCEPT_REDIRECTS': False,
+        'SECRET_KEY': environ.get('SECRET_KEY'),
+        'ADMIN_USER_IDS': [
+            int(user_id)
+            for user_id in environ.get('ADMIN_USER_IDS', '').split(',')
+            if user_id
+        ],
+    }
+    config.update(pool_config_from_env(environ))
 
-app.config['SQLALCHEMY_DATABASE_URI'] = os.environ['DATABASE_URL']
-app.config['SQLALCHEMY_ECHO'] = False
-app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
-app.config['SECRET_KEY'] = os.environ['SECRET_KEY']
-toolbar = DebugToolbarExtension(app)
+    return config
 
-connect_db(app)
+
+def create_app(config=None):
+    """Create and configure a Warbler app.
+
+    Settings come from the environment (and .env), overridden by `config`.
+
+    Nothing here connects to the database: engines connect on first use, and
+    are reset in forked children, so this is safe to call before gunicorn
+    forks its workers (`--preload`). Templates are loaded here too (see
+    templating.py), so workers don't compile them on their first requests.
+    """
+
+    load_dotenv()
+
+    app = Flask(__name__)
+    app.config.update(config_from_env(os.environ))
+    app.config.update(config or {})
+
+    if app.debug and not app.testing:
+        # only pay for importing the toolbar when it can actually be used
+        from flask_debugtoolbar import DebugToolbarExtension
+        DebugToolbarExtension(app)
+
+    init_templating(app)
+    init_profiling(app)
+    init_cache(app)
+    init_ratelimit(app, CURR_USER_KEY)
+    init_pool(app)
+    init_replicas(app)
+    connect_db(app)
+    init_pool_recycle(app)
+    init_pgbouncer(app)
+    init_graph(app)
+    init_usernames(app)
+    init_uniqueness(app)
+    init_suggestions(app)
+    init_trending(app)
+    init_timeline(app)
+    init_live(app)
+    init_notifications(app)
+    init_activity(app)
+    init_export(app)
+    init_ingest(app)
+    init_archive(app)
+    init_jobs(app)
+
+    app.register_blueprint(bp)
+    app.register_blueprint(api)
+
+    if app.config["TEMPLATES_WARMUP"]:
+        warm_templates(app)
+
+    return app
 
 ##############################################################################
 # CSRF form
 
 
-@app.before_request
+@bp.before_app_request
 def add_csrf_form_to_g():
     """Add csrf form to Flask global"""
 
@@ -39,15 +138,32 @@ def add_csrf_form_to_g():
 # User signup/login/logout
 
 
-@app.before_request
-def add_user_to_g():
-    """If we're logged in, add curr user to Flask global."""
+cache_model(User)
 
-    if CURR_USER_KEY in session:
-        g.user = User.query.get(session[CURR_USER_KEY])
 
+def get_logged_in_user():
+    """Return the session's logged in user, or None if there isn't one or
+    they've deleted their account.
+    """
+
+    if CURR_USER_KEY not in session:
+        return None
+
+    # a per-process cache would miss other workers' renames and account
+    # deletions, so only use a shared one
+    if cache_is_shared(current_app.config):
+        user = cached_get(User, session[CURR_USER_KEY])
     else:
-        g.user = None
+        user = db.session.get(User, session[CURR_USER_KEY])
+
+    return None if user and user.deleted_at else user
+
+
+@bp.before_app_request
+def add_user_to_g():
+    """If we're logged in, add curr user to Flask global."""
+
+    g.user = get_logged_in_user()
 
 
 def do_login(user):
@@ -63,7 +179,25 @@ def do_logout():
         del session[CURR_USER_KEY]
 
 
-@app.route('/signup', methods=["GET", "POST"])
+def check_available(form, user_id=None):
+    """Check that `form`'s username and email aren't taken by anyone but
+    `user_id`, before paying for a password hash.
+
+    Flashes, and adds an error to each taken field, if they are.
+    """
+
+    taken = taken_fields(
+        user_id, username=form.username.data, email=form.email.data)
+
+    for field in taken:
+        form[field].errors.append("Already taken.")
+    if taken:
+        flash("Username and/or email already taken", 'danger')
+
+    return not taken
+
+
+@bp.route('/signup', methods=["GET", "POST"])
 def signup():
     """Handle user signup.
 
@@ -79,7 +213,7 @@ def signup():
         del session[CURR_USER_KEY]
     form = UserAddForm()
 
-    if form.validate_on_submit():
+    if form.validate_on_submit() and check_available(form):
         try:
             user = User.signup(
                 username=form.username.data,
@@ -87,6 +221,8 @@ def signup():
                 email=form.email.data,
                 image_url=form.image_url.data or User.image_url.default.arg,
             )
+            db.session.flush()
+            record_activity("signups", user.id)
             db.session.commit()
 
         except IntegrityError:
@@ -95,6 +231,12 @@ def signup():
 
             return render_template('users/signup.html', form=form)
 
+        signals.user_signed_up.send(
+            current_app._get_current_object(),
+            user_id=user.id,
+            username=user.username,
+            email=user.email)
+
         do_login(user)
 
         return redirect("/")
@@ -103,7 +245,22 @@ def signup():
         return render_template('users/signup.html', form=form)
 
 
-@app.route('/login', methods=["GET", "POST"])
+@bp.get('/signup/available')
+def username_available():
+    """Is the `username` in the query string free? For the signup form.
+
+    (Emails aren't checked here, so this can't tell anyone who has an
+    account.)
+    """
+
+    username = request.args.get('username', '').strip()
+    if not username:
+        abort(400)
+
+    return jsonify(available=not taken_fields(username=username))
+
+
+@bp.route('/login', methods=["GET", "POST"])
 def login():
     """Handle user login and redirect to homepage on success."""
 
@@ -124,7 +281,7 @@ def login():
     return render_template('users/login.html', form=form)
 
 
-@app.post('/logout')
+@bp.post('/logout')
 def logout():
     """Handle logout of user and redirect to homepage."""
 
@@ -142,7 +299,7 @@ def logout():
 ##############################################################################
 # General user routes:
 
-@app.get('/users')
+@bp.get('/users')
 def list_users():
     """Page with listing of users.
 
@@ -156,10 +313,10 @@ def list_users():
     search = request.args.get('q')
 
     if not search:
-        users = User.query.all()
+        users = User.active().all()
         curr_url = '/users'
     else:
-        users = User.query.filter(User.username.like(f"%{search}%")).all()
+        users = User.active().filter(User.username.like(f"%{search}%")).all()
         curr_url = f'/users?q={search}'
 
     return render_template(
@@ -170,7 +327,8 @@ def list_users():
     )
 
 
-@app.get('/users/<int:user_id>')
+@bp.get('/users/<int:user_id>')
+@read_only
 def show_user(user_id):
     """Show user profile."""
 
@@ -178,7 +336,7 @@ def show_user(user_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    user = User.query.get_or_404(user_id)
+    user = User.get_active_or_404(user_id)
 
     return render_template(
         'users/show.html',
@@ -188,7 +346,8 @@ def show_user(user_id):
     )
 
 
-@app.get('/users/<int:user_id>/following')
+@bp.get('/users/<int:user_id>/following')
+@read_only
 def show_following(user_id):
     """Show list of people this user is following."""
 
@@ -196,16 +355,24 @@ def show_following(user_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    user = User.query.get_or_404(user_id)
+    user = User.get_active_or_404(user_id)
+    after = request.args.get('after', type=int)
+
+    following = user.following_page(g.user, after, FOLLOWS_PER_PAGE + 1)
+    more = len(following) > FOLLOWS_PER_PAGE
+
     return render_template(
         'users/following.html',
         user=user,
+        following=following[:FOLLOWS_PER_PAGE],
+        more=more,
         form=g.csrf_form,
         curr_url=f'/users/{user_id}/following'
     )
 
 
-@app.get('/users/<int:user_id>/followers')
+@bp.get('/users/<int:user_id>/followers')
+@read_only
 def show_followers(user_id):
     """Show list of followers of this user."""
 
@@ -213,16 +380,23 @@ def show_followers(user_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    user = User.query.get_or_404(user_id)
+    user = User.get_active_or_404(user_id)
+    after = request.args.get('after', type=int)
+
+    followers = user.followers_page(g.user, after, FOLLOWS_PER_PAGE + 1)
+    more = len(followers) > FOLLOWS_PER_PAGE
+
     return render_template(
         'users/followers.html',
         user=user,
+        followers=followers[:FOLLOWS_PER_PAGE],
+        more=more,
         form=g.csrf_form,
         curr_url=f'/users/{user_id}/followers'
     )
 
 
-@app.post('/users/follow/<int:follow_id>')
+@bp.post('/users/follow/<int:follow_id>')
 def start_following(follow_id):
     """Add a follow for the currently-logged-in user.
 
@@ -239,10 +413,17 @@ def start_following(follow_id):
         try:
             curr_url = request.form['curr-url']
 
-            followed_user = User.query.get_or_404(follow_id)
+            followed_user = User.get_active_or_404(follow_id)
             g.user.following.append(followed_user)
+            queue_notification(follow_id, "follow", g.user.id)
+            record_activity("follows", g.user.id)
             db.session.commit()
 
+            signals.followed.send(
+                current_app._get_current_object(),
+                follower_id=g.user.id,
+                followed_id=follow_id)
+
             # return redirect(f"/users/{g.user.id}/following")
         except IntegrityError:
             db.session.rollback()
@@ -253,7 +434,7 @@ def start_following(follow_id):
         raise Unauthorized()
 
 
-@app.post('/users/stop-following/<int:follow_id>')
+@bp.post('/users/stop-following/<int:follow_id>')
 def stop_following(follow_id):
     """Have currently-logged-in-user stop following this user.
 
@@ -273,6 +454,11 @@ def stop_following(follow_id):
             g.user.following.remove(followed_user)
             db.session.commit()
 
+            signals.unfollowed.send(
+                current_app._get_current_object(),
+                follower_id=g.user.id,
+                followed_id=follow_id)
+
             # return redirect(f"/users/{g.user.id}/following")
         except ValueError:
             print("ValueError occured")
@@ -285,7 +471,7 @@ def stop_following(follow_id):
         return Unauthorized()
 
 
-@app.route('/users/profile', methods=["GET", "POST"])
+@bp.route('/users/profile', methods=["GET", "POST"])
 def profile():
     """Update profile for current user."""
 
@@ -295,13 +481,15 @@ def profile():
 
     form = UserUpdateForm(obj=g.user)
 
-    if form.validate_on_submit():
+    if form.validate_on_submit() and check_available(form, g.user.id):
         user = User.authenticate(
             g.user.username,
             form.password.data)
 
         if user:
             try:
+                renamed = user.username != form.username.data
+                new_email = user.email != form.email.data
                 user.username = form.username.data
                 user.email = form.email.data
                 user.location = form.location.data
@@ -312,6 +500,17 @@ def profile():
 
                 db.session.commit()
 
+                if renamed:
+                    signals.user_renamed.send(
+                        current_app._get_current_object(),
+                        user_id=user.id,
+                        username=user.username)
+                if new_email:
+                    signals.user_email_changed.send(
+                        current_app._get_current_object(),
+                        user_id=user.id,
+                        email=user.email)
+
                 return redirect(f"/users/{g.user.id}")
             except IntegrityError:
                 db.session.rollback()
@@ -323,7 +522,34 @@ def profile():
     return render_template('users/edit.html', form=form, user=g.user)
 
 
-@app.post('/users/delete')
+@bp.get('/users/<int:user_id>/export')
+def export_user_data(user_id):
+    """Download the current user's data, streamed as it's read.
+
+    NDJSON by default; `format=csv` exports one `section` at a time.
+    (Not @read_only: the async mode would buffer the whole export.)
+    """
+
+    if not g.user or g.user.id != user_id:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+
+    format = request.args.get('format', 'ndjson')
+    section = request.args.get('section')
+
+    if (format not in FORMATS or
+            (section or format == 'csv') and section not in USER_SECTIONS):
+        abort(400)
+
+    filename = f"warbler-{g.user.username}-{section or 'data'}.{format}"
+
+    return current_app.response_class(
+        stream_with_context(export_user(user_id, format, section)),
+        mimetype=FORMATS[format],
+        headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+
+
+@bp.post('/users/delete')
 def delete_user():
     """Delete user.
 
@@ -340,23 +566,46 @@ def delete_user():
 
         do_logout()
 
-        try:
-            Message.query.filter(Message.user_id == g.user.id).delete()
-            db.session.delete(g.user)
-            db.session.commit()
-        except StaleDataError:
-            db.session.rollback()
+        # the user disappears from every page now; deleting everything a
+        # prolific user has made takes a while, so a job does that
+        g.user.deleted_at = datetime.utcnow()
+        enqueue("delete_user", user_id=g.user.id)
+        db.session.commit()
 
+        signals.user_deleted.send(
+            current_app._get_current_object(),
+            user_id=g.user.id)
+
+        flash("Your account is being deleted.", "success")
         return redirect("/signup")
 
     else:
         raise Unauthorized()
 
 
+@bp.get('/notifications')
+def show_notifications():
+    """Show the current user's latest notifications, marking them read."""
+
+    if not g.user:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+
+    unread = mark_read(g.user.id)
+    notifications = notifications_page(
+        g.user.id, current_app.config["NOTIFICATIONS_PER_PAGE"])
+
+    return render_template(
+        'users/notifications.html',
+        notifications=notifications,
+        unread=unread,
+        form=g.csrf_form)
+
+
 ##############################################################################
 # Messages routes:
 
-@app.route('/messages/new', methods=["GET", "POST"])
+@bp.route('/messages/new', methods=["GET", "POST"])
 def add_message():
     """Add a message:
 
@@ -371,9 +620,16 @@ def add_message():
 
     if form.validate_on_submit():
         try:
-            msg = Message(text=form.text.data)
-            g.user.messages.append(msg)
+            # not g.user.messages.append, which loads every message first
+            msg = Message(text=form.text.data, user_id=g.user.id)
+            db.session.add(msg)
+            record_activity("messages", g.user.id)
             db.session.commit()
+
+            signals.message_posted.send(
+                current_app._get_current_object(),
+                message_id=msg.id,
+                user_id=g.user.id)
         except IntegrityError:
             db.session.rollback()
 
@@ -382,7 +638,45 @@ def add_message():
     return render_template('messages/create.html', form=form)
 
 
-@app.get('/messages/<int:message_id>')
+@bp.get('/messages/stream')
+def stream_messages():
+    """Live timeline stream; only the async serving mode (asgi.py) has one.
+
+    Tells the browser not to reconnect.
+    """
+
+    return "", 204
+
+
+@bp.get('/messages/cards')
+@read_only
+def show_message_cards():
+    """Render the timeline cards for the messages in `ids`, newest first."""
+
+    if not g.user:
+        raise Unauthorized()
+
+    try:
+        ids = [int(id) for id in request.args.get('ids', '').split(',')]
+    except ValueError:
+        abort(400)
+
+    messages = (Message
+                .query
+                .options(selectinload(Message.user),
+                         selectinload(Message.likes))
+                .join(Message.user)
+                .filter(Message.id.in_(ids[:MESSAGE_CARDS_LIMIT]),
+                        User.deleted_at.is_(None))
+                .order_by(Message.timestamp.desc())
+                .all())
+
+    return render_template(
+        'messages/cards.html', messages=messages, form=g.csrf_form)
+
+
+@bp.get('/messages/<int:message_id>')
+@read_only
 def show_message(message_id):
     """Show a message."""
 
@@ -390,11 +684,15 @@ def show_message(message_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    msg = Message.query.get_or_404(message_id)
+    # messages in archived partitions are read from the archive
+    msg = db.session.get(Message, message_id) or get_archive().get(message_id)
+    if msg is None or msg.user is None or msg.user.deleted_at:
+        abort(404)
+
     return render_template('messages/show.html', message=msg, form=g.csrf_form)
 
 
-@app.post('/messages/<int:message_id>/delete')
+@bp.post('/messages/<int:message_id>/delete')
 def delete_message(message_id):
     """Delete a message.
 
@@ -408,8 +706,14 @@ def delete_message(message_id):
 
     try:
         msg = Message.query.get_or_404(message_id)
+        user_id = msg.user_id
         db.session.delete(msg)
         db.session.commit()
+
+        signals.message_deleted.send(
+            current_app._get_current_object(),
+            message_id=message_id,
+            user_id=user_id)
     except StaleDataError:
         db.session.rollback()
 
@@ -419,7 +723,8 @@ def delete_message(message_id):
 # Likes
 
 
-@app.get('/users/<int:user_id>/likes')
+@bp.get('/users/<int:user_id>/likes')
+@read_only
 def show_liked_messages(user_id):
     """Display all messages user has liked"""
 
@@ -427,17 +732,32 @@ def show_liked_messages(user_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    user = User.query.get_or_404(user_id)
+    user = User.get_active_or_404(user_id)
+
+    before = None
+    try:
+        before = (datetime.fromisoformat(request.args['before']),
+                  int(request.args['before_id']))
+    except (KeyError, ValueError):
+        pass
+
+    liked = user.liked_messages_page(before, limit=LIKES_PER_PAGE + 1)
+    more = len(liked) > LIKES_PER_PAGE
+    liked = liked[:LIKES_PER_PAGE]
+    like_counts = Message.like_counts([message.id for message, _ in liked])
 
     return render_template(
         'users/liked_messages.html',
         user=user,
+        liked=liked,
+        like_counts=like_counts,
+        more=more,
         form=g.csrf_form,
         curr_url=f'/users/{user_id}/likes'
     )
 
 
-@app.post('/messages/<int:message_id>/like')
+@bp.post('/messages/<int:message_id>/like')
 def add_like_to_message(message_id):
     """Add message to user's liked messages list.
     Redirect to same page.
@@ -457,9 +777,19 @@ def add_like_to_message(message_id):
             raise Unauthorized()
 
         curr_url = request.form['curr-url']
+        bucket_seconds = current_app.config["TRENDING_BUCKET_SECONDS"]
 
         try:
-            g.user.liked_messages.append(msg)
+            like = Like(
+                message_id=msg.id,
+                user_id=g.user.id,
+                liked_at=datetime.utcnow())
+            db.session.add(like)
+            db.session.flush()
+
+            record_like(msg.id, like.liked_at, bucket_seconds)
+            queue_notification(msg.user_id, "like", g.user.id, msg.id)
+            record_activity("likes", g.user.id)
             db.session.commit()
         except IntegrityError:
             db.session.rollback()
@@ -470,7 +800,7 @@ def add_like_to_message(message_id):
         raise Unauthorized()
 
 
-@app.post('/messages/<int:message_id>/unlike')
+@bp.post('/messages/<int:message_id>/unlike')
 def remove_like_from_message(message_id):
     """Remove message from user's liked messages.
     Redirect to same page.
@@ -490,14 +820,16 @@ def remove_like_from_message(message_id):
             raise Unauthorized()
 
         curr_url = request.form['curr-url']
+        bucket_seconds = current_app.config["TRENDING_BUCKET_SECONDS"]
 
-        try:
-            g.user.liked_messages.remove(msg)
+        like = db.session.get(Like, (msg.id, g.user.id), with_for_update=True)
+
+        if like:
+            record_unlike(like, bucket_seconds)
+            db.session.delete(like)
             db.session.commit()
-        except ValueError:
-            print("ValueError occured")
-        except StaleDataError:
-            print("Message already deleted")
+        else:
+            print("Message already unliked")
 
         return redirect(curr_url)
 
@@ -505,11 +837,62 @@ def remove_like_from_message(message_id):
         raise Unauthorized()
 
 
+@bp.get('/messages/trending')
+@read_only
+def show_trending():
+    """Show the most liked messages of the last hour, day or week."""
+
+    if not g.user:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+
+    period = request.args.get('period', 'day')
+    if period not in PERIODS:
+        period = 'day'
+
+    return render_template(
+        'messages/trending.html',
+        trending=trending_messages(period, 50),
+        period=period,
+        periods=PERIODS,
+        form=g.csrf_form,
+        curr_url=f'/messages/trending?period={period}'
+    )
+
+
+##############################################################################
+# Admin pages
+
+ACTIVITY_PERIODS = {"hour": 48, "day": 30}
+
+
+@bp.get('/admin/activity')
+def show_activity():
+    """Show hourly or daily activity counts, for admins only."""
+
+    if not g.user or g.user.id not in current_app.config["ADMIN_USER_IDS"]:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+
+    granularity = request.args.get('granularity', 'day')
+    if granularity not in ACTIVITY_PERIODS:
+        granularity = 'day'
+
+    return render_template(
+        'admin/activity.html',
+        rows=activity_table(granularity, ACTIVITY_PERIODS[granularity]),
+        granularity=granularity,
+        granularities=ACTIVITY_PERIODS,
+        metrics=METRICS,
+        form=g.csrf_form)
+
+
 ##############################################################################
 # Homepage and error pages
 
 
-@app.get('/')
+@bp.get('/')
+@read_only
 def homepage():
     """Show homepage:
 
@@ -518,14 +901,16 @@ def homepage():
     """
 
     if g.user:
-        user_ids_to_include = [user.id for user in g.user.following]
-        user_ids_to_include.append(g.user.id)
+        message_ids = get_timelines().message_ids(g.user)
 
         messages = (Message
                     .query
-                    .filter(Message.user_id.in_(user_ids_to_include))
+                    .options(selectinload(Message.user),
+                             selectinload(Message.likes))
+                    .join(Message.user)
+                    .filter(Message.id.in_(message_ids),
+                            User.deleted_at.is_(None))
                     .order_by(Message.timestamp.desc())
-                    .limit(100)
                     .all())
 
         return render_template('home.html', messages=messages, form=g.csrf_form)
@@ -541,7 +926,7 @@ def homepage():
 #
 # https://stackoverflow.com/questions/34066804/disabling-caching-in-flask
 
-@app.after_request
+@bp.after_app_request
 def add_header(response):
     """Add non-caching headers on every request."""
 
@@ -0,0 +1,475 @@
+"""Monthly message partitions, and archiving old ones to disk.
+
+On PostgreSQL `messages` is partitioned by month on `timestamp`, into
+tables named messages_pYYYYMM, plus messages_default for anything without
+a partition of its own. Create the coming months' partitions ahead of time
+(rows already in messages_default are moved into their month's partition):
+
+    flask messages create-partitions [--ahead 3]
+
+Partitions older than MESSAGES_HOT_MONTHS are archived, and dropped, with
+
+    flask messages archive
+
+so the tables and indexes queries use stay the size of recent months.
+
+A partition is detached from `messages` before it's archived, so that
+dropping it doesn't lock `messages`; its messages can't be shown from then
+until its archive is written. Postgres only detaches CONCURRENTLY when
+there's no default partition; otherwise the detach takes `messages`' ACCESS
+EXCLUSIVE lock for a moment, waiting at most MESSAGES_DETACH_LOCK_TIMEOUT
+milliseconds (rather than queueing every query behind a long one) and
+trying again up to MESSAGES_DETACH_ATTEMPTS times. A partition an
+interrupted run left detached is archived by the next one.
+
+A partition is archived to two files in MESSAGES_ARCHIVE_DIR: its messages,
+as NDJSON in order of id, compressed a block of MESSAGES_ARCHIVE_BLOCK_SIZE
+lines at a time, and a JSON index of the blocks' first ids and offsets.
+`MessageArchive.get` finds a message by id from the indexes and reads a
+single block; `show_message` falls back to it for messages no longer in the
+database. Archived messages keep the ids of the users who liked them, but
+can't be liked, unliked or deleted.
+"""
+
+import json
+import os
+import re
+import time
+import zlib
+from bisect import bisect_right
+from datetime import date, datetime
+
+import click
+from flask import current_app
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+from export import to_json
+from models import db, User
+
+DEFAULT_CONFIG = {
+    "MESSAGES_HOT_MONTHS": 12,
+    "MESSAGES_PARTITIONS_AHEAD": 3,
+    "MESSAGES_ARCHIVE_DIR": None,  # instance/archive
+    "MESSAGES_ARCHIVE_BLOCK_SIZE": 1000,
+    "MESSAGES_DETACH_LOCK_TIMEOUT": 1000,
+    "MESSAGES_DETACH_ATTEMPTS": 10,
+}
+
+DEFAULT_PARTITION = "messages_default"
+PARTITION_NAME = re.compile(r"^messages_p(\d{4})(\d{2})$")
+
+# lock_not_available, from lock_timeout
+LOCK_NOT_AVAILABLE = "55P03"
+
+
+def add_months(month, n):
+    """The first of the month `n` months after `month`'s."""
+
+    months = month.year * 12 + month.month - 1 + n
+    return date(months // 12, months % 12 + 1, 1)
+
+
+def partition_name(month):
+    return f"messages_p{month:%Y%m}"
+
+
+def partitions():
+    """Return {month: partition name} for the messages partitions."""
+
+    return by_month(db.session.scalars(text("""
+        SELECT c.relname
+        FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'messages'::regclass
+    """)))
+
+
+def detached_partitions():
+    """Return {month: table name} for partitions detached from messages
+    but not yet dropped."""
+
+    return by_month(db.session.scalars(text("""
+        SELECT c.relname
+        FROM pg_class c
+        WHERE c.relkind = 'r'
+          AND c.relnamespace = current_schema()::regnamespace
+          AND c.relname LIKE 'messages\\_p%'
+          AND NOT EXISTS (SELECT 1 FROM pg_inherits i
+                          WHERE i.inhrelid = c.oid)
+    """)))
+
+
+def by_month(names):
+    """Return {month: name} for the partition names among `names`."""
+
+    found = {}
+    for name in names:
+        match = PARTITION_NAME.match(name)
+        if match:
+            found[date(int(match[1]), int(match[2]), 1)] = name
+    return found
+
+
+def create_partition(month):
+    """Create `month`'s partition, moving its rows out of the default one.
+
+    Returns the number of rows moved. Doesn't commit.
+    """
+
+    name = partition_name(month)
+    bounds = (f"FROM ('{month:%Y-%m-%d}') "
+              f"TO ('{add_months(month, 1):%Y-%m-%d}')")
+    in_month = {"start": month, "end": add_months(month, 1)}
+
+    has_rows = db.session.scalar(text(f"""
+        SELECT EXISTS (
+            SELECT 1 FROM {DEFAULT_PARTITION}
+            WHERE timestamp >= :start AND timestamp < :end)
+    """), in_month)
+
+    if not has_rows:
+        db.session.execute(text(
+            f"CREATE TABLE {name} PARTITION OF messages FOR VALUES {bounds}"))
+        return 0
+
+    # the new partition can't overlap rows in the default one, so take it
+    # out while the rows move (the delete trigger sees they still exist)
+    db.session.execute(text(
+        f"ALTER TABLE messages DETACH PARTITION {DEFAULT_PARTITION}"))
+    db.session.execute(text(
+        f"CREATE TABLE {name} PARTITION OF messages FOR VALUES {bounds}"))
+    moved = db.session.execute(text(f"""
+        WITH moved AS (
+            DELETE FROM {DEFAULT_PARTITION}
+            WHERE timestamp >= :start AND timestamp < :end
+            RETURNING *)
+        INSERT INTO messages SELECT * FROM moved
+    """), in_month).rowcount
+    db.session.execute(text(
+        f"ALTER TABLE messages ATTACH PARTITION {DEFAULT_PARTITION} DEFAULT"))
+    return moved
+
+
+def create_partitions(today=None, ahead=None):
+    """Create partitions for this month, the next `ahead`, and any month
+    with rows in the default partition.
+
+    Returns {partition name: rows moved into it}.
+    """
+
+    config = current_app.config
+    this_month = (today or date.today()).replace(day=1)
+    if ahead is None:
+        ahead = config["MESSAGES_PARTITIONS_AHEAD"]
+
+    months = {add_months(this_month, n) for n in range(ahead + 1)}
+    months.update(
+        month.date() for month in db.session.scalars(text(f"""
+            SELECT DISTINCT date_trunc('month', timestamp)
+            FROM {DEFAULT_PARTITION}
+        """)))
+
+    created = {}
+    existing = partitions()
+    for month in sorted(months - set(existing)):
+        created[partition_name(month)] = create_partition(month)
+        db.session.commit()
+    return created
+
+
+def write_blocks(rows, path, block_size):
+    """Write `rows`, dicts in order of id, to `path` in compressed blocks.
+
+    Returns the blocks' [first id, offset, length]s.
+    """
+
+    blocks = []
+
+    def write_block(f, block):
+        data = zlib.compress("".join(
+            json.dumps(row, default=to_json) + "\n" for row in block
+        ).encode())
+        blocks.append([block[0]["id"], f.tell(), len(data)])
+        f.write(data)
+
+    with open(path, "wb") as f:
+        block = []
+        for row in rows:
+            block.append(row)
+            if len(block) == block_size:
+                write_block(f, block)
+                block = []
+        if block:
+            write_block(f, block)
+
+        f.flush()
+        os.fsync(f.fileno())
+
+    return blocks
+
+
+def read_block(path, offset, length):
+    """Return the records in the block at `offset` in `path`."""
+
+    with open(path, "rb") as f:
+        f.seek(offset)
+        data = zlib.decompress(f.read(length))
+    return [json.loads(line) for line in data.decode().splitlines()]
+
+
+def detach_partition(name, lock_timeout, attempts):
+    """Detach partition `name` from messages, and commit.
+
+    Detaches CONCURRENTLY if messages has no default partition, or else
+    takes messages' lock for at most `lock_timeout` milliseconds, up to
+    `attempts` times. Finishes a concurrent detach that was interrupted.
+    """
+
+    pending = db.session.scalar(text("""
+        SELECT i.inhdetachpending
+        FROM pg_inherits i
+        WHERE i.inhrelid = to_regclass(:name)
+          AND i.inhparent = 'messages'::regclass
+    """), {"name": name})
+    if pending is None:
+        return
+
+    has_default = db.session.scalar(text(
+        "SELECT to_regclass(:name) IS NOT NULL"),
+        {"name": DEFAULT_PARTITION})
+    db.session.commit()
+
+    if pending or not has_default:
+        # neither can run in a transaction
+        how = "FINALIZE" if pending else "CONCURRENTLY"
+        with db.engine.connect().execution_options(
+                isolation_level="AUTOCOMMIT") as conn:
+            conn.execute(text(
+                f"ALTER TABLE messages DETACH PARTITION {name} {how}"))
+        return
+
+    for attempt in range(1, attempts + 1):
+        try:
+            db.session.execute(text(
+                f"SET LOCAL lock_timeout = {int(lock_timeout)}"))
+            db.session.execute(text(
+                f"ALTER TABLE messages DETACH PARTITION {name}"))
+            db.session.commit()
+            return
+        except OperationalError as err:
+            db.session.rollback()
+            if (getattr(err.orig, "pgcode", None) != LOCK_NOT_AVAILABLE
+                    or attempt == attempts):
+                raise
+            time.sleep(lock_timeout / 1000)
+
+
+def archive_partition(month, directory, block_size,
+                      lock_timeout=1000, attempts=10):
+    """Detach `month`'s partition, archive it to `directory`, then drop
+    it.
+
+    Returns the number of messages archived.
+    """
+
+    name = partition_name(month)
+    os.makedirs(directory, exist_ok=True)
+
+    # once detached, nothing writes to it, and dropping it doesn't lock
+    # messages
+    detach_partition(name, lock_timeout, attempts)
+
+    count = db.session.scalar(text(f"SELECT count(*) FROM {name}"))
+
+    rows = db.session.execute(text(f"""
+        SELECT m.id, m.user_id, m.text, m.timestamp,
+               array_remove(array_agg(l.user_id ORDER BY l.user_id), NULL)
+                   AS liked_by
+        FROM {name} m LEFT JOIN likes l ON l.message_id = m.id
+        GROUP BY m.id, m.user_id, m.text, m.timestamp
+        ORDER BY m.id
+    """), execution_options={"yield_per": block_size})
+
+    # an earlier archive of the month (say, of imported messages) stays
+    stamp = f"{datetime.utcnow():%Y%m%d%H%M%S}"
+    base = os.path.join(directory, f"{name}.{stamp}")
+    blocks = write_blocks(
+        (dict(row) for row in rows.mappings()),
+        base + ".ndjson.z.tmp",
+        block_size)
+
+    archived = sum(len(read_block(base + ".ndjson.z.tmp", offset, length))
+                   for _, offset, length in blocks)
+    if archived != count:
+        os.remove(base + ".ndjson.z.tmp")
+        raise RuntimeError(
+            f"Archived {archived} of {name}'s {count} messages.")
+
+    os.replace(base + ".ndjson.z.tmp", base + ".ndjson.z")
+    with open(base + ".json.tmp", "w") as f:
+        json.dump({
+            "partition": name,
+            "count": count,
+            "min_id": blocks[0][0] if blocks else None,
+            "max_id": db.session.scalar(text(f"SELECT max(id) FROM {name}")),
+            "blocks": blocks,
+        }, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(base + ".json.tmp", base + ".json")
+
+    # neither detaching nor dropping the partition fires the delete trigger
+    for table in ("likes", "like_buckets", "trending_counts"):
+        db.session.execute(text(
+            f"DELETE FROM {table} "
+            f"WHERE message_id IN (SELECT id FROM {name})"))
+    db.session.execute(text(f"DROP TABLE {name}"))
+    db.session.commit()
+
+    return count
+
+
+def archive_partitions(today=None, hot_months=None):
+    """Archive partitions more than `hot_months` before this month's.
+
+    Returns {partition name: messages archived}.
+    """
+
+    config = current_app.config
+    this_month = (today or date.today()).replace(day=1)
+    if hot_months is None:
+        hot_months = config["MESSAGES_HOT_MONTHS"]
+    cutoff = add_months(this_month, -hot_months)
+
+    # including any an interrupted run left detached
+    old = {**detached_partitions(), **partitions()}
+
+    archived = {}
+    for month, name in sorted(old.items()):
+        if month < cutoff:
+            archived[name] = archive_partition(
+                month,
+                config["MESSAGES_ARCHIVE_DIR"],
+                config["MESSAGES_ARCHIVE_BLOCK_SIZE"],
+                config["MESSAGES_DETACH_LOCK_TIMEOUT"],
+                config["MESSAGES_DETACH_ATTEMPTS"])
+    return archived
+
+
+class ArchivedMessage:
+    """A message read back from the archive, for display only."""
+
+    archived = True
+
+    def __init__(self, record):
+        self.id = record["id"]
+        self.user_id = record["user_id"]
+        self.text = record["text"]
+        self.timestamp = datetime.fromisoformat(record["timestamp"])
+        # ids of the users who liked it
+        self.likes = record["liked_by"]
+
+    @property
+    def user(self):
+        return db.session.get(User, self.user_id)
+
+
+class MessageArchive:
+    """Archived messages in `directory`, by id."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._indexes = {}
+
+    def _load_indexes(self):
+        try:
+            names = {name for name in os.listdir(self.directory)
+                     if name.endswith(".json")}
+        except FileNotFoundError:
+            names = set()
+
+        for name in names - set(self._indexes):
+            with open(os.path.join(self.directory, name)) as f:
+                index = json.load(f)
+            index["first_ids"] = [block[0] for block in index["blocks"]]
+            self._indexes[name] = index
+
+        for name in set(self._indexes) - names:
+            del self._indexes[name]
+
+        return self._indexes
+
+    def get(self, message_id):
+        """Return the archived message with `message_id`, or None."""
+
+        for name, index in self._load_indexes().items():
+            if not index["count"] or not (
+                    index["min_id"] <= message_id <= index["max_id"]):
+                continue
+
+            block = bisect_right(index["first_ids"], message_id) - 1
+            _, offset, length = index["blocks"][block]
+            path = os.path.join(
+                self.directory, name.removesuffix(".json") + ".ndjson.z")
+
+            for record in read_block(path, offset, length):
+                if record["id"] == message_id:
+                    return ArchivedMessage(record)
+
+        return None
+
+
+def get_archive():
+    """Return the current app's MessageArchive."""
+
+    return current_app.extensions["archive"]
+
+
+def init_archive(app):
+    """Set up `app`'s message archive and partitioning CLI."""
+
+    for key, value in DEFAULT_CONFIG.items():
+        app.config.setdefault(key, value)
+
+    if app.config["MESSAGES_ARCHIVE_DIR"] is None:
+        app.config["MESSAGES_ARCHIVE_DIR"] = os.path.join(
+            app.instance_path, "archive")
+
+    app.extensions["archive"] = MessageArchive(
+        app.config["MESSAGES_ARCHIVE_DIR"])
+
+    @app.cli.group("messages")
+    def messages_cli():
+        """Message partitioning and archiving commands."""
+
+        if db.engine.dialect.name != "postgresql":
+            raise click.UsageError("Messages are only partitioned on "
+                                   "PostgreSQL.")
+
+    @messages_cli.command("partitions")
+    def partitions_command():
+        """List the partitions, with their row counts."""
+
+        for name in [*sorted(partitions().values()), DEFAULT_PARTITION]:
+            count = db.session.scalar(text(f"SELECT count(*) FROM {name}"))
+            click.echo(f"{name}: {count} rows")
+
+    @messages_cli.command("create-partitions")
+    @click.option("--ahead", type=int, default=None,
+                  help="Months ahead of this one "
+                       "(default MESSAGES_PARTITIONS_AHEAD).")
+    def create_partitions_command(ahead):
+        """Create partitions for the coming months."""
+
+        for name, moved in create_partitions(ahead=ahead).items():
+            click.echo(f"{name}: created, {moved} rows moved in")
+
+    @messages_cli.command("archive")
+    @click.option("--hot-months", type=int, default=None,
+                  help="Months kept in the database "
+                       "(default MESSAGES_HOT_MONTHS).")
+    def archive_command(hot_months):
+        """Archive and drop old partitions."""
+
+        for name, count in archive_partitions(hot_months=hot_months).items():
+            click.echo(f"{name}: {count} messages archived")
@@ -0,0 +1,309 @@
+"""Async serving mode for Warbler.
+
+Run with an ASGI server, e.g.:
+
+    uvicorn --factory asgi:create_asgi_app --workers 4
+
+GET/HEAD requests for views marked `@read_only` (the homepage, profile,
+following, followers, likes and message pages) are served with an async
+SQLAlchemy engine (asyncpg). Each one runs the normal Flask view in a thread,
+with `db.session` bound to a session on that engine, whose queries are
+awaited on the event loop (see `run_with_loop`). So only the queries run on
+the loop: rendering, cache lookups and the like don't hold up other
+connections, and while a view waits on PostgreSQL its thread just waits.
+
+GET /messages/stream is the live timeline's Server-Sent Events stream (see
+live.py), served on the event loop for as long as the client stays.
+
+Everything else is handed to the regular WSGI app in a thread pool.
+
+The async engine uses ASYNC_DATABASE_URI if set (e.g. to point it at a read
+replica), otherwise SQLALCHEMY_DATABASE_URI with an async driver, and the
+same pool settings as the sync engine.
+"""
+
+import asyncio
+import io
+import sys
+
+from asgiref.wsgi import WsgiToAsgi
+from greenlet import getcurrent
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.util._concurrency_py3k import _AsyncIoGreenlet
+from werkzeug.exceptions import HTTPException
+
+from app import create_app, get_logged_in_user
+from live import CLOSE, HEARTBEAT, RESET, get_hub
+from models import db
+
+STREAM_PATH = "/messages/stream"
+
+ASYNC_DRIVERS = {
+    "postgresql": "postgresql+asyncpg",
+    "sqlite": "sqlite+aiosqlite",
+}
+
+
+def async_database_uri(config):
+    """Return the URL for the async engine, using an async driver."""
+
+    if config.get("ASYNC_DATABASE_URI"):
+        return config["ASYNC_DATABASE_URI"]
+
+    url = make_url(config["SQLALCHEMY_DATABASE_URI"])
+    return url.set(drivername=ASYNC_DRIVERS[url.get_backend_name()])
+
+
+def async_engine_options(config):
+    """Return the sync engine's options, adapted for the async driver."""
+
+    options = dict(config.get("SQLALCHEMY_ENGINE_OPTIONS", {}))
+    options.pop("connect_args", None)
+
+    timeout = config.get("DB_STATEMENT_TIMEOUT")
+    if timeout and not config.get("DB_PGBOUNCER"):
+        options["connect_args"] = {
+            "server_settings": {"statement_timeout": str(timeout)}}
+
+    return options
+
+
+def build_environ(scope, body=b""):
+    """Build a WSGI environ for an ASGI HTTP `scope`."""
+
+    server = scope.get("server") or ("localhost", 80)
+    client = scope.get("client") or ("", 0)
+
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode().decode("latin-1"),
+        "PATH_INFO": scope["path"].encode().decode("latin-1"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "REMOTE_ADDR": client[0],
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+
+    for name, value in scope.get("headers", []):
+        name = name.decode("latin-1").upper().replace("-", "_")
+        value = value.decode("latin-1")
+
+        if name not in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+            name = f"HTTP_{name}"
+
+        if name in environ:
+            value = f"{environ[name]},{value}"
+        environ[name] = value
+
+    return environ
+
+
+async def _await(awaitable):
+    return await awaitable
+
+
+def run_with_loop(loop, fn, *args):
+    """Call `fn` on this thread, awaiting its queries on `loop`.
+
+    Like SQLAlchemy's `greenlet_spawn`, `fn` runs in a greenlet that hands
+    each await of the async driver's back to its caller; here that's a
+    thread other than the event loop's, which has `loop` run the await and
+    waits for it.
+    """
+
+    context = _AsyncIoGreenlet(fn, getcurrent())
+    try:
+        result = context.switch(*args)
+        while not context.dead:
+            try:
+                value = asyncio.run_coroutine_threadsafe(
+                    _await(result), loop).result()
+            except BaseException:
+                result = context.throw(*sys.exc_info())
+            else:
+                result = context.switch(value)
+        return result
+    finally:
+        del context.driver
+
+
+class AsyncReadApp:
+    """ASGI app serving read-only views on an async engine."""
+
+    def __init__(self, app):
+        self.app = app
+        self.wsgi = WsgiToAsgi(app)
+        self.engine = create_async_engine(
+            async_database_uri(app.config),
+            **async_engine_options(app.config))
+
+        with app.app_context():
+            self.hub = get_hub()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self.lifespan(receive, send)
+            return
+
+        if scope["type"] == "http" and scope["method"] in ("GET", "HEAD"):
+            environ = build_environ(scope)
+            if scope["path"] == STREAM_PATH:
+                await self.stream(environ, receive, send)
+                return
+            if self.is_async_view(environ):
+                await self.handle(environ, send)
+                return
+
+        await self.wsgi(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                self.hub.start()
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await self.hub.stop()
+                await self.engine.dispose()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    def is_async_view(self, environ):
+        """Does this request go to a view that can be served async?"""
+
+        adapter = self.app.url_map.bind_to_environ(environ)
+        try:
+            endpoint, _ = adapter.match()
+        except HTTPException:
+            return False
+
+        view = self.app.view_functions.get(endpoint)
+        return getattr(view, "read_only", False)
+
+    async def handle(self, environ, send):
+        """Run the Flask view in a thread, with db.session bound to an async
+        session.
+        """
+
+        loop = asyncio.get_running_loop()
+        async with AsyncSession(self.engine) as db_session:
+            response, body = await asyncio.to_thread(
+                self.respond, environ, db_session.sync_session, loop)
+
+        await send({
+            "type": "http.response.start",
+            "status": response.status_code,
+            "headers": [
+                (name.lower().encode("latin-1"), value.encode("latin-1"))
+                for name, value in response.headers.items()
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
+        response.close()
+
+    async def stream(self, environ, receive, send):
+        """Send the logged in user new message ids as Server-Sent Events."""
+
+        user_id = await asyncio.to_thread(self.stream_user_id, environ)
+        if user_id is None:
+            await send({"type": "http.response.start", "status": 401,
+                        "headers": [(b"content-length", b"0")]})
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        self.hub.start()
+        sub = self.hub.subscribe(user_id)
+
+        async def watch_disconnect():
+            while (await receive())["type"] != "http.disconnect":
+                pass
+            sub.force(CLOSE)
+
+        watcher = asyncio.create_task(watch_disconnect())
+        try:
+            await send({
+                "type": "http.response.start",
+                "status": 200,
+                "headers": [
+                    (b"content-type", b"text/event-stream"),
+                    (b"cache-control", b"no-store"),
+                    (b"x-accel-buffering", b"no"),
+                ],
+            })
+            await self.send_event(send, b"retry: 5000\n\n")
+
+            while True:
+                event = await sub.queue.get()
+                if event == CLOSE:
+                    break
+                elif event == HEARTBEAT:
+                    await self.send_event(send, b": heartbeat\n\n")
+                elif event == RESET:
+                    await self.send_event(send, b"event: reset\ndata:\n\n")
+                else:
+                    await self.send_event(
+                        send, f"id: {event}\ndata: {event}\n\n".encode())
+
+            await send({"type": "http.response.body", "body": b""})
+        finally:
+            watcher.cancel()
+            self.hub.unsubscribe(sub)
+
+    async def send_event(self, send, event):
+        await send({
+            "type": "http.response.body",
+            "body": event,
+            "more_body": True,
+        })
+
+    def stream_user_id(self, environ):
+        """Return the id of the request's logged in, active user, or None."""
+
+        with self.app.request_context(environ):
+            user = get_logged_in_user()
+            return user.id if user else None
+
+    def respond(self, environ, sync_session, loop):
+        """Return the response to `environ`, and its body.
+
+        Runs in a thread; the view's queries are run on `loop`.
+        """
+
+        # a fresh app context per request gives each its own db.session
+        with self.app.app_context(), self.app.request_context(environ):
+            db.session.registry.set(sync_session)
+            try:
+                response = run_with_loop(loop, self.dispatch)
+            finally:
+                db.session.registry.clear()
+
+        if environ["REQUEST_METHOD"] == "HEAD":
+            return response, b""
+        return response, response.get_data()
+
+    def dispatch(self):
+        """Dispatch the current request, as `Flask.wsgi_app` would.
+
+        This runs in a greenlet (see `run_with_loop`), so the view's queries
+        can wait on the async engine.
+        """
+
+        try:
+            return self.app.full_dispatch_request()
+        except Exception as e:
+            return self.app.handle_exception(e)
+
+
+def create_asgi_app(config=None):
+    """Create a Warbler app and wrap it for async serving."""
+
+    return AsyncReadApp(create_app(config))
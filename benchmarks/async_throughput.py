@@ -0,0 +1,149 @@
+"""Compare homepage throughput of the sync and async serving modes.
+
+Run from the top level directory against a seeded database:
+
+    python benchmarks/async_throughput.py [--requests 2000] [--concurrency 500]
+                                          [--threads 4] [--latency-ms 20]
+
+Both modes serve the same logged-in homepage in-process (no HTTP server, so
+only the app is measured). The sync mode uses a pool of `--threads` threads,
+like `gunicorn --threads 4`; the async mode keeps up to `--concurrency`
+requests in flight on one event loop.
+
+Local PostgreSQL answers far faster than a production database, so each
+request also runs `SELECT pg_sleep(latency)` to stand in for network and
+query time.
+"""
+
+import argparse
+import asyncio
+import os
+import resource
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import text
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import CURR_USER_KEY  # noqa: E402
+from asgi import create_asgi_app  # noqa: E402
+from models import db, User  # noqa: E402
+
+
+def add_latency(app, seconds):
+    """Make every request wait `seconds` on the database."""
+
+    @app.before_request
+    def simulated_latency():
+        db.session.execute(text("SELECT pg_sleep(:s)"), {"s": seconds})
+
+
+def session_cookie(app, user_id):
+    """Return a signed session cookie value logging in `user_id`."""
+
+    serializer = app.session_interface.get_signing_serializer(app)
+    return serializer.dumps({CURR_USER_KEY: user_id})
+
+
+def run_sync(app, cookie, requests, threads):
+    local = threading.local()
+
+    def one(_):
+        if not hasattr(local, "client"):
+            local.client = app.test_client()
+            local.client.set_cookie(
+                app.config["SESSION_COOKIE_NAME"], cookie, domain="localhost")
+
+        resp = local.client.get("/")
+        assert b"Log Out" in resp.data, resp.status_code
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(threads) as pool:
+        list(pool.map(one, range(requests)))
+    return time.perf_counter() - start
+
+
+async def run_async(asgi_app, cookie, requests, concurrency):
+    app = asgi_app.app
+    scope = {
+        "type": "http",
+        "method": "GET",
+        "path": "/",
+        "query_string": b"",
+        "headers": [
+            (b"host", b"localhost"),
+            (b"cookie", f"{app.config['SESSION_COOKIE_NAME']}={cookie}".encode()),
+        ],
+        "http_version": "1.1",
+        "scheme": "http",
+        "server": ("localhost", 80),
+    }
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def one():
+        body = []
+
+        async def send(message):
+            if message["type"] == "http.response.body":
+                body.append(message["body"])
+
+        async with semaphore:
+            await asgi_app(scope, receive, send)
+        assert b"Log Out" in b"".join(body)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[one() for _ in range(requests)])
+    elapsed = time.perf_counter() - start
+
+    await asgi_app.engine.dispose()
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=500)
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--latency-ms", type=float, default=20)
+    args = parser.parse_args()
+
+    config = {
+        # let the async engine hold more connections than 4 threads need
+        "DB_POOL_SIZE": max(args.threads, 20),
+        "DB_MAX_OVERFLOW": 20,
+    }
+
+    asgi_app = create_asgi_app(config)
+    app = asgi_app.app
+    add_latency(app, args.latency_ms / 1000)
+
+    with app.app_context():
+        user_id = db.session.scalar(
+            db.select(User.id).order_by(User.id).limit(1))
+    cookie = session_cookie(app, user_id)
+
+    sync_time = run_sync(app, cookie, args.requests, args.threads)
+    sync_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    async_time = asyncio.run(
+        run_async(asgi_app, cookie, args.requests, args.concurrency))
+    async_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    print(f"{args.requests} homepage requests, "
+          f"{args.latency_ms:g}ms simulated db latency")
+    print(f"sync  ({args.threads} threads):   "
+          f"{args.requests / sync_time:8.1f} req/s  "
+          f"max rss {sync_rss / 1024:.0f} MB")
+    print(f"async ({args.concurrency} in flight): "
+          f"{args.requests / async_time:8.1f} req/s  "
+          f"max rss {async_rss / 1024:.0f} MB")
+
+
+if __name__ == "__main__":
+    main()
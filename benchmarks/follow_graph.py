@@ -0,0 +1,78 @@
+"""Measure the in-memory follow graph on a generated graph.
+
+Run from the top level directory:
+
+    python benchmarks/follow_graph.py [--users 100000] [--follows 1000000]
+
+No database is needed: follows are generated with a skewed (power law)
+choice of who gets followed, like a real social graph.
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+from array import array
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from graph import FollowGraph  # noqa: E402
+
+
+def generate(users, follows, seed=0):
+    """Return parallel arrays of follower and followed ids."""
+
+    rng = random.Random(seed)
+    edges = set()
+    while len(edges) < follows:
+        follower = rng.randrange(users)
+        followed = min(int(rng.paretovariate(1.2)) - 1, users - 1)
+        if follower != followed:
+            edges.add((follower, followed))
+
+    followers = array("i", (f for f, _ in edges))
+    followed_users = array("i", (f for _, f in edges))
+    return followers, followed_users
+
+
+def per_call(fn, args):
+    start = time.perf_counter()
+    for a in args:
+        fn(*a)
+    return (time.perf_counter() - start) / len(args) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=100000)
+    parser.add_argument("--follows", type=int, default=1000000)
+    args = parser.parse_args()
+
+    followers, followed_users = generate(args.users, args.follows)
+
+    start = time.perf_counter()
+    graph = FollowGraph(followers, followed_users)
+    build = time.perf_counter() - start
+
+    rng = random.Random(1)
+    pairs = [(rng.randrange(args.users), rng.randrange(args.users))
+             for _ in range(100000)]
+    ids = [(u,) for u, _ in pairs]
+
+    print(f"{args.follows} follows between {args.users} users")
+    print(f"build:            {build:.2f}s")
+    print(f"memory:           {graph.nbytes / 1024 / 1024:.1f} MB")
+    print(f"is_following:     {per_call(graph.is_following, pairs):.2f}us")
+    print(f"following_count:  {per_call(graph.following_count, ids):.2f}us")
+    print(f"following_ids:    {per_call(graph.following_ids, ids):.2f}us")
+
+    for u, v in pairs[:10000]:
+        graph.set_follow(u, v, True)
+    print("with 10000 changes pending:")
+    print(f"is_following:     {per_call(graph.is_following, pairs):.2f}us")
+    print(f"following_ids:    {per_call(graph.following_ids, ids):.2f}us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""Measure the cost of idle live timeline streams.
+
+Run from the top level directory against a seeded database:
+
+    python benchmarks/idle_streams.py [--connections 20000]
+
+Opens `--connections` /messages/stream requests in-process (no HTTP server,
+so only the app is measured), all for the first user, then reports the
+memory they hold and how long one new message takes to reach all of them.
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import CURR_USER_KEY  # noqa: E402
+from asgi import create_asgi_app  # noqa: E402
+from models import db, User  # noqa: E402
+
+
+async def run(asgi_app, user_id, cookie, connections):
+    app = asgi_app.app
+    hub = asgi_app.hub
+    scope = {
+        "type": "http",
+        "method": "GET",
+        "path": "/messages/stream",
+        "query_string": b"",
+        "headers": [
+            (b"host", b"localhost"),
+            (b"cookie", f"{app.config['SESSION_COOKIE_NAME']}={cookie}".encode()),
+        ],
+        "http_version": "1.1",
+        "scheme": "http",
+        "server": ("localhost", 80),
+    }
+    disconnected = asyncio.Event()
+    received = 0
+    all_received = asyncio.Event()
+
+    async def receive():
+        await disconnected.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        nonlocal received
+        if message.get("body", b"").startswith(b"id:"):
+            received += 1
+            if received == connections:
+                all_received.set()
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+
+    tasks = [asyncio.create_task(asgi_app(scope, receive, send))
+             for _ in range(connections)]
+    while len(hub.subscriptions.get(user_id, ())) < connections:
+        await asyncio.sleep(0.1)
+
+    held = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+
+    start = time.perf_counter()
+    hub.publish(1, user_id)
+    await all_received.wait()
+    fan_out = time.perf_counter() - start
+
+    disconnected.set()
+    await asyncio.gather(*tasks)
+    await hub.stop()
+    await asgi_app.engine.dispose()
+
+    return held, fan_out
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--connections", type=int, default=20000)
+    args = parser.parse_args()
+
+    asgi_app = create_asgi_app({"LIVE_BUS": "local"})
+    app = asgi_app.app
+
+    with app.app_context():
+        user_id = db.session.scalar(
+            db.select(User.id).order_by(User.id).limit(1))
+
+    serializer = app.session_interface.get_signing_serializer(app)
+    cookie = serializer.dumps({CURR_USER_KEY: user_id})
+
+    held, fan_out = asyncio.run(
+        run(asgi_app, user_id, cookie, args.connections))
+
+    print(f"{args.connections} idle streams")
+    print(f"memory:  {held / 1024 / 1024:.1f} MB "
+          f"({held / args.connections / 1024:.1f} KB each)")
+    print(f"fan-out: {fan_out * 1000:.0f} ms to reach every stream")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""Measure Warbler's startup time.
+
+Run from the top level directory:
+
+    python benchmarks/startup.py [runs]
+
+Each run uses a fresh interpreter and reports:
+
+- import: `import app` (should do no real work)
+- create_app: building and configuring the app
+- first request: serving /login, which touches no database
+- fork: time for a forked child (like a gunicorn worker under --preload)
+  to serve its first request, with the app created in the parent
+"""
+
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+RUN_ONCE = r"""
+import json, os, time
+
+t0 = time.perf_counter()
+import app as warbler
+t1 = time.perf_counter()
+app = warbler.create_app({"TESTING": True})
+t2 = time.perf_counter()
+app.test_client().get("/login")
+t3 = time.perf_counter()
+
+r, w = os.pipe()
+t4 = time.perf_counter()
+pid = os.fork()
+if pid == 0:
+    app.test_client().get("/login")
+    os.write(w, b"x")
+    os._exit(0)
+os.read(r, 1)
+t5 = time.perf_counter()
+os.waitpid(pid, 0)
+
+print(json.dumps({
+    "import": t1 - t0,
+    "create_app": t2 - t1,
+    "first request": t3 - t2,
+    "fork": t5 - t4,
+}))
+"""
+
+
+def main(runs=10):
+    env = {
+        "DATABASE_URL": "postgresql:///warbler",
+        "SECRET_KEY": "benchmark",
+        **os.environ,
+    }
+
+    results = []
+    for _ in range(runs):
+        out = subprocess.run(
+            [sys.executable, "-c", RUN_ONCE],
+            cwd=ROOT, env=env, check=True, capture_output=True, text=True)
+        results.append(json.loads(out.stdout))
+
+    print(f"{'phase':<15} {'median ms':>10} {'max ms':>10}")
+    for phase in results[0]:
+        times = [r[phase] * 1000 for r in results]
+        print(f"{phase:<15} {statistics.median(times):>10.1f} "
+              f"{max(times):>10.1f}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10)
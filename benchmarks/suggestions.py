@@ -0,0 +1,98 @@
+"""Time the follow suggestions job on a generated graph.
+
+Run from the top level directory, against a scratch PostgreSQL database
+(its tables are dropped and recreated):
+
+    DATABASE_URL=postgresql:///warbler_bench \
+        python benchmarks/suggestions.py [--users 100000] [--follows 1000000]
+
+Times a full run, then an incremental run after `--changes` new follows.
+"""
+
+import argparse
+import io
+import os
+import random
+import sys
+import time
+
+from sqlalchemy import text
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app  # noqa: E402
+from follow_graph import generate  # noqa: E402
+from models import db, Follows  # noqa: E402
+from suggestions import run  # noqa: E402
+
+
+def load(users, followers, followed_users):
+    """Fill users and follows, user ids starting from 1."""
+
+    db.session.execute(text(
+        "INSERT INTO users (id, email, username, password) "
+        "SELECT i, 'u' || i || '@email.com', 'u' || i, 'x' "
+        "FROM generate_series(1, :n) AS i"), {"n": users})
+
+    data = io.StringIO("".join(
+        f"{follower + 1}\t{followed + 1}\n"
+        for follower, followed in zip(followers, followed_users)))
+
+    cursor = db.session.connection().connection.cursor()
+    cursor.copy_expert(
+        "COPY follows (user_following_id, user_being_followed_id) "
+        "FROM STDIN", data)
+
+    db.session.commit()
+    db.session.execute(text("ANALYZE"))
+
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=100000)
+    parser.add_argument("--follows", type=int, default=1000000)
+    parser.add_argument("--changes", type=int, default=1000)
+    args = parser.parse_args()
+
+    app = create_app({"SUGGESTIONS_SETTLE_SECONDS": 0})
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+
+        followers, followed_users = generate(args.users, args.follows)
+        _, elapsed = timed(load, args.users, followers, followed_users)
+        print(f"loaded {args.follows} follows between {args.users} users "
+              f"in {elapsed:.1f}s")
+
+        (users, written), elapsed = timed(run, app, full=True)
+        print(f"full run:        {users} users, {written} suggestions, "
+              f"{elapsed:.1f}s")
+
+        rng = random.Random(2)
+        new = set()
+        existing = set(zip(followers, followed_users))
+        while len(new) < args.changes:
+            edge = (rng.randrange(args.users), rng.randrange(args.users))
+            if edge[0] != edge[1] and edge not in existing:
+                new.add(edge)
+
+        db.session.add_all(
+            Follows(user_following_id=follower + 1,
+                    user_being_followed_id=followed + 1)
+            for follower, followed in new)
+        db.session.commit()
+
+        (users, written), elapsed = timed(run, app)
+        print(f"incremental run: {users} users, {written} suggestions, "
+              f"{elapsed:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""Measure first-request latency with and without template precompiling.
+
+Run from the top level directory:
+
+    python benchmarks/templates.py [runs]
+
+Each run uses a fresh interpreter (like a newly started worker) and times
+its first requests to /login and /signup, which render templates but touch
+no database, in three setups:
+
+- cold: no bytecode cache and no warmup, as before
+- bytecode cache: templates already compiled into the cache (as by
+  `flask templates compile`), but loaded on first use
+- warmup: the bytecode cache, plus loading every template in create_app
+"""
+
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+RUN_ONCE = r"""
+import json, sys, time
+
+import app as warbler
+
+cache_dir, warmup = sys.argv[1], sys.argv[2] == "1"
+
+config = {"TESTING": True, "TEMPLATES_WARMUP": warmup}
+if cache_dir:
+    config["TEMPLATES_CACHE_DIR"] = cache_dir
+
+t0 = time.perf_counter()
+app = warbler.create_app(config)
+if not cache_dir:
+    app.jinja_env.bytecode_cache = None
+t1 = time.perf_counter()
+client = app.test_client()
+client.get("/login")
+t2 = time.perf_counter()
+client.get("/signup")
+t3 = time.perf_counter()
+client.get("/login")
+t4 = time.perf_counter()
+
+print(json.dumps({
+    "create_app": t1 - t0,
+    "first /login": t2 - t1,
+    "first /signup": t3 - t2,
+    "second /login": t4 - t3,
+}))
+"""
+
+
+def run(runs, env, cache_dir, warmup):
+    results = []
+    for _ in range(runs):
+        out = subprocess.run(
+            [sys.executable, "-c", RUN_ONCE, cache_dir, "1" if warmup else "0"],
+            cwd=ROOT, env=env, check=True, capture_output=True, text=True)
+        results.append(json.loads(out.stdout))
+    return results
+
+
+def main(runs=10):
+    env = {
+        "DATABASE_URL": "postgresql:///warbler",
+        "SECRET_KEY": "benchmark",
+        **os.environ,
+    }
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        # the build step: compile everything into the cache
+        run(1, env, cache_dir, True)
+
+        setups = {
+            "cold": run(runs, env, "", False),
+            "bytecode cache": run(runs, env, cache_dir, False),
+            "warmup": run(runs, env, cache_dir, True),
+        }
+
+    print(f"{'setup':<16} {'phase':<15} {'median ms':>10} {'max ms':>10}")
+    for setup, results in setups.items():
+        for phase in results[0]:
+            times = [r[phase] * 1000 for r in results]
+            print(f"{setup:<16} {phase:<15} "
+                  f"{statistics.median(times):>10.1f} {max(times):>10.1f}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10)
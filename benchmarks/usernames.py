@@ -0,0 +1,80 @@
+"""Measure username autocomplete on generated usernames.
+
+Run from the top level directory:
+
+    python benchmarks/usernames.py [--users 1000000]
+
+No database is needed: usernames are generated like the seed data's
+(words and digits), so many share short prefixes.
+"""
+
+import argparse
+import os
+import random
+import string
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from usernames import SortedNames, UsernameIndex  # noqa: E402
+
+
+def generate(users, seed=0):
+    """Return (username, user id) pairs."""
+
+    rng = random.Random(seed)
+    syllables = [
+        "".join(rng.choices(string.ascii_lowercase, k=rng.randint(2, 3)))
+        for _ in range(300)]
+
+    names = set()
+    while len(names) < users:
+        name = "".join(rng.choices(syllables, k=rng.randint(2, 3)))
+        if rng.random() < 0.5:
+            name += str(rng.randrange(1000))
+        if rng.random() < 0.2:
+            name = name.capitalize()
+        names.add(name)
+
+    return [(name, id) for id, name in enumerate(names, 1)]
+
+
+def per_call(fn, args):
+    start = time.perf_counter()
+    for a in args:
+        fn(*a)
+    return (time.perf_counter() - start) / len(args) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=1000000)
+    args = parser.parse_args()
+
+    entries = generate(args.users)
+
+    start = time.perf_counter()
+    index = UsernameIndex(None)
+    index.names = SortedNames(entries)
+    build = time.perf_counter() - start
+
+    rng = random.Random(1)
+    prefixes = [(name[:rng.randint(1, 4)],)
+                for name, _ in rng.choices(entries, k=10000)]
+    misses = [(prefix + "qqq",) for prefix, in prefixes]
+
+    print(f"{args.users} users")
+    print(f"build:              {build:.2f}s")
+    print(f"memory:             {index.names.nbytes / 1024 / 1024:.1f} MB")
+    print(f"complete:           {per_call(index.complete, prefixes):.1f}us")
+    print(f"complete (no hits): {per_call(index.complete, misses):.1f}us")
+
+    for name, id in entries[:1000]:
+        index.add(id, name + "x")
+    print("with 1000 renames pending:")
+    print(f"complete:           {per_call(index.complete, prefixes):.1f}us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,587 @@
+"""Caching for Warbler.
+
+`get_cache()` returns the app's cache, chosen by CACHE_TYPE:
+
+- "lru": in this process, evicting least recently used entries once they
+  take up more than CACHE_LRU_MAX_BYTES
+- "sqlite": a SQLite file (CACHE_SQLITE_PATH) shared by every worker on
+  the host, holding up to CACHE_SQLITE_MAX_ENTRIES entries
+- "redis": a Redis server (CACHE_REDIS_URL), shared by every host; needs
+  `pip install redis`
+- "null": caches nothing
+
+Values are pickled, so any backend returns a copy. Entries can carry tags:
+`invalidate_tags("user:1")` makes every entry tagged "user:1" a miss, by
+bumping the tag's version, which is part of its entries' keys.
+
+`@memoize` caches a function's results, `@fragment` caches rendered HTML,
+and `cached_get(User, id)` is a cached `User.query.get(id)`, invalidated
+whenever a user is changed or deleted through the ORM.
+"""
+
+import functools
+import os
+import pickle
+import random
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from flask import current_app, has_app_context
+from markupsafe import Markup
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session, make_transient_to_detached
+
+from models import db
+
+DEFAULT_CONFIG = {
+    "CACHE_TYPE": "lru",
+    "CACHE_DEFAULT_TTL": 300,
+    "CACHE_KEY_PREFIX": "warbler:",
+    "CACHE_LRU_MAX_BYTES": 64 * 1024 * 1024,
+    "CACHE_SQLITE_PATH": None,
+    "CACHE_SQLITE_MAX_ENTRIES": 100000,
+    "CACHE_REDIS_URL": "redis://localhost:6379/0",
+}
+
+MISSING = object()
+
+# backends every worker sees the same entries in
+SHARED_CACHE_TYPES = ("sqlite", "redis")
+
+# tags invalidated per backend round trip
+TAG_BATCH_SIZE = 1000
+
+
+class BaseCache:
+    """A cache of pickled values, with optional expiry in seconds.
+
+    Backends implement _get, _set, _delete, _update and clear on bytes.
+    """
+
+    def __init__(self, default_ttl=None):
+        self.default_ttl = default_ttl
+
+    def _expires(self, ttl):
+        ttl = self.default_ttl if ttl is None else ttl
+        return time.time() + ttl if ttl else None
+
+    def get(self, key, default=None):
+        data = self._get(key)
+        return default if data is None else pickle.loads(data)
+
+    def set(self, key, value, ttl=None):
+        self._set(key, pickle.dumps(value), self._expires(ttl))
+
+    def delete(self, key):
+        self._delete(key)
+
+    def update(self, key, fn, ttl=None):
+        """Atomically replace `key`'s value `v` with `fn(v)`; return it.
+
+        `fn` is called with None if there's no value.
+        """
+
+        def update_data(data):
+            value = fn(None if data is None else pickle.loads(data))
+            return pickle.dumps(value), value
+
+        return self._update(key, update_data, self._expires(ttl))
+
+    def incr(self, key, ttl=None):
+        return self.update(key, lambda value: (value or 0) + 1, ttl)
+
+    def update_many(self, keys, fn, ttl=None):
+        """`update` each of `keys`, in as few round trips as the backend
+        allows. Each key's update is atomic, but not all of them together.
+        """
+
+        def update_data(data):
+            value = fn(None if data is None else pickle.loads(data))
+            return pickle.dumps(value), value
+
+        return self._update_many(keys, update_data, self._expires(ttl))
+
+    def _update_many(self, keys, update_data, expires):
+        return [self._update(key, update_data, expires) for key in keys]
+
+
+class NullCache(BaseCache):
+    """Caches nothing."""
+
+    def _get(self, key):
+        return None
+
+    def _set(self, key, data, expires):
+        pass
+
+    def _delete(self, key):
+        pass
+
+    def _update(self, key, update_data, expires):
+        return update_data(None)[1]
+
+    def clear(self):
+        pass
+
+
+class LRUCache(BaseCache):
+    """In-process cache holding up to `max_bytes` of pickled values."""
+
+    def __init__(self, max_bytes, default_ttl=None):
+        super().__init__(default_ttl)
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get(self, key):
+        with self._lock:
+            return self._get_locked(key)
+
+    def _get_locked(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+
+        data, expires = entry
+        if expires is not None and expires < time.time():
+            self._delete_locked(key)
+            return None
+
+        self._entries.move_to_end(key)
+        return data
+
+    def _set(self, key, data, expires):
+        with self._lock:
+            self._set_locked(key, data, expires)
+
+    def _set_locked(self, key, data, expires):
+        self._delete_locked(key)
+        if len(data) > self.max_bytes:
+            return
+
+        self._entries[key] = (data, expires)
+        self.size += len(data)
+
+        while self.size > self.max_bytes:
+            _, (evicted, _) = self._entries.popitem(last=False)
+            self.size -= len(evicted)
+
+    def _delete(self, key):
+        with self._lock:
+            self._delete_locked(key)
+
+    def _delete_locked(self, key):
+        entry = self._entries.pop(key, None)
+        if entry:
+            self.size -= len(entry[0])
+
+    def _update(self, key, update_data, expires):
+        with self._lock:
+            data, value = update_data(self._get_locked(key))
+            self._set_locked(key, data, expires)
+            return value
+
+    def _update_many(self, keys, update_data, expires):
+        values = []
+        with self._lock:
+            for key in keys:
+                data, value = update_data(self._get_locked(key))
+                self._set_locked(key, data, expires)
+                values.append(value)
+        return values
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+
+class SQLiteCache(BaseCache):
+    """Cache in a SQLite file, shared by every process that opens it.
+
+    Once it holds more than `max_entries`, expired entries and then the
+    least recently written ones are dropped.
+    """
+
+    def __init__(self, path, max_entries, default_ttl=None):
+        super().__init__(default_ttl)
+        self.path = path
+        self.max_entries = max_entries
+        self._local = threading.local()
+
+        with self._write() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                " key TEXT PRIMARY KEY,"
+                " value BLOB NOT NULL,"
+                " expires REAL,"
+                " written REAL NOT NULL)")
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS cache_written ON cache (written)")
+
+    def _connection(self):
+        # one connection per thread, and per process after a fork
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30,
+                                   isolation_level=None,
+                                   check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    @contextmanager
+    def _write(self):
+        """Run a block in a write transaction.
+
+        The write lock is taken up front, so read-modify-writes are atomic.
+        """
+
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def _read(self, conn, key):
+        row = conn.execute(
+            "SELECT value, expires FROM cache WHERE key = ?",
+            (key,)).fetchone()
+
+        if row is None or (row[1] is not None and row[1] < time.time()):
+            return None
+        return row[0]
+
+    def _get(self, key):
+        return self._read(self._connection(), key)
+
+    def _set(self, key, data, expires):
+        with self._write() as conn:
+            self._write_entry(conn, key, data, expires)
+
+    def _write_entry(self, conn, key, data, expires):
+        conn.execute(
+            "INSERT OR REPLACE INTO cache (key, value, expires, written) "
+            "VALUES (?, ?, ?, ?)",
+            (key, data, expires, time.time()))
+
+        # prune now and then rather than counting rows on every write
+        if random.random() < 0.01:
+            conn.execute(
+                "DELETE FROM cache WHERE expires < ?", (time.time(),))
+            conn.execute(
+                "DELETE FROM cache WHERE key IN ("
+                " SELECT key FROM cache ORDER BY written DESC"
+                " LIMIT -1 OFFSET ?)",
+                (self.max_entries,))
+
+    def _delete(self, key):
+        with self._write() as conn:
+            conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+
+    def _update(self, key, update_data, expires):
+        with self._write() as conn:
+            data, value = update_data(self._read(conn, key))
+            self._write_entry(conn, key, data, expires)
+            return value
+
+    def _update_many(self, keys, update_data, expires):
+        values = []
+        with self._write() as conn:
+            for key in keys:
+                data, value = update_data(self._read(conn, key))
+                self._write_entry(conn, key, data, expires)
+                values.append(value)
+        return values
+
+    def clear(self):
+        with self._write() as conn:
+            conn.execute("DELETE FROM cache")
+
+
+class RedisCache(BaseCache):
+    """Cache in Redis, shared by every host."""
+
+    def __init__(self, client, default_ttl=None):
+        super().__init__(default_ttl)
+        self.client = client
+
+    @classmethod
+    def from_url(cls, url, default_ttl=None):
+        import redis
+        return cls(redis.Redis.from_url(url), default_ttl)
+
+    def _get(self, key):
+        return self.client.get(key)
+
+    def _set(self, key, data, expires):
+        self.client.set(key, data, pxat=expires and int(expires * 1000))
+
+    def _delete(self, key):
+        self.client.delete(key)
+
+    def _update(self, key, update_data, expires):
+        from redis import WatchError
+
+        with self.client.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(key)
+                    data, value = update_data(pipe.get(key))
+                    pipe.multi()
+                    pipe.set(key, data, pxat=expires and int(expires * 1000))
+                    pipe.execute()
+                    return value
+                except WatchError:
+                    continue
+
+    def _update_many(self, keys, update_data, expires):
+        from redis import WatchError
+
+        with self.client.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(*keys)
+                    updates = [update_data(data) for data in pipe.mget(keys)]
+                    pipe.multi()
+                    for key, (data, _) in zip(keys, updates):
+                        pipe.set(key, data,
+                                 pxat=expires and int(expires * 1000))
+                    pipe.execute()
+                    return [value for _, value in updates]
+                except WatchError:
+                    continue
+
+    def clear(self):
+        self.client.flushdb()
+
+
+class PrefixedCache:
+    """A view of a cache with every key prefixed, plus tag versions."""
+
+    def __init__(self, backend, prefix):
+        self.backend = backend
+        self.prefix = prefix
+
+    def get(self, key, default=None):
+        return self.backend.get(self.prefix + key, default)
+
+    def set(self, key, value, ttl=None):
+        self.backend.set(self.prefix + key, value, ttl)
+
+    def delete(self, key):
+        self.backend.delete(self.prefix + key)
+
+    def update(self, key, fn, ttl=None):
+        return self.backend.update(self.prefix + key, fn, ttl)
+
+    def incr(self, key, ttl=None):
+        return self.backend.incr(self.prefix + key, ttl)
+
+    def clear(self):
+        self.backend.clear()
+
+    def tagged_key(self, key, tags):
+        """Return `key` qualified by the current versions of `tags`."""
+
+        versions = [f"{tag}={self._tag_version(tag)}" for tag in tags]
+        return "|".join([key, *versions])
+
+    def _tag_version(self, tag):
+        key = f"{self.prefix}tag:{tag}"
+
+        version = self.backend.get(key)
+        if version is None:
+            # a tag evicted from the cache gets a version it can't have had
+            # before, so entries made with its old version can't come back
+            version = self.backend.update(
+                key, lambda v: v or time.time_ns(), ttl=0)
+        return version
+
+    def invalidate_tags(self, *tags):
+        """Make every entry tagged with any of `tags` a miss.
+
+        Tags are bumped TAG_BATCH_SIZE at a time, in one round trip (or
+        transaction) per batch.
+        """
+
+        keys = [f"{self.prefix}tag:{tag}" for tag in tags]
+        for start in range(0, len(keys), TAG_BATCH_SIZE):
+            self.backend.update_many(
+                keys[start:start + TAG_BATCH_SIZE],
+                lambda v: (v or time.time_ns()) + 1,
+                ttl=0)
+
+
+def make_cache(config):
+    """Create the cache backend described by `config`."""
+
+    cache_type = config["CACHE_TYPE"]
+    ttl = config["CACHE_DEFAULT_TTL"]
+
+    if cache_type == "lru":
+        backend = LRUCache(config["CACHE_LRU_MAX_BYTES"], ttl)
+    elif cache_type == "sqlite":
+        backend = SQLiteCache(
+            config["CACHE_SQLITE_PATH"],
+            config["CACHE_SQLITE_MAX_ENTRIES"],
+            ttl)
+    elif cache_type == "redis":
+        backend = RedisCache.from_url(config["CACHE_REDIS_URL"], ttl)
+    elif cache_type == "null":
+        backend = NullCache(ttl)
+    else:
+        raise ValueError(f"Unknown CACHE_TYPE: {cache_type}")
+
+    return PrefixedCache(backend, config["CACHE_KEY_PREFIX"])
+
+
+def get_cache():
+    """Return the current app's cache."""
+
+    return current_app.extensions["cache"]
+
+
+def cache_is_shared(config):
+    """Do all of the app's workers see the same cache (and invalidations)?"""
+
+    return config["CACHE_TYPE"] in SHARED_CACHE_TYPES
+
+
+def invalidate_tags(*tags):
+    get_cache().invalidate_tags(*tags)
+
+
+def memoize(tags=None, ttl=None):
+    """Cache the decorated function's results, by its arguments.
+
+    `tags` is a function taking the same arguments and returning the tags
+    for the result, so that `invalidate_tags` can drop it.
+    """
+
+    def decorator(fn):
+        name = f"{fn.__module__}.{fn.__qualname__}"
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            cache = get_cache()
+            key = f"memo:{name}:{args!r}:{sorted(kwargs.items())!r}"
+            if tags:
+                key = cache.tagged_key(key, tags(*args, **kwargs))
+
+            value = cache.get(key, MISSING)
+            if value is MISSING:
+                value = fn(*args, **kwargs)
+                cache.set(key, value, ttl)
+            return value
+
+        return wrapper
+
+    return decorator
+
+
+def fragment(tags=None, ttl=None):
+    """Cache the decorated function's rendered HTML, by its arguments."""
+
+    def decorator(fn):
+        memoized = memoize(tags, ttl)(lambda *a, **kw: str(fn(*a, **kw)))
+        memoized.__qualname__ = fn.__qualname__
+        memoized.__module__ = fn.__module__
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            return Markup(memoized(*args, **kwargs))
+
+        return wrapper
+
+    return decorator
+
+
+##############################################################################
+# Cached model lookups
+
+CACHED_MODELS = set()
+
+
+def model_tag(model, ident):
+    return f"{model.__tablename__}:{ident}"
+
+
+def cached_get(model, ident, ttl=None):
+    """`model.query.get(ident)`, caching the row's column values.
+
+    `model` must have been registered with `cache_model`.
+    """
+
+    cache = get_cache()
+    key = cache.tagged_key(
+        f"model:{model.__tablename__}:{ident}", [model_tag(model, ident)])
+
+    values = cache.get(key, MISSING)
+    if values is MISSING:
+        instance = db.session.get(model, ident)
+        values = instance and {
+            attr.key: getattr(instance, attr.key)
+            for attr in inspect(model).column_attrs
+        }
+        cache.set(key, values, ttl)
+
+    if values is None:
+        return None
+
+    # attach it to the session like a freshly loaded instance
+    instance = model(**values)
+    make_transient_to_detached(instance)
+    return db.session.merge(instance, load=False)
+
+
+def cache_model(model):
+    """Invalidate `cached_get` entries for `model` when instances change."""
+
+    CACHED_MODELS.add(model)
+    return model
+
+
+@event.listens_for(Session, "after_flush")
+def collect_changed_models(session, flush_context):
+    changed = session.info.setdefault("cache_changed", set())
+
+    for instance in [*session.dirty, *session.deleted]:
+        if type(instance) in CACHED_MODELS:
+            changed.add(model_tag(type(instance), inspect(instance).identity[0]))
+
+
+@event.listens_for(Session, "after_commit")
+def invalidate_changed_models(session):
+    changed = session.info.pop("cache_changed", None)
+    if changed and has_app_context() and "cache" in current_app.extensions:
+        invalidate_tags(*changed)
+
+
+@event.listens_for(Session, "after_rollback")
+def forget_changed_models(session):
+    session.info.pop("cache_changed", None)
+
+
+def init_cache(app):
+    """Set up `app`'s cache."""
+
+    for key, value in DEFAULT_CONFIG.items():
+        app.config.setdefault(key, value)
+
+    if app.config["CACHE_SQLITE_PATH"] is None:
+        app.config["CACHE_SQLITE_PATH"] = os.path.join(
+            app.instance_path, "cache.sqlite3")
+        if app.config["CACHE_TYPE"] == "sqlite":
+            os.makedirs(app.instance_path, exist_ok=True)
+
+    app.extensions["cache"] = make_cache(app.config)
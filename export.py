@@ -0,0 +1,279 @@
+"""Streaming data export.
+
+A user's data -- their profile, messages, likes, followers and following --
+is exported as NDJSON (one JSON object per line, each with a "type") or as
+CSV (one section at a time), from GET /users/<id>/export or
+
+    flask export user USER_ID [--format csv] [--out DIR]
+
+Whole tables are exported, a file per table, with
+
+    flask export tables --out DIR [--format csv] [--workers 4]
+
+Rows are read through server-side cursors EXPORT_BATCH_SIZE at a time and
+written out as they arrive, so memory use doesn't grow with the export.
+Table exports run in parallel, in forked worker processes (formatting rows
+is CPU bound, so threads wouldn't help), each table on its own connection;
+on PostgreSQL they all read the same snapshot, like `pg_dump --jobs`.
+"""
+
+import csv
+import io
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime
+
+import click
+from flask import current_app
+from sqlalchemy import select, text
+
+from models import db, Follows, Like, Message, User
+
+DEFAULT_CONFIG = {
+    "EXPORT_BATCH_SIZE": 1000,
+}
+
+FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+
+USER_SECTIONS = ("profile", "messages", "likes", "followers", "following")
+
+# never exported
+EXCLUDED_COLUMNS = {
+    "users": {"password"},
+}
+
+
+def user_sections(user_id):
+    """Return {section name: query} for `user_id`'s data."""
+
+    return {
+        "profile": select(
+            User.id, User.username, User.email, User.bio, User.location,
+            User.image_url, User.header_image_url)
+        .where(User.id == user_id),
+
+        "messages": select(Message.id, Message.text, Message.timestamp)
+        .where(Message.user_id == user_id)
+        .order_by(Message.id),
+
+        "likes": select(Like.message_id, Like.liked_at)
+        .where(Like.user_id == user_id)
+        .order_by(Like.liked_at, Like.message_id),
+
+        "followers": select(User.id.label("user_id"), User.username)
+        .join(Follows, Follows.user_following_id == User.id)
+        .where(Follows.user_being_followed_id == user_id)
+        .order_by(User.id),
+
+        "following": select(User.id.label("user_id"), User.username)
+        .join(Follows, Follows.user_being_followed_id == User.id)
+        .where(Follows.user_following_id == user_id)
+        .order_by(User.id),
+    }
+
+
+def table_query(table):
+    """Select the exportable columns of `table`."""
+
+    excluded = EXCLUDED_COLUMNS.get(table.name, set())
+    return select(*[column for column in table.columns
+                    if column.name not in excluded])
+
+
+def stream(query, connection=None):
+    """Yield `query`'s rows as dicts, from a server-side cursor."""
+
+    query = query.execution_options(
+        yield_per=current_app.config["EXPORT_BATCH_SIZE"])
+    result = (connection or db.session).execute(query)
+
+    for row in result.mappings():
+        yield dict(row)
+
+
+def to_json(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"Can't export {type(value).__name__}")
+
+
+def ndjson_lines(rows, type=None):
+    """Yield each row as a line of JSON, with "type": `type` if given."""
+
+    for row in rows:
+        if type:
+            row = {"type": type, **row}
+        yield json.dumps(row, default=to_json) + "\n"
+
+
+def csv_lines(query, rows):
+    """Yield a header line for `query`'s columns, then a line per row."""
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def line(values):
+        writer.writerow(values)
+        value = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return value
+
+    columns = [column.name for column in query.selected_columns]
+    yield line(columns)
+
+    for row in rows:
+        yield line([
+            json.dumps(value) if isinstance(value, (dict, list))
+            else value.isoformat() if isinstance(value, (datetime, date))
+            else value
+            for value in (row[column] for column in columns)
+        ])
+
+
+def export_user(user_id, format="ndjson", section=None):
+    """Yield `user_id`'s data as lines of NDJSON, or of CSV for `section`."""
+
+    sections = user_sections(user_id)
+
+    if format == "csv":
+        query = sections[section]
+        yield from csv_lines(query, stream(query))
+    else:
+        names = [section] if section else sections
+        for name in names:
+            yield from ndjson_lines(stream(sections[name]), type=name)
+
+
+def write_lines(path, lines):
+    """Write `lines` to `path`; return the number written."""
+
+    count = 0
+    with open(path, "w", newline="") as f:
+        for line in lines:
+            f.write(line)
+            count += 1
+    return count
+
+
+def export_table(app, table, path, format, snapshot=None):
+    """Write `table` to `path`; return the number of rows."""
+
+    with app.app_context():
+        with db.engine.connect() as connection:
+            if snapshot:
+                connection.execute(text(
+                    "SET TRANSACTION ISOLATION LEVEL REPEATABLE READ"))
+                connection.execute(
+                    text("SET TRANSACTION SNAPSHOT :snapshot"),
+                    {"snapshot": snapshot})
+
+            query = table_query(table)
+            rows = stream(query, connection)
+
+            if format == "csv":
+                return write_lines(path, csv_lines(query, rows)) - 1
+            return write_lines(path, ndjson_lines(rows))
+
+
+_worker_app = None
+
+
+def _init_worker(app):
+    global _worker_app
+    _worker_app = app
+
+
+def _export_table_in_worker(name, path, format, snapshot):
+    return export_table(
+        _worker_app, db.metadata.tables[name], path, format, snapshot)
+
+
+def export_tables(app, out, format="ndjson", workers=4):
+    """Export every table to `out`/<table>.<format>, `workers` at a time.
+
+    Returns {table name: rows}.
+    """
+
+    os.makedirs(out, exist_ok=True)
+
+    with app.app_context(), db.engine.connect() as connection:
+        snapshot = None
+        if db.engine.dialect.name == "postgresql":
+            # hold a snapshot open for the workers to share
+            connection.execute(text(
+                "SET TRANSACTION ISOLATION LEVEL REPEATABLE READ"))
+            snapshot = connection.scalar(text("SELECT pg_export_snapshot()"))
+
+        names = [table.name for table in db.metadata.sorted_tables]
+        # forked, the workers inherit the app instead of pickling it
+        with ProcessPoolExecutor(
+                workers,
+                mp_context=multiprocessing.get_context("fork"),
+                initializer=_init_worker,
+                initargs=(app,)) as pool:
+            counts = pool.map(
+                _export_table_in_worker,
+                names,
+                [os.path.join(out, f"{name}.{format}") for name in names],
+                [format] * len(names),
+                [snapshot] * len(names))
+            return dict(zip(names, counts))
+
+
+def init_export(app):
+    """Set up `app`'s export settings and CLI."""
+
+    for key, value in DEFAULT_CONFIG.items():
+        app.config.setdefault(key, value)
+
+    @app.cli.group("export")
+    def export_cli():
+        """Data export commands."""
+
+    @export_cli.command("user")
+    @click.argument("user_id", type=int)
+    @click.option("--format", "format", type=click.Choice(list(FORMATS)),
+                  default="ndjson")
+    @click.option("--out", default=None,
+                  help="Directory for the files; NDJSON goes to stdout "
+                       "without one.")
+    def user_command(user_id, format, out):
+        """Export a user's data."""
+
+        if out is None and format == "ndjson":
+            for line in export_user(user_id):
+                click.echo(line, nl=False)
+            return
+
+        if out is None:
+            raise click.UsageError("CSV exports need --out.")
+
+        os.makedirs(out, exist_ok=True)
+        sections = USER_SECTIONS if format == "csv" else [None]
+        for section in sections:
+            path = os.path.join(out, f"{section or 'user'}.{format}")
+            lines = write_lines(path, export_user(user_id, format, section))
+            click.echo(f"{path}: {lines} lines")
+
+    @export_cli.command("tables")
+    @click.option("--out", required=True, help="Directory for the files.")
+    @click.option("--format", "format", type=click.Choice(list(FORMATS)),
+                  default="ndjson")
+    @click.option("--workers", default=4, help="Tables exported at once.")
+    def tables_command(out, format, workers):
+        """Export every table, a file each."""
+
+        start = time.perf_counter()
+        counts = export_tables(app, out, format, workers)
+        elapsed = time.perf_counter() - start
+
+        for name, count in counts.items():
+            click.echo(f"{name}: {count} rows")
+        click.echo(f"exported in {elapsed:.2f}s")
@@ -1,12 +1,26 @@
 from flask_wtf import FlaskForm
-from wtforms import StringField, PasswordField, TextAreaField
+from wtforms import DateTimeField, StringField, PasswordField, TextAreaField
 from wtforms.validators import DataRequired, Email, Length, URL, Optional, ValidationError
 
 
 class MessageForm(FlaskForm):
     """Form for adding/editing messages."""
 
-    text = TextAreaField('text', validators=[DataRequired()])
+    text = TextAreaField('text', validators=[DataRequired(), Length(max=140)])
+
+
+class MessageImportForm(MessageForm):
+    """A message in a bulk import: a MessageForm, plus when it was posted."""
+
+    class Meta:
+        csrf = False
+
+    timestamp = DateTimeField(
+        'timestamp',
+        validators=[Optional()],
+        format=["%Y-%m-%dT%H:%M:%S", "%Y-%m-%dT%H:%M:%S.%f",
+                "%Y-%m-%d %H:%M:%S"],
+    )
 
 
 class UserAddForm(FlaskForm):
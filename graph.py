@@ -0,0 +1,419 @@
+"""In-memory follow graph.
+
+Each worker keeps the `follows` table in memory as two CSR (compressed
+sparse row) indexes -- who each user follows, and who follows each user --
+so follow checks, counts and followed-id lists don't touch the database.
+
+The graph is built from a bulk scan of `follows` on first use (after fork),
+in a background thread (GRAPH_BUILD_IN_BACKGROUND), with callers reading
+the database until it's ready. It's then kept current by:
+
+- the `followed`/`unfollowed` signals, for changes made by this worker
+- the `follow_events` log, written by a trigger on `follows` (PostgreSQL
+  only), which is polled at most every GRAPH_SYNC_INTERVAL seconds for
+  changes made by other workers or outside the routes (e.g. cascades)
+
+It is rebuilt from scratch every GRAPH_MAX_AGE seconds as a backstop, the
+old graph serving until the new one is swapped in, and
+recent changes are folded into the CSR arrays once there are more than
+GRAPH_OVERLAY_LIMIT of them, so memory stays close to 4 bytes per follow in
+each direction plus 8 bytes per user id.
+"""
+
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from datetime import datetime, timedelta
+
+import click
+from sqlalchemy import delete, func, select, tuple_
+
+from models import db, Follows, FollowEvent
+from signals import followed, unfollowed
+
+DEFAULT_CONFIG = {
+    "GRAPH_SYNC_INTERVAL": 1.0,
+    "GRAPH_MAX_AGE": 3600,
+    "GRAPH_OVERLAY_LIMIT": 10000,
+    "GRAPH_EVENT_GAP_TIMEOUT": 10,
+    "GRAPH_BUILD_IN_BACKGROUND": True,
+}
+
+EMPTY = frozenset()
+
+
+class CSR:
+    """Sorted adjacency lists of integer ids, packed into two arrays.
+
+    The neighbours of `u` are targets[offsets[u]:offsets[u + 1]], in order.
+    """
+
+    def __init__(self, offsets, targets):
+        self.offsets = offsets
+        self.targets = targets
+
+    @classmethod
+    def from_edges(cls, sources, targets):
+        """Build from parallel sequences of edge sources and targets."""
+
+        n = max(sources, default=-1) + 1
+
+        offsets = array("q", bytes(8 * (n + 1)))
+        for source in sources:
+            offsets[source + 1] += 1
+        for u in range(n):
+            offsets[u + 1] += offsets[u]
+
+        packed = array("i", bytes(4 * len(sources)))
+        fill = array("q", offsets)
+        for source, target in zip(sources, targets):
+            packed[fill[source]] = target
+            fill[source] += 1
+
+        for u in range(n):
+            lo, hi = offsets[u], offsets[u + 1]
+            if hi - lo > 1:
+                packed[lo:hi] = array("i", sorted(packed[lo:hi]))
+
+        return cls(offsets, packed)
+
+    def _bounds(self, u):
+        if 0 <= u < len(self.offsets) - 1:
+            return self.offsets[u], self.offsets[u + 1]
+        return 0, 0
+
+    def has(self, u, v):
+        lo, hi = self._bounds(u)
+        i = bisect_left(self.targets, v, lo, hi)
+        return i < hi and self.targets[i] == v
+
+    def degree(self, u):
+        lo, hi = self._bounds(u)
+        return hi - lo
+
+    def row(self, u):
+        lo, hi = self._bounds(u)
+        return self.targets[lo:hi]
+
+    @property
+    def nbytes(self):
+        return (self.offsets.itemsize * len(self.offsets) +
+                self.targets.itemsize * len(self.targets))
+
+
+class Adjacency:
+    """One direction of the graph: a CSR base plus recent changes."""
+
+    def __init__(self, base):
+        self.base = base
+        # changes are stored as frozensets that are replaced, never mutated,
+        # so readers in other threads always see a consistent row
+        self.added = {}
+        self.removed = {}
+
+    def has(self, u, v):
+        if v in self.added.get(u, EMPTY):
+            return True
+        return v not in self.removed.get(u, EMPTY) and self.base.has(u, v)
+
+    def degree(self, u):
+        return (self.base.degree(u) + len(self.added.get(u, EMPTY)) -
+                len(self.removed.get(u, EMPTY)))
+
+    def row(self, u):
+        added = self.added.get(u, EMPTY)
+        removed = self.removed.get(u, EMPTY)
+        row = self.base.row(u)
+
+        if not added and not removed:
+            return row.tolist()
+        return sorted(added.union(v for v in row if v not in removed))
+
+    def add(self, u, v):
+        if self.base.has(u, v):
+            _discard(self.removed, u, v)
+        else:
+            _insert(self.added, u, v)
+
+    def remove(self, u, v):
+        if self.base.has(u, v):
+            _insert(self.removed, u, v)
+        else:
+            _discard(self.added, u, v)
+
+    @property
+    def changes(self):
+        return (sum(len(s) for s in self.added.values()) +
+                sum(len(s) for s in self.removed.values()))
+
+
+def _insert(sets, u, v):
+    sets[u] = sets.get(u, EMPTY) | {v}
+
+
+def _discard(sets, u, v):
+    if v in sets.get(u, EMPTY):
+        sets[u] = sets[u] - {v}
+        if not sets[u]:
+            del sets[u]
+
+
+class FollowGraph:
+    """Who follows whom, as CSR indexes in both directions."""
+
+    def __init__(self, followers, followed_users):
+        """Build from parallel arrays of follower and followed user ids."""
+
+        self.following = Adjacency(CSR.from_edges(followers, followed_users))
+        self.followers = Adjacency(CSR.from_edges(followed_users, followers))
+
+    def is_following(self, user_id, other_id):
+        return self.following.has(user_id, other_id)
+
+    def following_count(self, user_id):
+        return self.following.degree(user_id)
+
+    def follower_count(self, user_id):
+        return self.followers.degree(user_id)
+
+    def following_ids(self, user_id):
+        return self.following.row(user_id)
+
+    def follower_ids(self, user_id):
+        return self.followers.row(user_id)
+
+    def set_follow(self, follower_id, followed_id, is_follow):
+        if is_follow:
+            self.following.add(follower_id, followed_id)
+            self.followers.add(followed_id, follower_id)
+        else:
+            self.following.remove(follower_id, followed_id)
+            self.followers.remove(followed_id, follower_id)
+
+    def edges(self):
+        """Return all follows as parallel (follower ids, followed ids) arrays."""
+
+        followers = array("i")
+        followed_users = array("i")
+
+        users = set(range(len(self.following.base.offsets) - 1))
+        users.update(self.following.added)
+
+        for user_id in sorted(users):
+            row = self.following.row(user_id)
+            followers.extend([user_id] * len(row))
+            followed_users.extend(row)
+
+        return followers, followed_users
+
+    def compact(self):
+        """Return a new graph with all changes folded into the CSR arrays."""
+
+        return FollowGraph(*self.edges())
+
+    @property
+    def changes(self):
+        return self.following.changes
+
+    @property
+    def nbytes(self):
+        return self.following.base.nbytes + self.followers.base.nbytes
+
+
+class FollowGraphIndex:
+    """A worker's FollowGraph, built on first use and kept in sync."""
+
+    def __init__(self, app):
+        self.app = app
+        self.graph = None
+        self.watermark = 0
+        self.built_at = 0
+        self.synced_at = 0
+        self._gaps = {}
+        # guards changes to the graph; only held briefly
+        self._lock = threading.Lock()
+        # held by whichever thread is building or syncing
+        self._updating = threading.Lock()
+
+    def get(self):
+        """Return the up to date FollowGraph, or None if it isn't built yet.
+
+        Never waits for another thread (or, in the async serving mode,
+        greenlet) that is building or syncing the graph: until it's built,
+        callers fall back to the database, and while it's rebuilt or synced
+        they get the graph as of the last sync. With
+        GRAPH_BUILD_IN_BACKGROUND on, builds don't hold up the request that
+        starts them either.
+        """
+
+        config = self.app.config
+        now = time.monotonic()
+
+        if self.graph is None or now - self.built_at > config["GRAPH_MAX_AGE"]:
+            if self._updating.acquire(blocking=False):
+                if config["GRAPH_BUILD_IN_BACKGROUND"]:
+                    threading.Thread(
+                        target=self.build_in_background, daemon=True).start()
+                else:
+                    try:
+                        self.build()
+                    finally:
+                        self._updating.release()
+
+        elif now - self.synced_at >= config["GRAPH_SYNC_INTERVAL"]:
+            if self._updating.acquire(blocking=False):
+                try:
+                    self.sync()
+                finally:
+                    self._updating.release()
+
+        return self.graph
+
+    def build(self):
+        """Build the graph from a bulk scan of `follows`."""
+
+        # read the watermark first: anything logged after it gets replayed,
+        # and replaying a change that the scan already saw is harmless
+        watermark = db.session.scalar(
+            select(func.coalesce(func.max(FollowEvent.id), 0)))
+
+        followers = array("i")
+        followed_users = array("i")
+
+        result = db.session.execute(
+            select(Follows.user_following_id, Follows.user_being_followed_id)
+            .execution_options(yield_per=10000))
+        for follower_id, followed_id in result:
+            followers.append(follower_id)
+            followed_users.append(followed_id)
+
+        graph = FollowGraph(followers, followed_users)
+        with self._lock:
+            self.graph = graph
+            self.watermark = watermark
+            self._gaps = {}
+            self.built_at = self.synced_at = time.monotonic()
+
+        # catch up with changes made during the scan, including this
+        # worker's, which went to the old graph
+        self.sync()
+
+    def build_in_background(self):
+        """`build`, in the app's context, then let the next update start."""
+
+        try:
+            with self.app.app_context():
+                self.build()
+        except Exception:
+            self.app.logger.exception("Building the follow graph failed")
+        finally:
+            self._updating.release()
+
+    def sync(self):
+        """Apply follows changes logged in `follow_events` since the last sync.
+
+        Events only say which follows changed; their current state is read
+        from `follows`, so applying an event twice or out of order is safe.
+        """
+
+        self.synced_at = now = time.monotonic()
+
+        events = db.session.execute(
+            select(FollowEvent.id,
+                   FollowEvent.follower_id,
+                   FollowEvent.followed_id)
+            .where(FollowEvent.id > self.watermark)
+            .order_by(FollowEvent.id)).all()
+        if not events:
+            return
+
+        changed = {(e.follower_id, e.followed_id) for e in events}
+        existing = set(db.session.execute(
+            select(Follows.user_following_id, Follows.user_being_followed_id)
+            .where(tuple_(Follows.user_following_id,
+                          Follows.user_being_followed_id).in_(changed))).all())
+
+        with self._lock:
+            for follower_id, followed_id in changed:
+                self.graph.set_follow(
+                    follower_id, followed_id,
+                    (follower_id, followed_id) in existing)
+
+        # ids are handed out before commit, so a missing id may belong to a
+        # transaction that hasn't committed yet: don't move the watermark
+        # past it until it shows up or is old enough to have rolled back
+        timeout = self.app.config["GRAPH_EVENT_GAP_TIMEOUT"]
+        watermark = self.watermark
+
+        for event in events:
+            if event.id != watermark + 1:
+                first_seen = self._gaps.setdefault(watermark + 1, now)
+                if now - first_seen < timeout:
+                    break
+                del self._gaps[watermark + 1]
+            watermark = event.id
+
+        self.watermark = watermark
+        with self._lock:
+            self._maybe_compact()
+
+    def apply(self, follower_id, followed_id, is_follow):
+        """Apply a follow change made by this worker."""
+
+        if self.graph is None:
+            return
+
+        with self._lock:
+            self.graph.set_follow(follower_id, followed_id, is_follow)
+            self._maybe_compact()
+
+    def _maybe_compact(self):
+        if self.graph.changes > self.app.config["GRAPH_OVERLAY_LIMIT"]:
+            self.graph = self.graph.compact()
+
+
+def init_graph(app):
+    """Set up `app`'s follow graph, its signal receivers and CLI."""
+
+    for key, value in DEFAULT_CONFIG.items():
+        app.config.setdefault(key, value)
+
+    index = app.extensions["follow_graph"] = FollowGraphIndex(app)
+
+    @followed.connect_via(app, weak=False)
+    def on_followed(sender, follower_id, followed_id):
+        index.apply(follower_id, followed_id, True)
+
+    @unfollowed.connect_via(app, weak=False)
+    def on_unfollowed(sender, follower_id, followed_id):
+        index.apply(follower_id, followed_id, False)
+
+    @app.cli.group("graph")
+    def graph_cli():
+        """In-memory follow graph commands."""
+
+    @graph_cli.command("stats")
+    def stats_command():
+        """Build the follow graph and print its size."""
+
+        start = time.perf_counter()
+        index.build()
+        graph = index.graph
+        elapsed = time.perf_counter() - start
+
+        followers, _ = graph.edges()
+        click.echo(f"follows: {len(followers)}")
+        click.echo(f"memory: {graph.nbytes / 1024 / 1024:.1f} MB")
+        click.echo(f"build time: {elapsed:.2f}s")
+
+    @graph_cli.command("prune-events")
+    @click.option("--hours", default=24, help="Keep events this recent.")
+    def prune_events_command(hours):
+        """Delete old entries from the follow_events log."""
+
+        cutoff = datetime.utcnow() - timedelta(hours=hours)
+        result = db.session.execute(
+            delete(FollowEvent).where(FollowEvent.created_at < cutoff))
+        db.session.commit()
+        click.echo(f"deleted {result.rowcount} events")
@@ -0,0 +1,182 @@
+"""Bulk message import.
+
+POST /api/messages/import, as the user the messages are for, with a body of
+NDJSON (Content-Type: application/x-ndjson), one message per line:
+
+    {"text": "hello", "timestamp": "2019-05-01T12:00:00Z"}
+
+or CSV (Content-Type: text/csv) with a header line naming the `text` and,
+optionally, `timestamp` columns. Timestamps are UTC; without one, a message
+is timestamped now.
+
+Every message is checked with MessageImportForm (MessageForm's rules, plus
+the timestamp) before any are saved, and a batch with errors is rejected
+whole, listing them by line. Valid batches are inserted INGEST_CHUNK_SIZE
+rows per multi-row INSERT, in one transaction, and the author's and their
+followers' timelines are invalidated once for the whole batch.
+
+Neither content type can be sent cross-site without a CORS preflight, so
+the session cookie is safe to accept without a CSRF token.
+"""
+
+import csv
+import io
+import json
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import insert
+from werkzeug.datastructures import MultiDict
+
+from activity import record_activity
+from forms import MessageImportForm
+from models import db, Message
+from signals import messages_imported
+
+DEFAULT_CONFIG = {
+    "INGEST_MAX_MESSAGES": 10000,
+    "INGEST_MAX_BYTES": 10 * 1024 * 1024,
+    "INGEST_CHUNK_SIZE": 1000,
+}
+
+CONTENT_TYPES = {
+    "application/x-ndjson": "ndjson",
+    "text/csv": "csv",
+}
+
+# errors reported for a rejected batch, at most
+MAX_ERRORS = 100
+
+
+class IngestError(Exception):
+    """A batch was rejected; `errors` lists why, by line."""
+
+    def __init__(self, errors):
+        super().__init__(f"{len(errors)} invalid messages")
+        self.errors = errors
+
+
+def parse_ndjson(lines):
+    """Yield (line number, record) for each non-blank line of JSON.
+
+    The record is None if the line isn't a JSON object.
+    """
+
+    for number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+
+        try:
+            record = json.loads(line)
+        except ValueError:
+            record = None
+
+        yield number, record if isinstance(record, dict) else None
+
+
+def parse_csv(lines):
+    """Yield (line number, record) for each row after the header."""
+
+    reader = csv.DictReader(lines)
+    for record in reader:
+        yield reader.line_num, record
+
+
+PARSERS = {
+    "ndjson": parse_ndjson,
+    "csv": parse_csv,
+}
+
+
+def validate(records, max_messages):
+    """Return the rows to insert for `records`, or raise IngestError."""
+
+    now = datetime.utcnow()
+    rows = []
+    errors = []
+
+    for number, record in records:
+        if len(rows) + len(errors) == max_messages:
+            raise IngestError([{
+                "line": number,
+                "errors": {"batch": [
+                    f"A batch can have at most {max_messages} messages."]},
+            }])
+
+        if record is None:
+            errors.append({"line": number,
+                           "errors": {"line": ["Not a JSON object."]}})
+            continue
+
+        values = {key: record.get(key) for key in ("text", "timestamp")}
+        if not all(value is None or isinstance(value, str)
+                   for value in values.values()):
+            errors.append({"line": number,
+                           "errors": {"line": ["Values must be strings."]}})
+            continue
+
+        if values["timestamp"]:
+            values["timestamp"] = values["timestamp"].removesuffix("Z")
+
+        form = MessageImportForm(formdata=MultiDict(
+            (key, value) for key, value in values.items() if value))
+
+        if form.validate():
+            rows.append({
+                "text": form.text.data,
+                "timestamp": form.timestamp.data or now,
+            })
+        else:
+            errors.append({"line": number, "errors": form.errors})
+
+        if len(errors) == MAX_ERRORS:
+            break
+
+    if errors:
+        raise IngestError(errors)
+    return rows
+
+
+def insert_messages(user_id, rows, chunk_size):
+    """Insert `rows` as `user_id`'s messages; return their ids."""
+
+    ids = []
+    for start in range(0, len(rows), chunk_size):
+        chunk = [{**row, "user_id": user_id}
+                 for row in rows[start:start + chunk_size]]
+        ids += db.session.scalars(
+            insert(Message).values(chunk).returning(Message.id))
+    return ids
+
+
+def ingest(user_id, body, format):
+    """Import the messages in `body`, a binary file, for `user_id`.
+
+    Returns the new messages' ids, or raises IngestError.
+    """
+
+    config = current_app.config
+    lines = io.TextIOWrapper(body, encoding="utf-8", newline="")
+
+    try:
+        rows = validate(PARSERS[format](lines), config["INGEST_MAX_MESSAGES"])
+    except (UnicodeDecodeError, csv.Error) as e:
+        raise IngestError([{"line": None, "errors": {"body": [str(e)]}}])
+
+    ids = insert_messages(user_id, rows, config["INGEST_CHUNK_SIZE"])
+    record_activity("messages", user_id, [row["timestamp"] for row in rows])
+    db.session.commit()
+
+    messages_imported.send(
+        current_app._get_current_object(),
+        user_id=user_id,
+        message_ids=ids)
+
+    return ids
+
+
+def init_ingest(app):
+    """Set up `app`'s bulk import settings."""
+
+    for key, value in DEFAULT_CONFIG.items():
+        app.config.setdefault(key, value)
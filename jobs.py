@@ -0,0 +1,182 @@
+"""Background jobs, stored in the database.
+
+Code that shouldn't run in a request enqueues a job instead, in the same
+transaction as the rest of the request's changes:
+
+    enqueue("delete_user", user_id=user.id)
+    db.session.commit()
+
+and a worker process runs it:
+
+    flask jobs worker
+
+Tasks are functions registered with `@task`, called with the job's payload
+as keyword arguments, inside an app context. A task that has more to do
+than it should do in one transaction returns the payload for the next
+chunk; the job is then requeued to carry on from there, committing in
+between. A task that raises is retried, with exponential backoff, up to
+JOB_MAX_ATTEMPTS times. Jobs left running by a worker that died are
+requeued after JOB_TIMEOUT seconds.
+
+Any number of workers can run: each claims jobs with
+SELECT ... FOR UPDATE SKIP LOCKED, so no job runs twice at once.
+"""
+
+import time
+import traceback
+from datetime import datetime, timedelta
+
+import click
+from sqlalchemy import select, update
+
+from models import db, Job
+
+DEFAULT_CONFIG = {
+    "JOB_MAX_ATTEMPTS": 5,
+    "JOB_RETRY_DELAY": 10,
+    "JOB_TIMEOUT": 600,
+    "JOB_POLL_INTERVAL": 1,
+}
+
+TASKS = {}
+
+
+def task(fn):
+    """Register `fn` as a task, under its name."""
+
+    TASKS[fn.__name__] = fn
+    return fn
+
+
+def enqueue(task_name, **payload):
+    """Add a job running `task_name` with `payload` to the session."""
+
+    if task_name not in TASKS:
+        raise ValueError(f"No such task: {task_name}")
+
+    job = Job(task=task_name, payload=payload)
+    db.session.add(job)
+    return job
+
+
+def requeue_stale(timeout):
+    """Requeue jobs whose worker has been running them over `timeout`."""
+
+    db.session.execute(
+        update(Job)
+        .where(Job.status == "running",
+               Job.locked_at < datetime.utcnow() - timedelta(seconds=timeout))
+        .values(status="queued", locked_at=None))
+    db.session.commit()
+
+
+def claim():
+    """Mark the next due job running and return it, or None."""
+
+    job = db.session.scalars(
+        select(Job)
+        .where(Job.status == "queued", Job.run_at <= datetime.utcnow())
+        .order_by(Job.run_at, Job.id)
+        .limit(1)
+        .with_for_update(skip_locked=True)).first()
+
+    if job:
+        job.status = "running"
+        job.locked_at = datetime.utcnow()
+        job.attempts += 1
+    db.session.commit()
+
+    return job
+
+
+def run_job(job, config):
+    """Run one chunk of `job` and record how it went."""
+
+    try:
+        next_payload = TASKS[job.task](**job.payload)
+    except Exception:
+        db.session.rollback()
+
+        job.last_error = traceback.format_exc()
+        if job.attempts >= config["JOB_MAX_ATTEMPTS"]:
+            job.status = "failed"
+            job.finished_at = datetime.utcnow()
+        else:
+            delay = config["JOB_RETRY_DELAY"] * 2 ** (job.attempts - 1)
+            job.status = "queued"
+            job.run_at = datetime.utcnow() + timedelta(seconds=delay)
+
+    else:
+        if next_payload is None:
+            job.status = "done"
+            job.finished_at = datetime.utcnow()
+        else:
+            job.payload = next_payload
+            job.status = "queued"
+            job.attempts = 0
+
+    job.locked_at = None
+    db.session.commit()
+
+
+def run_pending(config, limit=None):
+    """Run due jobs until there are none (or `limit` have run).
+
+    Returns the number of job chunks run.
+    """
+
+    ran = 0
+    while limit is None or ran < limit:
+        job = claim()
+        if job is None:
+            break
+
+        run_job(job, config)
+        ran += 1
+
+    return ran
+
+
+def init_jobs(app):
+    """Set up `app`'s job settings and CLI."""
+
+    for key, value in DEFAULT_CONFIG.items():
+        app.config.setdefault(key, value)
+
+    @app.cli.group("jobs")
+    def jobs_cli():
+        """Background job commands."""
+
+    @jobs_cli.command("worker")
+    @click.option("--burst", is_flag=True,
+                  help="Exit once there are no more due jobs.")
+    def worker_command(burst):
+        """Run background jobs."""
+
+        while True:
+            requeue_stale(app.config["JOB_TIMEOUT"])
+            ran = run_pending(app.config)
+
+            if burst:
+                click.echo(f"ran {ran} jobs")
+                return
+
+            time.sleep(app.config["JOB_POLL_INTERVAL"])
+
+    @jobs_cli.command("enqueue")
+    @click.argument("task_name")
+    def enqueue_command(task_name):
+        """Queue a job running TASK_NAME, e.g. from cron."""
+
+        job = enqueue(task_name)
+        db.session.commit()
+        click.echo(f"queued job {job.id}")
+
+    @jobs_cli.command("status")
+    def status_command():
+        """Print the number of jobs in each state."""
+
+        counts = db.session.execute(
+            select(Job.status, db.func.count()).group_by(Job.status)).all()
+        for status, count in sorted(counts):
+            click.echo(f"{status}: {count}")
@@ -0,0 +1,232 @@
+"""Live timeline updates.
+
+In the async serving mode (asgi.py), the homepage opens one Server-Sent
+Events connection, GET /messages/stream, and is sent the id of every new
+message by its user or someone they follow. The page then fetches the
+cards for new ids (GET /messages/cards) and adds them to the top.
+
+New messages reach the stream through the MessageHub, which fans each out
+to the connected users it's for. LIVE_BUS decides how messages get to the
+hub:
+
+- "postgres": posting sends a NOTIFY, and each ASGI worker LISTENs on one
+  connection, so every worker sees every new message, wherever it was posted
+- "local": posting hands the message straight to this process's hub, which
+  is enough with a single worker
+
+It defaults to "postgres" on PostgreSQL. LISTEN needs a session, so behind
+PgBouncer in transaction mode set LIVE_LISTEN_URI to connect directly.
+
+Idle connections cost a coroutine, a watcher task and an empty queue each;
+nothing polls. A single task sends every connection a comment every
+LIVE_HEARTBEAT seconds to keep proxies from closing them.
+"""
+
+import asyncio
+import logging
+
+from flask import current_app
+from sqlalchemy import func, select
+from sqlalchemy.engine import make_url
+
+from models import db, follow_graph
+from signals import message_posted
+from timeline import follower_ids
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CONFIG = {
+    "LIVE_BUS": None,
+    "LIVE_LISTEN_URI": None,
+    "LIVE_HEARTBEAT": 15,
+    "LIVE_QUEUE_SIZE": 100,
+}
+
+CHANNEL = "warbler_messages"
+
+# sentinels put in subscriptions' queues, besides message ids
+HEARTBEAT = "heartbeat"
+RESET = "reset"
+CLOSE = "close"
+
+
+class Subscription:
+    """One connected stream's queue of events."""
+
+    def __init__(self, user_id, maxsize):
+        self.user_id = user_id
+        self.queue = asyncio.Queue(maxsize)
+
+    def put(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # the client is too far behind; have it reload instead
+            self.force(RESET)
+
+    def force(self, event):
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        self.queue.put_nowait(event)
+
+
+class MessageHub:
+    """Fans new messages out to the subscriptions they're for."""
+
+    def __init__(self, app):
+        self.app = app
+        self.subscriptions = {}
+        self.loop = None
+        self._tasks = []
+        self._publishing = set()
+
+    def subscribe(self, user_id):
+        sub = Subscription(user_id, self.app.config["LIVE_QUEUE_SIZE"])
+        self.subscriptions.setdefault(user_id, set()).add(sub)
+        return sub
+
+    def unsubscribe(self, sub):
+        subs = self.subscriptions.get(sub.user_id)
+        if subs:
+            subs.discard(sub)
+            if not subs:
+                del self.subscriptions[sub.user_id]
+
+    def start(self):
+        """Start listening and sending heartbeats on the running loop."""
+
+        loop = asyncio.get_running_loop()
+        if self.loop is loop:
+            return
+
+        self.loop = loop
+        self._tasks = [loop.create_task(self._heartbeat())]
+        if self.app.config["LIVE_BUS"] == "postgres":
+            self._tasks.append(loop.create_task(self._listen()))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self.loop = None
+
+    def publish_threadsafe(self, message_id, user_id):
+        """Publish a message from any thread, if the hub is running."""
+
+        loop = self.loop
+        if loop is not None and not loop.is_closed():
+            loop.call_soon_threadsafe(self.publish, message_id, user_id)
+
+    def publish(self, message_id, user_id):
+        """Send `message_id`, by `user_id`, to its author and followers."""
+
+        if self.subscriptions:
+            task = asyncio.create_task(self._publish(message_id, user_id))
+            self._publishing.add(task)
+            task.add_done_callback(self._publishing.discard)
+
+    async def _publish(self, message_id, user_id):
+        recipients = await asyncio.to_thread(self.recipients, user_id)
+
+        for recipient in recipients:
+            for sub in self.subscriptions.get(recipient, ()):
+                sub.put(message_id)
+
+    def recipients(self, user_id):
+        """Connected users who should see `user_id`'s messages."""
+
+        connected = list(self.subscriptions)
+
+        with self.app.app_context():
+            graph = follow_graph()
+            if graph and len(connected) < graph.follower_count(user_id):
+                return [viewer for viewer in connected
+                        if viewer == user_id or
+                        graph.is_following(viewer, user_id)]
+
+            followers = (graph.follower_ids(user_id) if graph
+                         else follower_ids(user_id))
+            return [user_id, *followers]
+
+    async def _heartbeat(self):
+        while True:
+            await asyncio.sleep(self.app.config["LIVE_HEARTBEAT"])
+            for subs in list(self.subscriptions.values()):
+                for sub in subs:
+                    if sub.queue.empty():
+                        sub.queue.put_nowait(HEARTBEAT)
+
+    async def _listen(self):
+        """LISTEN for new messages, reconnecting if the connection drops."""
+
+        import asyncpg
+
+        def notified(connection, pid, channel, payload):
+            message_id, user_id = map(int, payload.split(":"))
+            self.publish(message_id, user_id)
+
+        while True:
+            try:
+                conn = await asyncpg.connect(listen_dsn(self.app.config))
+                try:
+                    await conn.add_listener(CHANNEL, notified)
+                    closed = asyncio.Event()
+                    conn.add_termination_listener(lambda c: closed.set())
+                    await closed.wait()
+                finally:
+                    await conn.close()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("LISTEN connection failed")
+
+            # messages posted while disconnected are lost; have clients reload
+            for subs in list(self.subscriptions.values()):
+                for sub in subs:
+                    sub.force(RESET)
+            await asyncio.sleep(1)
+
+
+def listen_dsn(config):
+    """Return a libpq-style DSN for the LISTEN connection."""
+
+    uri = config["LIVE_LISTEN_URI"] or config["SQLALCHEMY_DATABASE_URI"]
+    url = make_url(uri).set(drivername="postgresql")
+    return url.render_as_string(hide_password=False)
+
+
+def notify(message_id, user_id):
+    """Tell every worker's hub about a new message."""
+
+    db.session.execute(
+        select(func.pg_notify(CHANNEL, f"{message_id}:{user_id}")))
+    db.session.commit()
+
+
+def get_hub():
+    """Return the current app's MessageHub."""
+
+    return current_app.extensions["live"]
+
+
+def init_live(app):
+    """Set up `app`'s message hub and have new messages published to it."""
+
+    for key, value in DEFAULT_CONFIG.items():
+        app.config.setdefault(key, value)
+
+    if app.config["LIVE_BUS"] is None:
+        backend = make_url(app.config["SQLALCHEMY_DATABASE_URI"])
+        app.config["LIVE_BUS"] = (
+            "postgres" if backend.get_backend_name() == "postgresql"
+            else "local")
+
+    hub = app.extensions["live"] = MessageHub(app)
+
+    @message_posted.connect_via(app, weak=False)
+    def on_message_posted(sender, message_id, user_id):
+        if app.config["LIVE_BUS"] == "postgres":
+            notify(message_id, user_id)
+        else:
+            hub.publish_threadsafe(message_id, user_id)
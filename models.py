@@ -1,12 +1,17 @@
 """SQLAlchemy models for Warbler."""
 
+import os
 from datetime import datetime
 
+from flask import current_app, has_app_context
 from flask_bcrypt import Bcrypt
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import DDL, event
+
+from replicas import RoutingSession
 
 bcrypt = Bcrypt()
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={"class_": RoutingSession})
 
 DEFAULT_IMAGE_URL = "/static/images/default-pic.png"
 DEFAULT_HEADER_IMAGE_URL = "/static/images/warbler-hero.jpg"
@@ -29,6 +34,195 @@ class Follows(db.Model):
         primary_key=True,
     )
 
+    __table_args__ = (
+        # the primary key covers followers of a user; this covers following
+        db.Index(
+            "ix_follows_user_following_id",
+            user_following_id,
+            user_being_followed_id,
+        ),
+    )
+
+
+class FollowEvent(db.Model):
+    """A change to `follows`, logged by a trigger for the follow graph."""
+
+    __tablename__ = 'follow_events'
+
+    id = db.Column(
+        db.Integer,
+        primary_key=True,
+    )
+
+    follower_id = db.Column(
+        db.Integer,
+        nullable=False,
+    )
+
+    followed_id = db.Column(
+        db.Integer,
+        nullable=False,
+    )
+
+    created_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.utcnow,
+        server_default=db.func.now(),
+    )
+
+
+event.listen(
+    Follows.__table__,
+    "after_create",
+    DDL("""
+        CREATE OR REPLACE FUNCTION log_follow_event() RETURNS trigger AS $$
+        DECLARE
+            row follows%%ROWTYPE;
+        BEGIN
+            IF TG_OP = 'DELETE' THEN row := OLD; ELSE row := NEW; END IF;
+            INSERT INTO follow_events (follower_id, followed_id, created_at)
+            VALUES (row.user_following_id, row.user_being_followed_id,
+                    now() AT TIME ZONE 'utc');
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+
+        CREATE TRIGGER follows_log_event
+        AFTER INSERT OR DELETE ON follows
+        FOR EACH ROW EXECUTE FUNCTION log_follow_event();
+    """).execute_if(dialect="postgresql"),
+)
+
+
+class FollowSuggestion(db.Model):
+    """A user suggested to another ("who to follow"), ranked from 1."""
+
+    __tablename__ = 'follow_suggestions'
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete="cascade"),
+        primary_key=True,
+    )
+
+    rank = db.Column(
+        db.SmallInteger,
+        primary_key=True,
+    )
+
+    suggested_user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete="cascade"),
+        nullable=False,
+        index=True,
+    )
+
+    # number of users followed by user_id who follow suggested_user_id
+    score = db.Column(
+        db.Integer,
+        nullable=False,
+    )
+
+
+class Watermark(db.Model):
+    """How far a batch job has got through a log (e.g. follow_events)."""
+
+    __tablename__ = 'watermarks'
+
+    name = db.Column(
+        db.Text,
+        primary_key=True,
+    )
+
+    value = db.Column(
+        db.BigInteger,
+        nullable=False,
+    )
+
+
+class Job(db.Model):
+    """A background job, run by `flask jobs worker` (see jobs.py)."""
+
+    __tablename__ = 'jobs'
+
+    id = db.Column(
+        db.Integer,
+        primary_key=True,
+    )
+
+    # name of the task to run
+    task = db.Column(
+        db.Text,
+        nullable=False,
+    )
+
+    # keyword arguments for the task
+    payload = db.Column(
+        db.JSON,
+        nullable=False,
+        default=dict,
+    )
+
+    # queued, running, done or failed
+    status = db.Column(
+        db.Text,
+        nullable=False,
+        default="queued",
+    )
+
+    attempts = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+    )
+
+    run_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.utcnow,
+    )
+
+    locked_at = db.Column(
+        db.DateTime,
+    )
+
+    last_error = db.Column(
+        db.Text,
+    )
+
+    created_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.utcnow,
+    )
+
+    finished_at = db.Column(
+        db.DateTime,
+    )
+
+    __table_args__ = (
+        # the worker's queue: due jobs, oldest first
+        db.Index(
+            "ix_jobs_status_run_at",
+            status,
+            run_at,
+        ),
+    )
+
+    def __repr__(self):
+        return f"<Job #{self.id}: {self.task} {self.status}>"
+
+
+def follow_graph():
+    """Return the current app's FollowGraph, or None if it has none."""
+
+    if not has_app_context():
+        return None
+
+    index = current_app.extensions.get("follow_graph")
+    return index.get() if index else None
+
 
 class User(db.Model):
     """User in the system."""
@@ -75,11 +269,28 @@ class User(db.Model):
         nullable=False,
     )
 
+    # set when the user deletes their account; a background job then
+    # deletes their data (see tasks.delete_user)
+    deleted_at = db.Column(
+        db.DateTime,
+    )
+
+    # unread notifications, kept by notifications.py for the navbar badge
+    unread_notifications = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default="0",
+    )
+
     messages = db.relationship('Message', backref="user")
 
     liked_messages = db.relationship(
         "Message",
         secondary="likes",
+        # likes.message_id has no foreign key; see Message
+        primaryjoin="User.id == Like.user_id",
+        secondaryjoin="foreign(Like.message_id) == Message.id",
         backref="likes"
     )
 
@@ -91,6 +302,12 @@ class User(db.Model):
         backref="following",
     )
 
+    __table_args__ = (
+        # case-insensitive lookups for signup checks (see uniqueness.py)
+        db.Index("ix_users_username_lower", db.func.lower(username)),
+        db.Index("ix_users_email_lower", db.func.lower(email)),
+    )
+
     def __repr__(self):
         return f"<User #{self.id}: {self.username}, {self.email}>"
 
@@ -113,6 +330,18 @@ class User(db.Model):
         db.session.add(user)
         return user
 
+    @classmethod
+    def active(cls):
+        """Query for users who haven't deleted their account."""
+
+        return cls.query.filter(cls.deleted_at.is_(None))
+
+    @classmethod
+    def get_active_or_404(cls, user_id):
+        """Get the user with `user_id`, unless they've deleted their account."""
+
+        return cls.active().filter_by(id=user_id).first_or_404()
+
     @classmethod
     def authenticate(cls, username, password):
         """Find user with `username` and `password`.
@@ -125,7 +354,7 @@ class User(db.Model):
         False.
         """
 
-        user = cls.query.filter_by(username=username).first()
+        user = cls.active().filter_by(username=username).first()
 
         if user:
             is_auth = bcrypt.check_password_hash(user.password, password)
@@ -134,9 +363,134 @@ class User(db.Model):
 
         return False
 
+    @property
+    def following_count(self):
+        """Number of users this user is following."""
+
+        graph = follow_graph()
+        if graph:
+            return graph.following_count(self.id)
+        return len(self.following)
+
+    @property
+    def followers_count(self):
+        """Number of users following this user."""
+
+        graph = follow_graph()
+        if graph:
+            return graph.follower_count(self.id)
+        return len(self.followers)
+
+    def following_ids(self):
+        """Ids of the users this user is following."""
+
+        graph = follow_graph()
+        if graph:
+            return graph.following_ids(self.id)
+        return [user.id for user in self.following]
+
+    def followers_page(self, viewer, after=None, limit=24):
+        """This user's followers, in id order, from after `after`.
+
+        Returns up to `limit` (user, viewer follows them) pairs.
+        """
+
+        return self._follows_page(
+            Follows.user_being_followed_id,
+            Follows.user_following_id,
+            viewer, after, limit)
+
+    def following_page(self, viewer, after=None, limit=24):
+        """The users this user follows, in id order, from after `after`.
+
+        Returns up to `limit` (user, viewer follows them) pairs.
+        """
+
+        return self._follows_page(
+            Follows.user_following_id,
+            Follows.user_being_followed_id,
+            viewer, after, limit)
+
+    def _follows_page(self, this_user_id, other_user_id, viewer, after, limit):
+        viewer_follows = db.aliased(Follows)
+
+        query = (db.select(User, viewer_follows.user_following_id.isnot(None))
+                 .select_from(Follows)
+                 .join(User, User.id == other_user_id)
+                 .outerjoin(viewer_follows, db.and_(
+                     viewer_follows.user_following_id == viewer.id,
+                     viewer_follows.user_being_followed_id == User.id))
+                 .where(this_user_id == self.id, User.deleted_at.is_(None))
+                 .order_by(other_user_id)
+                 .limit(limit))
+
+        if after is not None:
+            query = query.where(other_user_id > after)
+
+        return db.session.execute(query).all()
+
+    @property
+    def messages_count(self):
+        """Number of messages this user has posted."""
+
+        return db.session.scalar(
+            db.select(db.func.count())
+            .select_from(Message)
+            .where(Message.user_id == self.id))
+
+    @property
+    def likes_count(self):
+        """Number of messages this user has liked."""
+
+        return db.session.scalar(
+            db.select(db.func.count())
+            .select_from(Like)
+            .where(Like.user_id == self.id))
+
+    def liked_messages_page(self, before=None, limit=20):
+        """This user's liked messages, most recently liked first.
+
+        Returns up to `limit` (message, liked_at) pairs liked before
+        `before`, a (liked_at, message_id) pair from the previous page.
+        """
+
+        query = (db.select(Message, Like.liked_at)
+                 .join(Like, Like.message_id == Message.id)
+                 .join(User, User.id == Message.user_id)
+                 .where(Like.user_id == self.id, User.deleted_at.is_(None))
+                 .options(db.selectinload(Message.user))
+                 .order_by(Like.liked_at.desc(), Like.message_id.desc())
+                 .limit(limit))
+
+        if before:
+            query = query.where(
+                db.tuple_(Like.liked_at, Like.message_id) < before)
+
+        return db.session.execute(query).all()
+
+    def follow_suggestions(self, limit=5):
+        """Users this user might want to follow, best first."""
+
+        suggested = (User
+                     .query
+                     .join(FollowSuggestion,
+                           FollowSuggestion.suggested_user_id == User.id)
+                     .filter(FollowSuggestion.user_id == self.id,
+                             User.deleted_at.is_(None))
+                     .order_by(FollowSuggestion.rank)
+                     .all())
+
+        # suggestions are only as fresh as the last batch run
+        return [user for user in suggested
+                if not self.is_following(user)][:limit]
+
     def is_followed_by(self, other_user):
         """Is this user followed by `other_user`?"""
 
+        graph = follow_graph()
+        if graph:
+            return graph.is_following(other_user.id, self.id)
+
         found_user_list = [
             user for user in self.followers if user == other_user]
         return len(found_user_list) == 1
@@ -144,6 +498,10 @@ class User(db.Model):
     def is_following(self, other_user):
         """Is this user following `other_use`?"""
 
+        graph = follow_graph()
+        if graph:
+            return graph.is_following(self.id, other_user.id)
+
         found_user_list = [
             user for user in self.following if user == other_user]
         return len(found_user_list) == 1
@@ -159,12 +517,19 @@ class User(db.Model):
 class Message(db.Model):
     """An individual message ("warble").
     Connection of likes <-> liked_messages
+
+    On PostgreSQL the table is partitioned by month on `timestamp` (see
+    archive.py), so its primary key has to include `timestamp`; the ORM
+    still identifies messages by id alone. Foreign keys can't reference
+    `id` alone either, so a trigger deletes a message's likes, like buckets
+    and trending counts instead of ON DELETE CASCADE.
     """
 
     __tablename__ = 'messages'
 
     id = db.Column(
         db.Integer,
+        db.Identity(),
         primary_key=True,
     )
 
@@ -175,6 +540,7 @@ class Message(db.Model):
 
     timestamp = db.Column(
         db.DateTime,
+        primary_key=True,
         nullable=False,
         default=datetime.utcnow,
     )
@@ -183,35 +549,339 @@ class Message(db.Model):
         db.Integer,
         db.ForeignKey('users.id', ondelete='CASCADE'),
         nullable=False,
+        index=True,
     )
 
     # likes = backreference to liked_messages on User
 
+    # read back from the archive (see archive.ArchivedMessage)?
+    archived = False
+
+    __table_args__ = {
+        "postgresql_partition_by": "RANGE (timestamp)",
+    }
+
+    __mapper_args__ = {
+        "primary_key": [id],
+    }
+
+    @staticmethod
+    def like_counts(message_ids):
+        """Number of likes of each of these messages, by message id.
+
+        Messages nobody has liked are left out.
+        """
+
+        if not message_ids:
+            return {}
+
+        return dict(db.session.execute(
+            db.select(Like.message_id, db.func.count(Like.user_id))
+            .where(Like.message_id.in_(message_ids))
+            .group_by(Like.message_id)).all())
+
+
+event.listen(
+    Message.__table__,
+    "after_create",
+    DDL("""
+        CREATE OR REPLACE FUNCTION delete_message_rows() RETURNS trigger AS $$
+        BEGIN
+            -- a row moved to another partition is deleted and reinserted
+            IF NOT EXISTS (SELECT 1 FROM messages WHERE id = OLD.id) THEN
+                DELETE FROM likes WHERE message_id = OLD.id;
+                DELETE FROM like_buckets WHERE message_id = OLD.id;
+                DELETE FROM trending_counts WHERE message_id = OLD.id;
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+
+        CREATE TRIGGER messages_delete_rows
+        AFTER DELETE ON messages
+        FOR EACH ROW EXECUTE FUNCTION delete_message_rows();
+
+        CREATE TABLE messages_default PARTITION OF messages DEFAULT;
+    """).execute_if(dialect="postgresql"),
+)
+
 
 def connect_db(app):
-    """Connects this database to provided Flask app."""
+    """Connects this database to provided Flask app.
+
+    Engines don't connect until first used. Forked children (e.g. gunicorn
+    workers started with --preload) drop any connections inherited from
+    their parent and open their own.
+    """
 
-    app.app_context().push()
-    db.app = app
     db.init_app(app)
 
+    def reset_engines():
+        with app.app_context():
+            for engine in db.engines.values():
+                engine.dispose(close=False)
+
+    os.register_at_fork(after_in_child=reset_engines)
+
 
 class Like(db.Model):
     """ Join table for users and liked_messages"""
 
     __tablename__ = "likes"
 
+    # no foreign key to messages; see Message
     message_id = db.Column(
         db.Integer,
-        db.ForeignKey("messages.id"),
         primary_key=True
     )
 
     user_id = db.Column(
         db.Integer,
-        db.ForeignKey("users.id"),
+        db.ForeignKey("users.id", ondelete="cascade"),
         primary_key=True
     )
 
+    liked_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.utcnow,
+        server_default=db.func.now(),
+    )
+
+    __table_args__ = (
+        # a user's likes, newest first (liked messages page)
+        db.Index(
+            "ix_likes_user_id_liked_at",
+            user_id,
+            liked_at.desc(),
+            message_id.desc(),
+        ),
+    )
+
+
+class LikeBucket(db.Model):
+    """Number of likes a message got in one time bucket (see trending.py)."""
+
+    __tablename__ = "like_buckets"
 
+    # no foreign key to messages; see Message
+    message_id = db.Column(
+        db.Integer,
+        primary_key=True,
+    )
+
+    # start of the bucket, in seconds since the epoch (UTC)
+    bucket = db.Column(
+        db.BigInteger,
+        primary_key=True,
+    )
+
+    like_count = db.Column(
+        db.Integer,
+        nullable=False,
+    )
+
+
+class TrendingCount(db.Model):
+    """Number of likes a message got in a trending period (see trending.py)."""
+
+    __tablename__ = "trending_counts"
+
+    # "hour", "day" or "week"
+    period = db.Column(
+        db.Text,
+        primary_key=True,
+    )
+
+    # no foreign key to messages; see Message
+    message_id = db.Column(
+        db.Integer,
+        primary_key=True,
+    )
+
+    like_count = db.Column(
+        db.Integer,
+        nullable=False,
+    )
+
+    __table_args__ = (
+        db.Index(
+            "ix_trending_counts_period_like_count",
+            period,
+            like_count.desc(),
+            message_id,
+        ),
+    )
+
+
+class NotificationEvent(db.Model):
+    """A like or follow waiting to be grouped into a notification.
+
+    Appended by the like and follow routes, and consumed (deleted) by
+    notifications.aggregate, so it has no indexes but its primary key.
+    """
+
+    __tablename__ = "notification_events"
+
+    id = db.Column(
+        db.BigInteger,
+        primary_key=True,
+    )
+
+    # who's being notified
+    user_id = db.Column(
+        db.Integer,
+        nullable=False,
+    )
+
+    # "like" or "follow"
+    kind = db.Column(
+        db.Text,
+        nullable=False,
+    )
+
+    # who liked or followed
+    actor_id = db.Column(
+        db.Integer,
+        nullable=False,
+    )
+
+    # the liked message; no foreign key to messages, see Message
+    message_id = db.Column(
+        db.Integer,
+    )
+
+    created_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.utcnow,
+    )
 
+
+class Notification(db.Model):
+    """Likes of a message, or follows, grouped for a user (see
+    notifications.py): "12 people liked your warble".
+    """
+
+    __tablename__ = "notifications"
+
+    id = db.Column(
+        db.Integer,
+        primary_key=True,
+    )
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete="cascade"),
+        nullable=False,
+    )
+
+    # "like" or "follow"
+    kind = db.Column(
+        db.Text,
+        nullable=False,
+    )
+
+    # the liked message, for likes; no foreign key to messages, see Message
+    message_id = db.Column(
+        db.Integer,
+    )
+
+    # number of likes or follows
+    count = db.Column(
+        db.Integer,
+        nullable=False,
+    )
+
+    # the latest user to like or follow
+    actor_id = db.Column(
+        db.Integer,
+        nullable=False,
+    )
+
+    updated_at = db.Column(
+        db.DateTime,
+        nullable=False,
+    )
+
+    read_at = db.Column(
+        db.DateTime,
+    )
+
+    __table_args__ = (
+        # a user's notifications, newest first
+        db.Index(
+            "ix_notifications_user_id_updated_at",
+            user_id,
+            updated_at.desc(),
+        ),
+        # at most one unread notification per message liked (or for
+        # follows), which new events are added to
+        db.Index(
+            "ix_notifications_unread",
+            user_id,
+            kind,
+            db.func.coalesce(message_id, 0),
+            unique=True,
+            postgresql_where=read_at.is_(None),
+        ),
+    )
+
+
+class ActivityCount(db.Model):
+    """Part of the count of one metric in an hour or day (see activity.py).
+
+    Each count is split into shards, by user id, so that concurrent writes
+    don't all wait on one row.
+    """
+
+    __tablename__ = "activity_counts"
+
+    # "hour" or "day"
+    granularity = db.Column(
+        db.Text,
+        primary_key=True,
+    )
+
+    period_start = db.Column(
+        db.DateTime,
+        primary_key=True,
+    )
+
+    # "messages", "likes", "follows", "signups" or "active_users"
+    metric = db.Column(
+        db.Text,
+        primary_key=True,
+    )
+
+    shard = db.Column(
+        db.SmallInteger,
+        primary_key=True,
+    )
+
+    count = db.Column(
+        db.Integer,
+        nullable=False,
+    )
+
+
+class ActiveUser(db.Model):
+    """A user who was active in an hour or day (see activity.py)."""
+
+    __tablename__ = "active_users"
+
+    granularity = db.Column(
+        db.Text,
+        primary_key=True,
+    )
+
+    period_start = db.Column(
+        db.DateTime,
+        primary_key=True,
+    )
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete="cascade"),
+        primary_key=True,
+    )
@@ -0,0 +1,246 @@
+"""Like and follow notifications, grouped in batch.
+
+A like or follow only appends a row to `notification_events`, in the same
+transaction (`queue_notification`). A batch (`aggregate`, run from cron or
+the jobs worker) takes events off that queue and adds them to each user's
+unread notification for that message, or for follows, creating it if
+there isn't one -- so a popular warble gets "12 people liked your warble"
+rather than twelve notifications.
+
+Each user's number of unread notifications is kept in
+`users.unread_notifications` by the batch and the notifications page, so
+the navbar badge is a primary key lookup. Both lock the user's row first,
+so the count stays right when they run at once.
+
+Counts are of likes and follows, not people: someone who unlikes and
+likes again is counted twice, unless both land in the same batch.
+"""
+
+import time
+from datetime import datetime
+
+import click
+from flask import g
+from sqlalchemy import (
+    and_, bindparam, delete, func, literal_column, select, update)
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import aliased
+
+from models import db, Message, Notification, NotificationEvent, User
+
+DEFAULT_CONFIG = {
+    "NOTIFICATIONS_BATCH_SIZE": 1000,
+    "NOTIFICATIONS_PER_PAGE": 50,
+}
+
+
+def queue_notification(user_id, kind, actor_id, message_id=None):
+    """Queue a notification for `user_id`; commit it with the like or
+    follow.
+    """
+
+    db.session.add(NotificationEvent(
+        user_id=user_id,
+        kind=kind,
+        actor_id=actor_id,
+        message_id=message_id,
+        created_at=datetime.utcnow()))
+
+
+def take_events(limit):
+    """Delete up to `limit` of the oldest queued events; return them.
+
+    Events another batch has taken, but not committed, are skipped.
+    """
+
+    oldest = (select(NotificationEvent.id)
+              .order_by(NotificationEvent.id)
+              .limit(limit)
+              .with_for_update(skip_locked=True))
+
+    return db.session.execute(
+        delete(NotificationEvent)
+        .where(NotificationEvent.id.in_(oldest))
+        .returning(NotificationEvent.user_id,
+                   NotificationEvent.kind,
+                   NotificationEvent.actor_id,
+                   NotificationEvent.message_id,
+                   NotificationEvent.created_at)).all()
+
+
+def group_events(events):
+    """Return a notification row per (user, kind, message) in `events`."""
+
+    groups = {}
+    for user_id, kind, actor_id, message_id, created_at in sorted(
+            events, key=lambda event: event.created_at):
+        key = (user_id, kind, message_id)
+        actors = groups.setdefault(key, {})
+        actors.pop(actor_id, None)
+        actors[actor_id] = created_at
+
+    rows = []
+    for (user_id, kind, message_id), actors in groups.items():
+        actor_id, updated_at = list(actors.items())[-1]
+        rows.append({
+            "user_id": user_id,
+            "kind": kind,
+            "message_id": message_id,
+            "count": len(actors),
+            "actor_id": actor_id,
+            "updated_at": updated_at,
+        })
+    return rows
+
+
+def add_notifications(rows):
+    """Add `rows` to their users' unread notifications.
+
+    Returns {user id: number of new unread notifications}.
+    """
+
+    notifications = Notification.__table__
+
+    stmt = pg_insert(notifications).values(rows)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[
+            notifications.c.user_id,
+            notifications.c.kind,
+            func.coalesce(notifications.c.message_id, 0),
+        ],
+        index_where=notifications.c.read_at.is_(None),
+        set_={
+            "count": notifications.c.count + stmt.excluded.count,
+            "actor_id": stmt.excluded.actor_id,
+            "updated_at": func.greatest(
+                notifications.c.updated_at, stmt.excluded.updated_at),
+        })
+
+    # xmax is 0 for rows that were inserted, rather than updated
+    added = {}
+    for user_id, inserted in db.session.execute(stmt.returning(
+            notifications.c.user_id, literal_column("xmax = 0"))):
+        if inserted:
+            added[user_id] = added.get(user_id, 0) + 1
+    return added
+
+
+def aggregate(batch_size):
+    """Group queued events into notifications, a batch per transaction.
+
+    Returns (events, new notifications).
+    """
+
+    total_events = total_added = 0
+
+    while True:
+        events = take_events(batch_size)
+        if not events:
+            break
+
+        # lock the users first (see mark_read); skip deleted ones
+        user_ids = set(db.session.scalars(
+            select(User.id)
+            .where(User.id.in_({event.user_id for event in events}),
+                   User.deleted_at.is_(None))
+            .order_by(User.id)
+            .with_for_update()))
+
+        rows = [row for row in group_events(events)
+                if row["user_id"] in user_ids]
+        added = add_notifications(rows) if rows else {}
+
+        users = User.__table__
+        if added:
+            db.session.execute(
+                update(users)
+                .where(users.c.id == bindparam("b_id"))
+                .values(unread_notifications=(
+                    users.c.unread_notifications + bindparam("b_added"))),
+                [{"b_id": user_id, "b_added": count}
+                 for user_id, count in added.items()])
+        db.session.commit()
+
+        total_events += len(events)
+        total_added += sum(added.values())
+        if len(events) < batch_size:
+            break
+
+    return total_events, total_added
+
+
+def unread_count(user_id):
+    """The number of `user_id`'s unread notifications, for the badge.
+
+    (Read from the database, not the user cache, which doesn't see the
+    batch's updates.)
+    """
+
+    return db.session.scalar(
+        select(User.unread_notifications).where(User.id == user_id)) or 0
+
+
+def notifications_page(user_id, limit):
+    """Return `user_id`'s latest `limit` (notification, actor, message)s.
+
+    The actor is None if they've deleted their account, and the message if
+    it's been deleted or archived.
+    """
+
+    actor = aliased(User)
+
+    return db.session.execute(
+        select(Notification, actor, Message)
+        .outerjoin(actor, and_(actor.id == Notification.actor_id,
+                                  actor.deleted_at.is_(None)))
+        .outerjoin(Message, Message.id == Notification.message_id)
+        .where(Notification.user_id == user_id)
+        .order_by(Notification.updated_at.desc(), Notification.id.desc())
+        .limit(limit)).all()
+
+
+def mark_read(user_id):
+    """Mark all of `user_id`'s notifications read; return their ids."""
+
+    db.session.execute(
+        select(User.id).where(User.id == user_id).with_for_update())
+    marked = set(db.session.scalars(
+        update(Notification)
+        .where(Notification.user_id == user_id,
+               Notification.read_at.is_(None))
+        .values(read_at=datetime.utcnow())
+        .returning(Notification.id)))
+    db.session.execute(
+        update(User.__table__)
+        .where(User.__table__.c.id == user_id)
+        .values(unread_notifications=0))
+    db.session.commit()
+
+    return marked
+
+
+def init_notifications(app):
+    """Set up `app`'s notification settings, badge and CLI."""
+
+    for key, value in DEFAULT_CONFIG.items():
+        app.config.setdefault(key, value)
+
+    @app.context_processor
+    def add_unread_notifications():
+        user = g.get("user")
+        return {"unread_notifications": unread_count(user.id) if user else 0}
+
+    @app.cli.group("notifications")
+    def notifications_cli():
+        """Notification commands."""
+
+    @notifications_cli.command("aggregate")
+    def aggregate_command():
+        """Group queued likes and follows into notifications."""
+
+        start = time.perf_counter()
+        events, added = aggregate(app.config["NOTIFICATIONS_BATCH_SIZE"])
+        elapsed = time.perf_counter() - start
+
+        click.echo(f"{events} events, {added} new notifications "
+                   f"in {elapsed:.2f}s")
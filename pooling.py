@@ -0,0 +1,207 @@
+"""Database connection pool settings and utilization reporting.
+
+Pool settings are read from config (usually set from env vars of the same
+name, see `pool_config_from_env`):
+
+- DB_POOL_SIZE: connections kept open per worker; 0 disables client-side
+  pooling (NullPool), e.g. when pgbouncer does all the pooling
+- DB_MAX_OVERFLOW: extra connections allowed at peak
+- DB_POOL_TIMEOUT: seconds to wait for a connection before erroring
+- DB_POOL_RECYCLE: seconds before a connection is replaced; each worker adds
+  up to 10% jitter, drawn after it's forked, so workers started together
+  don't reconnect together
+- DB_POOL_PRE_PING: test connections on checkout
+- DB_STATEMENT_TIMEOUT: PostgreSQL statement timeout in ms (0 is no limit)
+- DB_PGBOUNCER: pgbouncer transaction-mode friendly settings; the statement
+  timeout is set per transaction rather than per connection
+- DB_POOL_REPORT_INTERVAL: seconds between pool utilization log lines (0 is
+  never); these are logged at INFO, so setting it turns on the app logger's
+  INFO messages
+"""
+
+import logging
+import os
+import random
+import time
+
+from flask import current_app
+from sqlalchemy import event
+from sqlalchemy.pool import NullPool
+
+from models import db
+
+POOL_DEFAULTS = {
+    "DB_POOL_SIZE": 5,
+    "DB_MAX_OVERFLOW": 10,
+    "DB_POOL_TIMEOUT": 30,
+    "DB_POOL_RECYCLE": 1800,
+    "DB_POOL_PRE_PING": True,
+    "DB_STATEMENT_TIMEOUT": 0,
+    "DB_PGBOUNCER": False,
+    "DB_POOL_REPORT_INTERVAL": 0,
+}
+
+
+def pool_config_from_env(environ):
+    """Return pool settings found in `environ`, converted to the right type."""
+
+    config = {}
+
+    for key, default in POOL_DEFAULTS.items():
+        if key not in environ:
+            continue
+
+        value = environ[key]
+        if isinstance(default, bool):
+            config[key] = value.lower() in ("1", "true", "yes", "on")
+        else:
+            config[key] = int(value)
+
+    return config
+
+
+def engine_options(config):
+    """Build SQLAlchemy engine options from pool settings in `config`."""
+
+    options = {"pool_pre_ping": config["DB_POOL_PRE_PING"]}
+    url = config.get("SQLALCHEMY_DATABASE_URI") or ""
+
+    if config["DB_POOL_SIZE"] == 0:
+        options["poolclass"] = NullPool
+
+    elif not url.startswith("sqlite"):
+        # jittered per process by `init_pool_recycle`
+        options.update(
+            pool_size=config["DB_POOL_SIZE"],
+            max_overflow=config["DB_MAX_OVERFLOW"],
+            pool_timeout=config["DB_POOL_TIMEOUT"],
+            pool_recycle=config["DB_POOL_RECYCLE"],
+        )
+
+    timeout = config["DB_STATEMENT_TIMEOUT"]
+    if timeout and url.startswith("postgres") and not config["DB_PGBOUNCER"]:
+        options["connect_args"] = {
+            "options": f"-c statement_timeout={timeout}"}
+
+    return options
+
+
+def set_local_statement_timeout(engine, timeout):
+    """Set the statement timeout at the start of each transaction.
+
+    pgbouncer in transaction mode hands each transaction a different server
+    connection, so settings must be made with SET LOCAL inside it.
+    """
+
+    @event.listens_for(engine, "begin")
+    def set_timeout(conn):
+        conn.exec_driver_sql(f"SET LOCAL statement_timeout = {int(timeout)}")
+
+
+def jitter_recycle(engine, recycle):
+    """Set `engine`'s pool to recycle connections after `recycle` seconds
+    plus up to 10%.
+    """
+
+    # only pools created with a recycle time (see engine_options)
+    if recycle > 0 and getattr(engine.pool, "_recycle", -1) >= 0:
+        engine.pool._recycle = recycle + random.randint(0, recycle // 10)
+
+
+def pool_status(engine):
+    """Return a dict describing `engine`'s pool utilization."""
+
+    pool = engine.pool
+    status = {"pool": type(pool).__name__}
+
+    if hasattr(pool, "checkedout"):
+        status.update(
+            size=pool.size(),
+            checked_out=pool.checkedout(),
+            checked_in=pool.checkedin(),
+            overflow=pool.overflow(),
+        )
+
+    return status
+
+
+def init_pool(app):
+    """Apply pool settings to `app`'s engine options and set up reporting.
+
+    Must be called before `connect_db` (and `init_replicas`), which create
+    the engines.
+    """
+
+    for key, value in POOL_DEFAULTS.items():
+        app.config.setdefault(key, value)
+
+    options = app.config.setdefault("SQLALCHEMY_ENGINE_OPTIONS", {})
+    for key, value in engine_options(app.config).items():
+        options.setdefault(key, value)
+
+    if (app.config["DB_POOL_REPORT_INTERVAL"] and
+            not app.logger.isEnabledFor(logging.INFO)):
+        app.logger.setLevel(logging.INFO)
+
+    last_report = time.monotonic()
+
+    @app.after_request
+    def report_pool_status(response):
+        """Log pool utilization every DB_POOL_REPORT_INTERVAL seconds."""
+
+        nonlocal last_report
+
+        interval = current_app.config["DB_POOL_REPORT_INTERVAL"]
+        now = time.monotonic()
+
+        if interval and now - last_report >= interval:
+            last_report = now
+            log_pool_status(current_app)
+
+        return response
+
+
+def log_pool_status(app):
+    """Log pool utilization for the primary and any replicas."""
+
+    engines = [db.engine] + app.extensions.get("warbler_replicas", [])
+    for engine in engines:
+        app.logger.info(
+            "db pool pid=%s url=%s %s",
+            os.getpid(),
+            engine.url.render_as_string(hide_password=True),
+            " ".join(f"{k}={v}" for k, v in pool_status(engine).items()),
+        )
+
+
+def init_pool_recycle(app):
+    """Jitter the recycle time of `app`'s engines' pools, now and again in
+    each forked child (e.g. gunicorn workers started with --preload), so
+    that every worker draws its own.
+
+    Must be called after `connect_db`, whose at-fork reset runs first.
+    """
+
+    def jitter():
+        recycle = app.config["DB_POOL_RECYCLE"]
+        with app.app_context():
+            engines = list(db.engines.values())
+        for engine in engines + app.extensions.get("warbler_replicas", []):
+            jitter_recycle(engine, recycle)
+
+    jitter()
+    os.register_at_fork(after_in_child=jitter)
+
+
+def init_pgbouncer(app):
+    """Set per-transaction statement timeouts when running behind pgbouncer.
+
+    Must be called after `connect_db`.
+    """
+
+    timeout = app.config["DB_STATEMENT_TIMEOUT"]
+    if not (app.config["DB_PGBOUNCER"] and timeout):
+        return
+
+    for engine in [db.engine] + app.extensions.get("warbler_replicas", []):
+        set_local_statement_timeout(engine, timeout)
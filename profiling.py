@@ -0,0 +1,230 @@
+"""On-demand request profiling for Warbler.
+
+A single request is profiled when it carries a valid signed token, either in
+the `X-Warbler-Profile` header or the `_profile` query param. Tokens are
+minted with `flask profiling token` and are signed with the app's SECRET_KEY,
+so only someone with access to the deployment can turn profiling on.
+
+Aggregate mode profiles 1-in-N requests to PROFILE_SAMPLE_ENDPOINT and merges
+them into one file per endpoint and worker.
+
+Output goes to PROFILE_DIR as either a flame-graph-compatible collapsed-stack
+file (PROFILE_FORMAT = "collapsed", the default) or a pstats dump
+(PROFILE_FORMAT = "pstats").
+"""
+
+import cProfile
+import itertools
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+
+import click
+from flask import current_app, g, request
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+
+PROFILE_HEADER = "X-Warbler-Profile"
+PROFILE_PARAM = "_profile"
+TOKEN_SALT = "warbler-profile"
+
+DEFAULT_CONFIG = {
+    "PROFILE_DIR": "profiles",
+    "PROFILE_FORMAT": "collapsed",
+    "PROFILE_INTERVAL": 0.001,
+    "PROFILE_TOKEN_MAX_AGE": 3600,
+    "PROFILE_SAMPLE_ENDPOINT": None,
+    "PROFILE_SAMPLE_RATE": 0,
+}
+
+# aggregate files are read-merge-written, so threads take turns
+_aggregate_lock = threading.Lock()
+
+
+class SamplingProfiler:
+    """Sample the call stack of the calling thread at a fixed interval.
+
+    Samples are kept as collapsed stacks ("outer;inner;leaf" -> count), the
+    format consumed by flamegraph.pl and speedscope.
+    """
+
+    def __init__(self, interval=0.001):
+        self.interval = interval
+        self.samples = Counter()
+        self._thread_id = None
+        self._sampler = None
+        self._stopped = threading.Event()
+
+    def start(self):
+        self._thread_id = threading.get_ident()
+        self._sampler = threading.Thread(target=self._run, daemon=True)
+        self._sampler.start()
+
+    def stop(self):
+        self._stopped.set()
+        self._sampler.join()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self._thread_id)
+            if frame is not None:
+                self.samples[collapse_stack(frame)] += 1
+
+    def write(self, path, merge=False):
+        """Write samples to `path`, merging with its counts if `merge`."""
+
+        samples = Counter(self.samples)
+        if merge and os.path.exists(path):
+            samples.update(read_collapsed(path))
+
+        with open(path, "w") as f:
+            for stack, count in samples.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+class TracingProfiler:
+    """Thin wrapper giving cProfile the same interface as SamplingProfiler."""
+
+    def __init__(self):
+        self.profile = cProfile.Profile()
+
+    def start(self):
+        self.profile.enable()
+
+    def stop(self):
+        self.profile.disable()
+
+    def write(self, path, merge=False):
+        """Dump stats to `path`, merging with the stats there if `merge`."""
+
+        stats = pstats.Stats(self.profile)
+        if merge and os.path.exists(path):
+            stats.add(path)
+        stats.dump_stats(path)
+
+
+def collapse_stack(frame):
+    """Return `frame`'s stack as "file:function;..." from outermost frame."""
+
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+def read_collapsed(path):
+    """Read a collapsed-stack file back into a Counter."""
+
+    samples = Counter()
+    with open(path) as f:
+        for line in f:
+            stack, _, count = line.rstrip("\n").rpartition(" ")
+            samples[stack] += int(count)
+    return samples
+
+
+def _serializer(app):
+    return URLSafeTimedSerializer(app.config["SECRET_KEY"], salt=TOKEN_SALT)
+
+
+def make_profile_token(app):
+    """Return a signed token that switches on profiling for a request."""
+
+    return _serializer(app).dumps("profile")
+
+
+def has_valid_token(app):
+    """Does the current request carry a valid profiling token?"""
+
+    token = (request.headers.get(PROFILE_HEADER) or
+             request.args.get(PROFILE_PARAM))
+    if not token:
+        return False
+
+    try:
+        _serializer(app).loads(
+            token, max_age=app.config["PROFILE_TOKEN_MAX_AGE"])
+    except BadSignature:
+        return False
+
+    return True
+
+
+def init_profiling(app):
+    """Register the profiling hooks and CLI on `app`.
+
+    Call this before registering other request hooks so that the profile
+    covers them too.
+    """
+
+    for key, value in DEFAULT_CONFIG.items():
+        app.config.setdefault(key, value)
+
+    counter = itertools.count(1)
+
+    @app.before_request
+    def start_profiler():
+        """Start a profiler if this request asked for one or was sampled."""
+
+        config = current_app.config
+        aggregate = False
+
+        if not has_valid_token(current_app):
+            rate = config["PROFILE_SAMPLE_RATE"]
+            if (not rate or
+                    request.endpoint != config["PROFILE_SAMPLE_ENDPOINT"] or
+                    next(counter) % rate):
+                return
+            aggregate = True
+
+        if config["PROFILE_FORMAT"] == "pstats":
+            profiler = TracingProfiler()
+        else:
+            profiler = SamplingProfiler(config["PROFILE_INTERVAL"])
+
+        g.profiler = profiler
+        g.profiler_aggregate = aggregate
+        profiler.start()
+
+    @app.teardown_request
+    def stop_profiler(exc):
+        """Stop this request's profiler, if any, and save its output."""
+
+        profiler = g.pop("profiler", None)
+        if profiler is None:
+            return
+
+        profiler.stop()
+
+        config = current_app.config
+        ext = "prof" if config["PROFILE_FORMAT"] == "pstats" else "collapsed"
+        endpoint = request.endpoint or "unknown"
+
+        if g.pop("profiler_aggregate", False):
+            name = f"aggregate-{endpoint}-{os.getpid()}.{ext}"
+        else:
+            stamp = time.strftime("%Y%m%d-%H%M%S")
+            name = f"{stamp}-{endpoint}-{os.getpid()}-{time.monotonic_ns()}.{ext}"
+
+        os.makedirs(config["PROFILE_DIR"], exist_ok=True)
+        path = os.path.join(config["PROFILE_DIR"], name)
+
+        if name.startswith("aggregate-"):
+            with _aggregate_lock:
+                profiler.write(path, merge=True)
+        else:
+            profiler.write(path)
+
+    @app.cli.group()
+    def profiling():
+        """Request profiling commands."""
+
+    @profiling.command("token")
+    def token_command():
+        """Print a token that enables profiling for a request."""
+
+        click.echo(make_profile_token(app))
@@ -0,0 +1,172 @@
+"""Rate limiting, with token buckets in the app's cache.
+
+RATELIMITS maps endpoints to their limits, per client IP address ("ip")
+and/or per logged-in user ("user"):
+
+    RATELIMITS = {
+        "warbler.login": {"ip": "10/minute"},
+        "warbler.add_message": {"user": "30/minute"},
+    }
+
+A limit of "10/minute" is a bucket of 10 tokens, refilled at 10 a minute;
+each request the limit applies to takes a token, and a request that finds
+the bucket empty gets a 429 with Retry-After, before anything else is done
+for it. Limits only apply to requests that can change something, i.e. not
+to GET, HEAD or OPTIONS.
+
+Buckets live in the cache (cache.py), so workers share them when the cache
+is shared ("sqlite" or "redis"); with "lru" each worker has its own, so
+starting up logs a warning, and with "null" there are no buckets at all, so
+it refuses to (outside of tests, or with RATELIMIT_ENABLED off). Behind
+RATELIMIT_PROXIES proxies, the client's address is taken from
+X-Forwarded-For.
+"""
+
+import math
+import time
+
+from flask import request, session
+from werkzeug.exceptions import TooManyRequests
+
+from cache import cache_is_shared, get_cache
+
+DEFAULT_CONFIG = {
+    "RATELIMIT_ENABLED": True,
+    "RATELIMIT_PROXIES": 0,
+    "RATELIMITS": {
+        # bcrypt
+        "warbler.signup": {"ip": "5/minute"},
+        "warbler.login": {"ip": "10/minute"},
+        "warbler.profile": {"user": "10/minute"},
+        # writes
+        "warbler.start_following": {"user": "60/minute"},
+        "warbler.stop_following": {"user": "60/minute"},
+        "warbler.add_like_to_message": {"user": "60/minute"},
+        "warbler.remove_like_from_message": {"user": "60/minute"},
+        "warbler.add_message": {"user": "30/minute"},
+        "warbler.delete_message": {"user": "30/minute"},
+        "api.import_messages": {"user": "10/hour"},
+    },
+}
+
+SAFE_METHODS = {"GET", "HEAD", "OPTIONS"}
+
+PERIODS = {
+    "second": 1,
+    "minute": 60,
+    "hour": 60 * 60,
+    "day": 24 * 60 * 60,
+}
+
+
+def parse_limit(limit):
+    """Return (tokens, seconds to refill them) for e.g. "10/minute"."""
+
+    count, _, period = limit.partition("/")
+    try:
+        return int(count), PERIODS[period]
+    except (ValueError, KeyError):
+        raise ValueError(f"Bad rate limit: {limit!r}")
+
+
+class TokenBucket:
+    """`capacity` tokens, refilled at `capacity` per `period` seconds."""
+
+    def __init__(self, capacity, period):
+        self.capacity = capacity
+        self.rate = capacity / period
+        self.period = period
+
+    def take(self, cache, key, now=None):
+        """Take a token from the bucket at `key` in `cache`.
+
+        Returns 0 if there was one, or else the seconds until there is.
+        """
+
+        now = time.time() if now is None else now
+
+        def take(state):
+            # (tokens, when they were counted, seconds to wait)
+            tokens, at, _ = state or (self.capacity, now, 0)
+            tokens = min(self.capacity, tokens + (now - at) * self.rate)
+            if tokens >= 1:
+                return tokens - 1, now, 0
+            return tokens, now, (1 - tokens) / self.rate
+
+        # a bucket left alone for a period is full again, so it can expire
+        return cache.update(key, take, ttl=self.period)[2]
+
+
+class RateLimiter:
+    """The app's rate limits, by endpoint."""
+
+    def __init__(self, config, user_key):
+        self.config = config
+        # the session key holding the logged-in user's id
+        self.user_key = user_key
+        self.limits = {
+            endpoint: {scope: TokenBucket(*parse_limit(limit))
+                       for scope, limit in scopes.items()}
+            for endpoint, scopes in config["RATELIMITS"].items()
+        }
+
+        for scopes in self.limits.values():
+            for scope in scopes:
+                if scope not in ("ip", "user"):
+                    raise ValueError(f"Bad rate limit scope: {scope!r}")
+
+    def client_ip(self):
+        proxies = self.config["RATELIMIT_PROXIES"]
+        if proxies:
+            route = request.access_route
+            return route[max(len(route) - proxies, 0)]
+        return request.remote_addr
+
+    def check(self):
+        """Take a token from each of the request's buckets, or raise
+        TooManyRequests.
+        """
+
+        if request.method in SAFE_METHODS:
+            return
+
+        buckets = self.limits.get(request.endpoint)
+        if not buckets or not self.config["RATELIMIT_ENABLED"]:
+            return
+
+        idents = {"ip": self.client_ip(), "user": session.get(self.user_key)}
+
+        cache = get_cache()
+        wait = 0
+        for scope, bucket in buckets.items():
+            if idents[scope] is not None:
+                key = f"ratelimit:{request.endpoint}:{scope}:{idents[scope]}"
+                wait = max(wait, bucket.take(cache, key))
+
+        if wait:
+            raise TooManyRequests(
+                "Too many requests; try again later.",
+                retry_after=math.ceil(wait))
+
+
+def init_ratelimit(app, user_key):
+    """Set up `app`'s rate limits; `user_key` is the session key holding
+    the logged-in user's id.
+    """
+
+    for key, value in DEFAULT_CONFIG.items():
+        app.config.setdefault(key, value)
+
+    if app.config["RATELIMIT_ENABLED"] and not app.testing:
+        cache_type = app.config["CACHE_TYPE"]
+        if cache_type == "null":
+            raise ValueError(
+                "Rate limits need a cache; CACHE_TYPE 'null' would turn "
+                "them off (set RATELIMIT_ENABLED to False to run without)")
+        if not cache_is_shared(app.config):
+            app.logger.warning(
+                "Rate limits are per worker with CACHE_TYPE %r; use "
+                "'sqlite' or 'redis' to share them", cache_type)
+
+    limiter = app.extensions["ratelimit"] = RateLimiter(app.config, user_key)
+    app.before_request(limiter.check)
@@ -0,0 +1,87 @@
+"""Read-replica routing for Warbler.
+
+Replica URLs come from SQLALCHEMY_REPLICA_URLS. Each gets an engine built
+with the same SQLALCHEMY_ENGINE_OPTIONS as the primary.
+
+Views marked with `@read_only` have their queries sent to a random replica.
+Everything else -- and every flush -- goes to the primary. After a user's
+request writes to the database, their session sticks to the primary for
+REPLICA_STICKY_SECONDS so they always read their own writes.
+"""
+
+import os
+import random
+import time
+
+from flask import current_app, g, has_request_context, request, session
+from flask_sqlalchemy.session import Session
+from sqlalchemy import create_engine, event
+
+PRIMARY_UNTIL_KEY = "primary_until"
+
+
+def read_only(view):
+    """Mark a view as safe to serve from a read replica."""
+
+    view.read_only = True
+    return view
+
+
+class RoutingSession(Session):
+    """Session that sends reads from read-only views to a replica."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and use_replica():
+            replicas = current_app.extensions.get("warbler_replicas")
+            if replicas:
+                return random.choice(replicas)
+
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def use_replica():
+    """Should queries for the current request go to a replica?"""
+
+    return has_request_context() and g.get("use_replica", False)
+
+
+@event.listens_for(RoutingSession, "after_flush")
+def stick_to_primary(db_session, flush_context):
+    """After a write, read from the primary for the rest of this request
+    and for REPLICA_STICKY_SECONDS of this user's next requests."""
+
+    if has_request_context():
+        g.use_replica = False
+        session[PRIMARY_UNTIL_KEY] = (
+            time.time() + current_app.config["REPLICA_STICKY_SECONDS"])
+
+
+def init_replicas(app):
+    """Create replica engines and register the routing hook on `app`."""
+
+    app.config.setdefault("SQLALCHEMY_REPLICA_URLS", [])
+    app.config.setdefault("REPLICA_STICKY_SECONDS", 5)
+
+    options = app.config.get("SQLALCHEMY_ENGINE_OPTIONS", {})
+
+    replicas = app.extensions["warbler_replicas"] = [
+        create_engine(url, **options)
+        for url in app.config["SQLALCHEMY_REPLICA_URLS"]
+    ]
+
+    def reset_engines():
+        for engine in replicas:
+            engine.dispose(close=False)
+
+    os.register_at_fork(after_in_child=reset_engines)
+
+    @app.before_request
+    def route_to_replica():
+        """Use a replica for read-only views, unless this user just wrote."""
+
+        view = current_app.view_functions.get(request.endpoint)
+
+        g.use_replica = (
+            getattr(view, "read_only", False) and
+            session.get(PRIMARY_UNTIL_KEY, 0) < time.time()
+        )
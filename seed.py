@@ -1,8 +1,12 @@
 """Seed database with sample data from CSV Files."""
 
 from csv import DictReader
-from app import db
-from models import User, Message, Follows
+from app import create_app
+from archive import create_partitions
+from models import db, User, Message, Follows
+
+app = create_app()
+app.app_context().push()
 
 db.drop_all()
 db.create_all()
@@ -17,3 +21,7 @@ with open('generator/follows.csv') as follows:
     db.session.bulk_insert_mappings(Follows, DictReader(follows))
 
 db.session.commit()
+
+if db.engine.dialect.name == "postgresql":
+    # move the messages out of the default partition
+    create_partitions()
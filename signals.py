@@ -0,0 +1,32 @@
+"""Signals sent by Warbler's write routes.
+
+Each is sent with the app as sender, after the route's transaction commits,
+so receivers only ever see changes that happened.
+"""
+
+from blinker import Namespace
+
+warbler_signals = Namespace()
+
+# follower_id, followed_id
+followed = warbler_signals.signal("followed")
+unfollowed = warbler_signals.signal("unfollowed")
+
+# message_id, user_id (the author)
+message_posted = warbler_signals.signal("message_posted")
+message_deleted = warbler_signals.signal("message_deleted")
+
+# user_id, message_ids (of a bulk import)
+messages_imported = warbler_signals.signal("messages_imported")
+
+# user_id, username, email
+user_signed_up = warbler_signals.signal("user_signed_up")
+
+# user_id, username (the new one)
+user_renamed = warbler_signals.signal("user_renamed")
+
+# user_id, email (the new one)
+user_email_changed = warbler_signals.signal("user_email_changed")
+
+# user_id (the account is marked deleted)
+user_deleted = warbler_signals.signal("user_deleted")
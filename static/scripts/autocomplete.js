@@ -0,0 +1,58 @@
+"use strict";
+
+// Suggest usernames in the navbar search box as they're typed.
+//
+// Suggestions come from /api/users/autocomplete, at most one request at a
+// time; picking one goes straight to that user's profile.
+
+const $search = document.getElementById("search");
+const $suggestions = document.getElementById("search-suggestions");
+let inFlight = false;
+let queued = false;
+let userIds = {};
+
+async function suggest() {
+  if (inFlight) {
+    queued = true;
+    return;
+  }
+
+  const q = $search.value.trim();
+  if (!q) {
+    $suggestions.replaceChildren();
+    return;
+  }
+
+  inFlight = true;
+  try {
+    const resp = await fetch(
+      `/api/users/autocomplete?q=${encodeURIComponent(q)}`);
+    if (!resp.ok) return;
+
+    const { users } = await resp.json();
+    userIds = {};
+    $suggestions.replaceChildren(...users.map(user => {
+      userIds[user.username] = user.id;
+      const $option = document.createElement("option");
+      $option.value = user.username;
+      return $option;
+    }));
+  } finally {
+    inFlight = false;
+    if (queued) {
+      queued = false;
+      suggest();
+    }
+  }
+}
+
+if ($search && $suggestions) {
+  $search.addEventListener("input", evt => {
+    // a suggestion was picked
+    if (!evt.inputType && $search.value in userIds) {
+      window.location = `/users/${userIds[$search.value]}`;
+      return;
+    }
+    suggest();
+  });
+}
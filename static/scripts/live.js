@@ -0,0 +1,36 @@
+"use strict";
+
+// Add new messages to the top of the homepage timeline as they're posted.
+//
+// The server sends the id of each new message over /messages/stream; ids
+// arriving close together are fetched as rendered cards in one request.
+
+const $messages = document.getElementById("messages");
+let pendingIds = [];
+let fetchTimer = null;
+
+async function addPendingMessages() {
+  const ids = pendingIds.filter(
+    id => !$messages.querySelector(`[data-message-id="${id}"]`));
+  pendingIds = [];
+  fetchTimer = null;
+
+  if (ids.length === 0) return;
+
+  const resp = await fetch(`/messages/cards?ids=${ids.join(",")}`);
+  if (!resp.ok) return;
+
+  $messages.insertAdjacentHTML("afterbegin", await resp.text());
+}
+
+if ($messages && window.EventSource) {
+  const stream = new EventSource("/messages/stream");
+
+  stream.onmessage = function (evt) {
+    pendingIds.push(evt.data);
+    if (!fetchTimer) fetchTimer = setTimeout(addPendingMessages, 250);
+  };
+
+  // we fell behind or missed messages: start over
+  stream.addEventListener("reset", () => window.location.reload());
+}
@@ -0,0 +1,29 @@
+"use strict";
+
+// Say whether the username on the signup form is taken, as it's typed.
+//
+// Checks /signup/available once typing pauses; the server checks again
+// when the form is submitted.
+
+const $username = document.getElementById("username");
+let timer;
+
+async function checkUsername() {
+  const username = $username.value.trim();
+  $username.classList.remove("is-invalid", "is-valid");
+  if (!username) return;
+
+  const resp = await fetch(
+    `/signup/available?username=${encodeURIComponent(username)}`);
+  if (!resp.ok || $username.value.trim() !== username) return;
+
+  const { available } = await resp.json();
+  $username.classList.add(available ? "is-valid" : "is-invalid");
+}
+
+if ($username) {
+  $username.addEventListener("input", () => {
+    clearTimeout(timer);
+    timer = setTimeout(checkUsername, 300);
+  });
+}
@@ -0,0 +1,163 @@
+"""Batch job computing "who to follow" suggestions.
+
+A user's suggestions are the users followed by the people they follow
+(friends of friends) that they don't follow yet, ranked by how many of the
+people they follow follow them. That's the square of the follows adjacency
+matrix, minus existing follows; it's computed in the database as a join of
+`follows` with itself, grouped per (user, suggestion), a batch of users at a
+time, and the top SUGGESTIONS_PER_USER are written to `follow_suggestions`
+so serving them is a single primary key lookup.
+
+Run it from cron, more often than `follow_events` is pruned:
+
+    flask suggestions update          # users whose graph has changed
+    flask suggestions update --full   # everyone
+"""
+
+import time
+from datetime import datetime, timedelta
+
+import click
+from sqlalchemy import and_, delete, exists, func, insert, select
+from sqlalchemy.orm import aliased
+
+from models import db, Follows, FollowEvent, FollowSuggestion, User, Watermark
+
+DEFAULT_CONFIG = {
+    "SUGGESTIONS_PER_USER": 10,
+    "SUGGESTIONS_BATCH_SIZE": 1000,
+    # events newer than this may still have uncommitted ones before them
+    "SUGGESTIONS_SETTLE_SECONDS": 10,
+}
+
+WATERMARK_NAME = "follow_suggestions"
+
+
+def suggestions_query(user_ids, limit):
+    """Select the top `limit` suggestions for each of `user_ids`."""
+
+    mine = aliased(Follows)
+    theirs = aliased(Follows)
+    already = aliased(Follows)
+
+    user_id = mine.user_following_id
+    suggested_user_id = theirs.user_being_followed_id
+
+    scores = (
+        select(
+            user_id.label("user_id"),
+            suggested_user_id.label("suggested_user_id"),
+            func.count().label("score"),
+        )
+        .join(theirs,
+              theirs.user_following_id == mine.user_being_followed_id)
+        .where(user_id.in_(user_ids))
+        .where(suggested_user_id != user_id)
+        .where(~exists().where(and_(
+            already.user_following_id == user_id,
+            already.user_being_followed_id == suggested_user_id)))
+        .group_by(user_id, suggested_user_id)
+        .subquery())
+
+    ranked = select(
+        scores.c.user_id,
+        func.row_number().over(
+            partition_by=scores.c.user_id,
+            order_by=(scores.c.score.desc(), scores.c.suggested_user_id),
+        ).label("rank"),
+        scores.c.suggested_user_id,
+        scores.c.score,
+    ).subquery()
+
+    return select(ranked).where(ranked.c.rank <= limit)
+
+
+def update_suggestions(user_ids, limit):
+    """Replace the suggestions of `user_ids`; return how many were written."""
+
+    db.session.execute(
+        delete(FollowSuggestion).where(FollowSuggestion.user_id.in_(user_ids)))
+    result = db.session.execute(
+        insert(FollowSuggestion).from_select(
+            ["user_id", "rank", "suggested_user_id", "score"],
+            suggestions_query(user_ids, limit)))
+    db.session.commit()
+
+    return result.rowcount
+
+
+def changed_users(since, until):
+    """Return ids of users whose suggestions may have changed.
+
+    A follow (a -> b) changes the friends of friends of `a`, and of everyone
+    following `a`.
+    """
+
+    followers = (select(FollowEvent.follower_id)
+                 .where(FollowEvent.id > since, FollowEvent.id <= until))
+
+    direct = set(db.session.scalars(followers.distinct()))
+    indirect = set(db.session.scalars(
+        select(Follows.user_following_id)
+        .where(Follows.user_being_followed_id.in_(followers))
+        .distinct()))
+
+    return direct | indirect
+
+
+def run(app, full=False):
+    """Update suggestions, for everyone or just for changed users.
+
+    Returns (users updated, suggestions written).
+    """
+
+    config = app.config
+    limit = config["SUGGESTIONS_PER_USER"]
+    batch_size = config["SUGGESTIONS_BATCH_SIZE"]
+
+    watermark = db.session.get(Watermark, WATERMARK_NAME)
+    settled = datetime.utcnow() - timedelta(
+        seconds=config["SUGGESTIONS_SETTLE_SECONDS"])
+    until = db.session.scalar(
+        select(func.coalesce(func.max(FollowEvent.id), 0))
+        .where(FollowEvent.created_at < settled))
+
+    if full or watermark is None:
+        user_ids = db.session.scalars(select(User.id).order_by(User.id)).all()
+    else:
+        user_ids = sorted(changed_users(watermark.value, until))
+
+    written = 0
+    for i in range(0, len(user_ids), batch_size):
+        written += update_suggestions(user_ids[i:i + batch_size], limit)
+
+    if watermark is None:
+        watermark = Watermark(name=WATERMARK_NAME, value=until)
+        db.session.add(watermark)
+    watermark.value = max(watermark.value, until)
+    db.session.commit()
+
+    return len(user_ids), written
+
+
+def init_suggestions(app):
+    """Set up `app`'s suggestions settings and CLI."""
+
+    for key, value in DEFAULT_CONFIG.items():
+        app.config.setdefault(key, value)
+
+    @app.cli.group("suggestions")
+    def suggestions_cli():
+        """Follow suggestion commands."""
+
+    @suggestions_cli.command("update")
+    @click.option("--full", is_flag=True, help="Update every user.")
+    def update_command(full):
+        """Update follow suggestions."""
+
+        start = time.perf_counter()
+        users, written = run(app, full)
+        elapsed = time.perf_counter() - start
+
+        click.echo(
+            f"updated {users} users, {written} suggestions in {elapsed:.2f}s")
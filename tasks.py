@@ -0,0 +1,133 @@
+"""Background tasks (see jobs.py)."""
+
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import delete, select, tuple_
+
+from activity import prune as prune_activity
+from archive import archive_partitions, create_partitions
+from jobs import task
+from models import (
+    db, Follows, FollowEvent, FollowSuggestion, Like, Message, Notification,
+    User)
+from notifications import aggregate
+from suggestions import run as run_suggestions
+from timeline import follower_ids, get_timelines
+from trending import expire, record_unlikes
+
+DELETE_CHUNK_SIZE = 1000
+
+
+def delete_chunk(model, *where, returning=None):
+    """Delete up to DELETE_CHUNK_SIZE rows of `model` matching `where`.
+
+    Returns the number of rows deleted, or with `returning`, a list of
+    columns, those columns of the deleted rows.
+    """
+
+    key = tuple_(*model.__table__.primary_key.columns)
+    chunk = (select(*model.__table__.primary_key.columns)
+             .where(*where)
+             .limit(DELETE_CHUNK_SIZE))
+
+    stmt = delete(model).where(key.in_(chunk))
+    if returning is not None:
+        stmt = stmt.returning(*returning)
+
+    result = db.session.execute(
+        stmt, execution_options={"synchronize_session": False})
+    return result.all() if returning is not None else result.rowcount
+
+
+@task
+def delete_user(user_id):
+    """Delete a deleted account's data, a chunk per transaction.
+
+    The user's likes go first, uncounted from trending messages as they're
+    deleted, as unliking does. Then likes of the user's messages, follows,
+    appearances in others' suggestions, notifications and messages, and
+    finally the user, so no single statement cascades to an unbounded number
+    of rows.
+    """
+
+    likes = delete_chunk(Like, Like.user_id == user_id,
+                         returning=[Like.message_id, Like.liked_at])
+    if likes:
+        record_unlikes(
+            [tuple(like) for like in likes],
+            current_app.config["TRENDING_BUCKET_SECONDS"])
+        db.session.commit()
+        return {"user_id": user_id}
+
+    user_messages = select(Message.id).where(Message.user_id == user_id)
+
+    chunks = [
+        (Like, Like.message_id.in_(user_messages)),
+        (Follows, Follows.user_following_id == user_id),
+        (Follows, Follows.user_being_followed_id == user_id),
+        (FollowSuggestion, FollowSuggestion.suggested_user_id == user_id),
+        (Notification, Notification.user_id == user_id),
+        (Message, Message.user_id == user_id),
+    ]
+
+    for model, where in chunks:
+        if delete_chunk(model, where):
+            db.session.commit()
+            return {"user_id": user_id}
+
+    db.session.execute(delete(User).where(User.id == user_id))
+    db.session.commit()
+
+
+@task
+def prune_follow_events(hours=24):
+    """Delete follow_events older than `hours`."""
+
+    cutoff = datetime.utcnow() - timedelta(hours=hours)
+    db.session.execute(
+        delete(FollowEvent).where(FollowEvent.created_at < cutoff))
+    db.session.commit()
+
+
+@task
+def expire_trending():
+    """Subtract likes that are no longer in each trending period."""
+
+    expire(datetime.utcnow(), current_app.config["TRENDING_BUCKET_SECONDS"])
+
+
+@task
+def update_suggestions(full=False):
+    """Update follow suggestions."""
+
+    run_suggestions(current_app, full)
+
+
+@task
+def maintain_message_partitions():
+    """Create the coming months' message partitions; archive old ones."""
+
+    create_partitions()
+    archive_partitions()
+
+
+@task
+def aggregate_notifications():
+    """Group queued likes and follows into notifications."""
+
+    aggregate(current_app.config["NOTIFICATIONS_BATCH_SIZE"])
+
+
+@task
+def prune_active_users():
+    """Delete active_users rows that no longer count towards anything."""
+
+    prune_activity(current_app.config["ACTIVITY_KEEP_DAYS"])
+
+
+@task
+def invalidate_timelines(user_id):
+    """Invalidate the timelines of `user_id`'s followers."""
+
+    get_timelines().invalidate(*follower_ids(user_id))
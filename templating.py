@@ -0,0 +1,89 @@
+"""Compiled template cache and warmup.
+
+Jinja compiles a template to Python the first time it's rendered, which
+put a compile of base.html and the page's templates on the first requests
+each worker served after a deploy. Instead:
+
+- compiled templates are kept on disk, in TEMPLATES_CACHE_DIR, by Jinja's
+  FileSystemBytecodeCache, so a template is only compiled once per deploy
+  (entries are keyed by the template's source, so edits are picked up)
+- `flask templates compile` fills that cache, for a build step
+- `create_app` loads every template when TEMPLATES_WARMUP is on, so
+  they're in memory before the first request; under gunicorn's --preload
+  that happens once, in the master, and every worker inherits them
+
+`python3 benchmarks/templates.py` measures first requests with and without
+these.
+"""
+
+import os
+import time
+
+import click
+from jinja2 import FileSystemBytecodeCache
+
+DEFAULT_CONFIG = {
+    "TEMPLATES_CACHE_DIR": None,  # instance/templates
+    "TEMPLATES_WARMUP": True,
+}
+
+
+def app_templates(app):
+    """Return the names of `app`'s own templates (not extensions')."""
+
+    return sorted(app.jinja_loader.list_templates())
+
+
+def warm_templates(app):
+    """Load all of `app`'s templates into its Jinja environment's cache,
+    compiling any that aren't in the bytecode cache. Returns their names.
+    """
+
+    names = app_templates(app)
+    for name in names:
+        app.jinja_env.get_template(name)
+    return names
+
+
+def init_templating(app):
+    """Set up `app`'s template bytecode cache and CLI.
+
+    Must run before anything uses `app.jinja_env`. Templates are warmed
+    up by `create_app`, once the app is set up (see `warm_templates`).
+    """
+
+    for key, value in DEFAULT_CONFIG.items():
+        app.config.setdefault(key, value)
+
+    if app.config["TEMPLATES_CACHE_DIR"] is None:
+        app.config["TEMPLATES_CACHE_DIR"] = os.path.join(
+            app.instance_path, "templates")
+
+    directory = app.config["TEMPLATES_CACHE_DIR"]
+    os.makedirs(directory, exist_ok=True)
+    app.jinja_options = {
+        **app.jinja_options,
+        "bytecode_cache": FileSystemBytecodeCache(directory),
+    }
+
+    @app.cli.group("templates")
+    def templates_cli():
+        """Template cache commands."""
+
+    @templates_cli.command("compile")
+    @click.option("--clear", is_flag=True,
+                  help="Empty the cache first.")
+    def compile_command(clear):
+        """Compile every template into the bytecode cache."""
+
+        if clear:
+            app.jinja_env.bytecode_cache.clear()
+            app.jinja_env.cache.clear()
+
+        start = time.perf_counter()
+        names = warm_templates(app)
+        elapsed = time.perf_counter() - start
+
+        click.echo(f"{len(names)} templates in "
+                   f"{app.config['TEMPLATES_CACHE_DIR']} "
+                   f"({elapsed * 1000:.0f}ms)")
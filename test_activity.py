@@ -0,0 +1,131 @@
+"""Activity count tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_activity.py
+
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+from activity import activity_table, prune, record_activity
+from app import create_app, CURR_USER_KEY
+from models import (
+    db, ActiveUser, ActivityCount, Follows, Like, Message, User)
+
+app = create_app({
+    'SQLALCHEMY_DATABASE_URI': "postgresql:///warbler_test",
+    'WTF_CSRF_ENABLED': False,
+    'GRAPH_SYNC_INTERVAL': 0,
+    'RATELIMIT_ENABLED': False,
+    'ACTIVITY_SHARDS': 2,
+})
+app.app_context().push()
+
+db.drop_all()
+db.create_all()
+
+
+class ActivityTestCase(TestCase):
+    def setUp(self):
+        # other test modules push their apps' contexts too
+        ctx = app.app_context()
+        ctx.push()
+        self.addCleanup(ctx.pop)
+
+        app.extensions["cache"].clear()
+
+        ActivityCount.query.delete()
+        ActiveUser.query.delete()
+        Like.query.delete()
+        Follows.query.delete()
+        Message.query.delete()
+        User.query.delete()
+
+        u1 = User.signup("u1", "u1@email.com", "password", None)
+        u2 = User.signup("u2", "u2@email.com", "password", None)
+        db.session.commit()
+
+        self.u1_id = u1.id
+        self.u2_id = u2.id
+
+    def tearDown(self):
+        db.session.rollback()
+        app.config["ADMIN_USER_IDS"] = []
+
+    def client_for(self, user_id):
+        client = app.test_client()
+        with client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+        return client
+
+    def latest(self, granularity):
+        return activity_table(granularity, 1)[0][1]
+
+    def test_write_routes(self):
+        c1 = self.client_for(self.u1_id)
+        c2 = self.client_for(self.u2_id)
+
+        c1.post("/messages/new", data={"text": "one"})
+        c1.post("/messages/new", data={"text": "two"})
+        message_id = Message.query.filter_by(text="one").one().id
+        c2.post(f"/messages/{message_id}/like", data={"curr-url": "/"})
+        c2.post(f"/users/follow/{self.u1_id}", data={"curr-url": "/"})
+        app.test_client().post("/signup", data={
+            "username": "u3", "email": "u3@email.com",
+            "password": "password"})
+
+        expected = {"messages": 2, "likes": 1, "follows": 1, "signups": 1,
+                    "active_users": 2}
+        self.assertEqual(self.latest("hour"), expected)
+        self.assertEqual(self.latest("day"), expected)
+
+        # spread over shards
+        self.assertEqual(
+            {row.shard for row in ActivityCount.query.filter_by(
+                granularity="hour", metric="active_users")},
+            {self.u1_id % 2, self.u2_id % 2})
+
+    def test_past_times(self):
+        now = datetime.utcnow()
+        record_activity("messages", self.u1_id,
+                        [now, now - timedelta(hours=1),
+                         now - timedelta(days=1)])
+        db.session.commit()
+
+        hours = activity_table("hour", 3)
+        self.assertEqual([counts["messages"] for _, counts in hours[:2]],
+                         [1, 1])
+        # (an hour ago may have been yesterday)
+        days = [counts["messages"] for _, counts in activity_table("day", 2)]
+        self.assertEqual(sum(days), 3)
+        self.assertGreaterEqual(min(days), 1)
+
+        # active once, now
+        self.assertEqual(hours[0][1]["active_users"], 1)
+        self.assertEqual(hours[1][1]["active_users"], 0)
+
+    def test_prune(self):
+        now = datetime.utcnow()
+        record_activity("likes", self.u1_id)
+        db.session.add(ActiveUser(
+            granularity="day", period_start=now - timedelta(days=5),
+            user_id=self.u2_id))
+        db.session.commit()
+
+        self.assertEqual(prune(2), 1)
+        self.assertEqual(ActiveUser.query.count(), 2)
+        self.assertEqual(self.latest("day")["likes"], 1)
+
+    def test_admin_page(self):
+        c1 = self.client_for(self.u1_id)
+        c1.post("/messages/new", data={"text": "one"})
+
+        resp = c1.get("/admin/activity")
+        self.assertEqual(resp.status_code, 302)
+
+        app.config["ADMIN_USER_IDS"] = [self.u1_id]
+        resp = c1.get("/admin/activity?granularity=hour")
+        html = resp.get_data(as_text=True)
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn('id="activity"', html)
+        self.assertIn("Active users", html)
@@ -0,0 +1,191 @@
+"""JSON API tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_api.py
+
+import os
+import tempfile
+from unittest import TestCase
+
+from app import create_app, CURR_USER_KEY
+from models import db, Like, Message, User
+
+# timelines are only cached in a shared cache
+cache_dir = tempfile.TemporaryDirectory()
+
+app = create_app({
+    'SQLALCHEMY_DATABASE_URI': "postgresql:///warbler_test",
+    'WTF_CSRF_ENABLED': False,
+    'GRAPH_SYNC_INTERVAL': 0,
+    'TIMELINE_LENGTH': 10,
+    'RATELIMIT_ENABLED': False,
+    'CACHE_TYPE': "sqlite",
+    'CACHE_SQLITE_PATH': os.path.join(cache_dir.name, "cache.sqlite3"),
+})
+app.app_context().push()
+
+db.drop_all()
+db.create_all()
+
+
+class APITestCase(TestCase):
+    def setUp(self):
+        # other test modules push their apps' contexts too
+        ctx = app.app_context()
+        ctx.push()
+        self.addCleanup(ctx.pop)
+
+        Like.query.delete()
+        Message.query.delete()
+        User.query.delete()
+
+        u1 = User.signup("u1", "u1@email.com", "password", None)
+        u2 = User.signup("u2", "u2@email.com", "password", None)
+        u3 = User.signup("u3", "u3@email.com", "password", None)
+        db.session.flush()
+
+        u1.following.append(u2)
+        messages = [Message(text=f"m{i}", user_id=(u1.id, u2.id, u3.id)[i % 3])
+                    for i in range(9)]
+        db.session.add_all(messages)
+        db.session.commit()
+
+        self.u1_id = u1.id
+        self.u2_id = u2.id
+        self.u3_id = u3.id
+        self.ids = [message.id for message in messages]
+
+        self.client = app.test_client()
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.u1_id
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def texts(self, data):
+        return [message["text"] for message in data["messages"]]
+
+    def test_logged_out(self):
+        resp = app.test_client().get("/api/timeline")
+
+        self.assertEqual(resp.status_code, 401)
+        self.assertIn("error", resp.json)
+
+    def test_timeline(self):
+        resp = self.client.get("/api/timeline")
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(
+            self.texts(resp.json), ["m7", "m6", "m4", "m3", "m1", "m0"])
+        self.assertEqual(set(resp.json["users"]),
+                         {str(self.u1_id), str(self.u2_id)})
+        self.assertEqual(resp.json["users"][str(self.u2_id)]["username"], "u2")
+        self.assertFalse(resp.json["more"])
+
+    def test_timeline_pages(self):
+        resp = self.client.get("/api/timeline?limit=4")
+        self.assertEqual(self.texts(resp.json), ["m7", "m6", "m4", "m3"])
+        self.assertTrue(resp.json["more"])
+
+        oldest = resp.json["messages"][-1]["id"]
+        resp = self.client.get(f"/api/timeline?limit=4&before_id={oldest}")
+        self.assertEqual(self.texts(resp.json), ["m1", "m0"])
+        self.assertFalse(resp.json["more"])
+
+    def test_timeline_since(self):
+        resp = self.client.get(f"/api/timeline?since_id={self.ids[7]}")
+        self.assertEqual(resp.json["messages"], [])
+
+        self.client.post("/messages/new", data={"text": "new1"})
+        self.client.post("/messages/new", data={"text": "new2"})
+
+        resp = self.client.get(f"/api/timeline?since_id={self.ids[7]}&limit=1")
+        self.assertEqual(self.texts(resp.json), ["new1"])
+        self.assertTrue(resp.json["more"])
+
+        newest = resp.json["messages"][0]["id"]
+        resp = self.client.get(f"/api/timeline?since_id={newest}&limit=1")
+        self.assertEqual(self.texts(resp.json), ["new2"])
+        self.assertFalse(resp.json["more"])
+
+    def test_timeline_since_before_first(self):
+        resp = self.client.get(f"/api/timeline?since_id={self.ids[0] - 1}")
+
+        self.assertEqual(
+            self.texts(resp.json), ["m7", "m6", "m4", "m3", "m1", "m0"])
+
+    def test_timeline_imported(self):
+        # fill the timeline cache (TIMELINE_LENGTH 10)
+        for i in range(4):
+            self.client.post("/messages/new", data={"text": f"new{i}"})
+        resp = self.client.get("/api/timeline?limit=1")
+        newest = resp.json["messages"][0]["id"]
+
+        resp = self.client.post(
+            "/api/messages/import",
+            data='{"text": "old", "timestamp": "2019-05-01T12:00:00Z"}\n',
+            content_type="application/x-ndjson")
+        self.assertEqual(resp.status_code, 201)
+
+        resp = self.client.get("/api/timeline?limit=1")
+        self.assertEqual(self.texts(resp.json), ["old"])
+
+        resp = self.client.get(f"/api/timeline?since_id={newest}")
+        self.assertEqual(self.texts(resp.json), ["old"])
+
+    def test_not_modified(self):
+        resp = self.client.get("/api/timeline")
+        etag = resp.headers["ETag"]
+
+        resp = self.client.get(
+            "/api/timeline", headers={"If-None-Match": etag})
+        self.assertEqual(resp.status_code, 304)
+        self.assertEqual(resp.data, b"")
+
+        db.session.add(Like(user_id=self.u2_id, message_id=self.ids[0]))
+        db.session.commit()
+
+        resp = self.client.get(
+            "/api/timeline", headers={"If-None-Match": etag})
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.json["messages"][-1]["likes"], 1)
+
+    def test_user_messages(self):
+        resp = self.client.get(
+            f"/api/users/{self.u3_id}/messages?before_id={self.ids[8]}")
+
+        self.assertEqual(self.texts(resp.json), ["m5", "m2"])
+        self.assertEqual(list(resp.json["users"]), [str(self.u3_id)])
+
+    def test_user_messages_404(self):
+        resp = self.client.get("/api/users/0/messages")
+
+        self.assertEqual(resp.status_code, 404)
+        self.assertIn("error", resp.json)
+
+    def test_bad_cursor(self):
+        resp = self.client.get("/api/timeline?since_id=x")
+
+        self.assertEqual(resp.status_code, 400)
+
+    def test_likes(self):
+        for i in (2, 1, 5):
+            self.client.post(f"/messages/{self.ids[i]}/like",
+                             data={"curr-url": "/"})
+
+        resp = self.client.get(f"/api/users/{self.u1_id}/likes?limit=2")
+        self.assertEqual(self.texts(resp.json), ["m5", "m1"])
+        self.assertTrue(all(m["liked"] for m in resp.json["messages"]))
+
+        resp = self.client.get(
+            f"/api/users/{self.u1_id}/likes?before_id={self.ids[1]}")
+        self.assertEqual(self.texts(resp.json), ["m2"])
+
+        resp = self.client.get(
+            f"/api/users/{self.u1_id}/likes?since_id={self.ids[2]}")
+        self.assertEqual(self.texts(resp.json), ["m5", "m1"])
+
+        resp = self.client.get(
+            f"/api/users/{self.u1_id}/likes?since_id={self.ids[4]}")
+        self.assertEqual(resp.status_code, 400)
@@ -0,0 +1,51 @@
+"""App factory tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_app.py
+
+import os
+import subprocess
+import sys
+from unittest import TestCase
+
+from app import create_app
+
+
+class CreateAppTestCase(TestCase):
+    def test_import_has_no_side_effects(self):
+        # in a fresh interpreter, importing app shouldn't need any settings,
+        # create an app, or import the debug toolbar; creating one shouldn't
+        # leave an app context pushed
+        code = (
+            "import sys, flask, app; "
+            "assert not hasattr(app, 'app'); "
+            "assert 'flask_debugtoolbar' not in sys.modules; "
+            "app.create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite://'}); "
+            "assert not flask.has_app_context()"
+        )
+        subprocess.run(
+            [sys.executable, "-c", code],
+            check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            env={"PATH": ""},
+        )
+
+    def test_create_app_config(self):
+        app = create_app({
+            'SQLALCHEMY_DATABASE_URI': "postgresql:///warbler_test",
+            'SECRET_KEY': "override",
+            'DB_POOL_SIZE': 2,
+        })
+
+        self.assertEqual(app.config['SECRET_KEY'], "override")
+        self.assertEqual(
+            app.config['SQLALCHEMY_ENGINE_OPTIONS']['pool_size'], 2)
+        self.assertIn('warbler.homepage', app.view_functions)
+
+    def test_no_debug_toolbar_in_production(self):
+        app = create_app({
+            'SQLALCHEMY_DATABASE_URI': "postgresql:///warbler_test",
+        })
+
+        self.assertNotIn('debugtoolbar', app.extensions)
@@ -0,0 +1,258 @@
+"""Message partitioning and archive tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_archive.py
+
+import os
+import shutil
+import tempfile
+from datetime import date, datetime
+from unittest import TestCase
+from unittest.mock import patch
+
+from sqlalchemy import event, text
+from sqlalchemy.exc import OperationalError
+
+from app import create_app, CURR_USER_KEY
+from archive import (
+    DEFAULT_PARTITION, archive_partitions, create_partitions,
+    detached_partitions, get_archive, partitions)
+from models import db, Like, LikeBucket, Message, User
+
+archive_dir = tempfile.mkdtemp()
+
+app = create_app({
+    'SQLALCHEMY_DATABASE_URI': "postgresql:///warbler_test",
+    'WTF_CSRF_ENABLED': False,
+    'GRAPH_SYNC_INTERVAL': 0,
+    'MESSAGES_ARCHIVE_DIR': archive_dir,
+    'MESSAGES_ARCHIVE_BLOCK_SIZE': 2,
+})
+app.app_context().push()
+
+db.drop_all()
+db.create_all()
+
+TODAY = date(2020, 3, 15)
+
+
+def partition_of(message_id):
+    return db.session.scalar(
+        text("SELECT tableoid::regclass::text FROM messages WHERE id = :id"),
+        {"id": message_id})
+
+
+class ArchiveTestCase(TestCase):
+    def setUp(self):
+        # other test modules push their apps' contexts too
+        ctx = app.app_context()
+        ctx.push()
+        self.addCleanup(ctx.pop)
+
+        for name in [*partitions().values(),
+                     *detached_partitions().values()]:
+            db.session.execute(text(f"DROP TABLE {name}"))
+        LikeBucket.query.delete()
+        Like.query.delete()
+        Message.query.delete()
+        User.query.delete()
+        db.session.commit()
+
+        shutil.rmtree(archive_dir)
+        os.mkdir(archive_dir)
+
+        u1 = User.signup("u1", "u1@email.com", "password", None)
+        u2 = User.signup("u2", "u2@email.com", "password", None)
+        db.session.flush()
+
+        # before any partitions exist, so in the default one
+        january = [
+            Message(text=f"jan {i}", user_id=u1.id,
+                    timestamp=datetime(2020, 1, i + 1))
+            for i in range(5)]
+        march = Message(text="mar", user_id=u1.id,
+                        timestamp=datetime(2020, 3, 1))
+        db.session.add_all([*january, march])
+        db.session.flush()
+
+        u2.liked_messages.append(january[2])
+        db.session.add(LikeBucket(
+            message_id=january[2].id, bucket=0, like_count=1))
+        db.session.commit()
+
+        self.u1_id = u1.id
+        self.u2_id = u2.id
+        self.january_ids = [msg.id for msg in january]
+        self.march_id = march.id
+
+        self.client = app.test_client()
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.u2_id
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def test_create_partitions(self):
+        self.assertEqual(partition_of(self.march_id), "messages_default")
+
+        created = create_partitions(today=TODAY, ahead=1)
+
+        self.assertEqual(created, {
+            "messages_p202001": 5,
+            "messages_p202003": 1,
+            "messages_p202004": 0,
+        })
+        self.assertEqual(partition_of(self.march_id), "messages_p202003")
+        self.assertEqual(
+            partition_of(self.january_ids[0]), "messages_p202001")
+
+        # moving rows between partitions keeps their likes
+        self.assertEqual(Like.query.count(), 1)
+        self.assertEqual(create_partitions(today=TODAY, ahead=1), {})
+
+    def test_new_message_partition(self):
+        create_partitions(today=TODAY, ahead=1)
+
+        msg = Message(text="apr", user_id=self.u1_id,
+                      timestamp=datetime(2020, 4, 30, 23, 59))
+        db.session.add(msg)
+        db.session.commit()
+
+        self.assertEqual(partition_of(msg.id), "messages_p202004")
+
+    def test_delete_cascades(self):
+        db.session.delete(db.session.get(Message, self.january_ids[2]))
+        db.session.commit()
+
+        self.assertEqual(Like.query.count(), 0)
+        self.assertEqual(LikeBucket.query.count(), 0)
+
+    def test_archive(self):
+        create_partitions(today=TODAY, ahead=1)
+        archived = archive_partitions(today=TODAY, hot_months=1)
+
+        self.assertEqual(archived, {"messages_p202001": 5})
+        self.assertNotIn(date(2020, 1, 1), partitions())
+        self.assertEqual(
+            Message.query.with_entities(Message.id).all(),
+            [(self.march_id,)])
+        self.assertEqual(Like.query.count(), 0)
+        self.assertEqual(LikeBucket.query.count(), 0)
+
+        names = os.listdir(archive_dir)
+        self.assertEqual(len(names), 2)
+
+        for i, message_id in enumerate(self.january_ids):
+            found = get_archive().get(message_id)
+            self.assertEqual(found.text, f"jan {i}")
+            self.assertEqual(found.timestamp, datetime(2020, 1, i + 1))
+        self.assertEqual(
+            get_archive().get(self.january_ids[2]).likes, [self.u2_id])
+        self.assertIsNone(get_archive().get(self.march_id))
+
+    def statements(self):
+        """Record the SQL run until the test ends."""
+
+        run = []
+
+        def before_execute(conn, cursor, statement, *args):
+            run.append(statement)
+
+        event.listen(db.engine, "before_cursor_execute", before_execute)
+        self.addCleanup(
+            event.remove, db.engine, "before_cursor_execute", before_execute)
+        return run
+
+    def test_archive_detaches_first(self):
+        create_partitions(today=TODAY, ahead=1)
+        run = self.statements()
+
+        archive_partitions(today=TODAY, hot_months=1)
+
+        alters = [i for i, sql in enumerate(run) if "ALTER TABLE" in sql]
+        drops = [i for i, sql in enumerate(run) if "DROP TABLE" in sql]
+        self.assertEqual(
+            run[alters[0]],
+            "ALTER TABLE messages DETACH PARTITION messages_p202001")
+        self.assertLess(alters[-1], drops[0])
+
+    def test_archive_detaches_concurrently(self):
+        create_partitions(today=TODAY, ahead=1)
+        db.session.execute(text(f"DROP TABLE {DEFAULT_PARTITION}"))
+        db.session.commit()
+        self.addCleanup(db.session.commit)
+        self.addCleanup(db.session.execute, text(
+            f"CREATE TABLE {DEFAULT_PARTITION} PARTITION OF messages DEFAULT"))
+        run = self.statements()
+
+        archived = archive_partitions(today=TODAY, hot_months=1)
+
+        self.assertEqual(archived, {"messages_p202001": 5})
+        self.assertIn(
+            "ALTER TABLE messages DETACH PARTITION messages_p202001 "
+            "CONCURRENTLY", run)
+        self.assertEqual(detached_partitions(), {})
+        self.assertEqual(get_archive().get(self.january_ids[0]).text, "jan 0")
+
+    def test_archive_lock_timeout(self):
+        create_partitions(today=TODAY, ahead=1)
+
+        # a long query holding its lock on messages
+        with db.engine.connect() as other:
+            other.execute(text("LOCK TABLE messages IN ACCESS SHARE MODE"))
+
+            with patch.dict(app.config, {
+                    "MESSAGES_DETACH_LOCK_TIMEOUT": 50,
+                    "MESSAGES_DETACH_ATTEMPTS": 2}):
+                with self.assertRaises(OperationalError):
+                    archive_partitions(today=TODAY, hot_months=1)
+
+            other.rollback()
+
+        self.assertIn(date(2020, 1, 1), partitions())
+        self.assertEqual(os.listdir(archive_dir), [])
+
+        archived = archive_partitions(today=TODAY, hot_months=1)
+        self.assertEqual(archived, {"messages_p202001": 5})
+
+    def test_archive_left_detached(self):
+        create_partitions(today=TODAY, ahead=1)
+        # as if an earlier run stopped after detaching it
+        db.session.execute(text(
+            "ALTER TABLE messages DETACH PARTITION messages_p202001"))
+        db.session.commit()
+        self.assertIn(date(2020, 1, 1), detached_partitions())
+
+        archived = archive_partitions(today=TODAY, hot_months=1)
+
+        self.assertEqual(archived, {"messages_p202001": 5})
+        self.assertEqual(detached_partitions(), {})
+        self.assertEqual(Like.query.count(), 0)
+        self.assertEqual(
+            get_archive().get(self.january_ids[2]).likes, [self.u2_id])
+
+    def test_show_archived_message(self):
+        create_partitions(today=TODAY)
+        archive_partitions(today=TODAY, hot_months=1)
+
+        resp = self.client.get(f"/messages/{self.january_ids[2]}")
+        html = resp.get_data(as_text=True)
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn("jan 2", html)
+        self.assertNotIn("/like", html)
+
+        resp = self.client.get(f"/messages/{self.january_ids[-1] + 100}")
+        self.assertEqual(resp.status_code, 404)
+
+    def test_partitions_command(self):
+        create_partitions(today=TODAY, ahead=0)
+
+        result = app.test_cli_runner().invoke(args=["messages", "partitions"])
+
+        self.assertEqual(result.exit_code, 0)
+        self.assertEqual(result.output, (
+            "messages_p202001: 5 rows\n"
+            "messages_p202003: 1 rows\n"
+            "messages_default: 0 rows\n"))
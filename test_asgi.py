@@ -0,0 +1,297 @@
+"""Async serving mode tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_asgi.py
+
+import asyncio
+import time
+from datetime import datetime
+from unittest import TestCase
+from unittest.mock import patch
+
+from sqlalchemy import event, update
+
+from asgi import create_asgi_app
+from app import CURR_USER_KEY
+from cache import cached_get
+from models import db, User, Message
+
+asgi_app = create_asgi_app({
+    'SQLALCHEMY_DATABASE_URI': "postgresql:///warbler_test",
+    'WTF_CSRF_ENABLED': False,
+    'GRAPH_SYNC_INTERVAL': 0,
+})
+app = asgi_app.app
+app.app_context().push()
+
+db.drop_all()
+db.create_all()
+
+
+class AsyncReadAppTestCase(TestCase):
+    def setUp(self):
+        Message.query.delete()
+        User.query.delete()
+
+        u1 = User.signup("u1", "u1@email.com", "password", None)
+        u2 = User.signup("u2", "u2@email.com", "password", None)
+        db.session.flush()
+
+        u1.following.append(u2)
+        m1 = Message(text="m1-text", user_id=u2.id)
+        db.session.add(m1)
+        db.session.commit()
+
+        self.u1_id = u1.id
+        self.u2_id = u2.id
+        self.m1_id = m1.id
+
+        serializer = app.session_interface.get_signing_serializer(app)
+        self.cookie = (
+            f"{app.config['SESSION_COOKIE_NAME']}="
+            f"{serializer.dumps({CURR_USER_KEY: self.u1_id})}")
+
+        self.loop = asyncio.new_event_loop()
+
+        self.async_queries = 0
+
+        def count_query(*args):
+            self.async_queries += 1
+
+        event.listen(
+            asgi_app.engine.sync_engine, "before_cursor_execute", count_query)
+        self.addCleanup(
+            event.remove,
+            asgi_app.engine.sync_engine, "before_cursor_execute", count_query)
+
+    def tearDown(self):
+        self.loop.run_until_complete(asgi_app.hub.stop())
+        self.loop.run_until_complete(asgi_app.engine.dispose())
+        self.loop.close()
+        db.session.rollback()
+
+    async def request(self, path, method="GET", cookie=None, body=b""):
+        """Make a request to the ASGI app; return (status, headers, body)."""
+
+        headers = [(b"host", b"localhost")]
+        if cookie:
+            headers.append((b"cookie", cookie.encode()))
+        if body:
+            headers.append(
+                (b"content-type", b"application/x-www-form-urlencoded"))
+            headers.append((b"content-length", str(len(body)).encode()))
+
+        scope = {
+            "type": "http",
+            "method": method,
+            "path": path,
+            "query_string": b"",
+            "headers": headers,
+            "http_version": "1.1",
+            "scheme": "http",
+            "server": ("localhost", 80),
+        }
+        sent = []
+
+        async def receive():
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        async def send(message):
+            sent.append(message)
+
+        await asgi_app(scope, receive, send)
+
+        start = sent[0]
+        return (
+            start["status"],
+            dict(start["headers"]),
+            b"".join(m.get("body", b"") for m in sent[1:]).decode(),
+        )
+
+    def get(self, path, **kwargs):
+        return self.loop.run_until_complete(self.request(path, **kwargs))
+
+    def test_homepage_logged_out(self):
+        status, _, html = self.get("/")
+
+        self.assertEqual(status, 200)
+        self.assertIn("New to Warbler?", html)
+
+    def test_homepage_logged_in(self):
+        status, _, html = self.get("/", cookie=self.cookie)
+
+        self.assertEqual(status, 200)
+        self.assertIn("m1-text", html)
+        self.assertGreater(self.async_queries, 0)
+
+    def test_show_message(self):
+        status, _, html = self.get(f"/messages/{self.m1_id}", cookie=self.cookie)
+
+        self.assertEqual(status, 200)
+        self.assertIn("m1-text", html)
+
+    def test_show_message_404(self):
+        status, _, _ = self.get("/messages/0", cookie=self.cookie)
+
+        self.assertEqual(status, 404)
+
+    def test_unauthorized_flash_saves_session(self):
+        status, headers, _ = self.get(f"/users/{self.u1_id}")
+
+        self.assertEqual(status, 302)
+        self.assertIn(b"set-cookie", headers)
+
+    def test_writes_go_to_wsgi_app(self):
+        status, _, _ = self.get(
+            "/login",
+            method="POST",
+            body=b"username=u1&password=password")
+
+        self.assertEqual(status, 302)
+        self.assertEqual(self.async_queries, 0)
+
+    def test_concurrent_requests(self):
+        async def many():
+            return await asyncio.gather(*[
+                self.request("/", cookie=self.cookie) for _ in range(20)])
+
+        results = self.loop.run_until_complete(many())
+
+        self.assertEqual([status for status, _, _ in results], [200] * 20)
+
+    def test_rendering_off_the_loop(self):
+        update_template_context = app.update_template_context
+
+        def render_slowly(context):
+            time.sleep(0.3)
+            update_template_context(context)
+
+        async def tick():
+            ticks = 0
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+                self.ticks = ticks
+
+        async def request():
+            ticker = asyncio.create_task(tick())
+            try:
+                return await self.request("/", cookie=self.cookie)
+            finally:
+                ticker.cancel()
+
+        self.ticks = 0
+        with patch.object(app, "update_template_context", render_slowly):
+            status, _, body = self.loop.run_until_complete(request())
+
+        self.assertEqual(status, 200)
+        self.assertIn("m1-text", body)
+        # the loop kept running other tasks while the page rendered
+        self.assertGreater(self.ticks, 10)
+        self.assertGreater(self.async_queries, 0)
+
+    async def open_stream(self):
+        """Start a stream request; return (task, sent messages, disconnect)."""
+
+        scope = {
+            "type": "http",
+            "method": "GET",
+            "path": "/messages/stream",
+            "query_string": b"",
+            "headers": [(b"host", b"localhost"),
+                        (b"cookie", self.cookie.encode())],
+            "http_version": "1.1",
+            "scheme": "http",
+            "server": ("localhost", 80),
+        }
+        sent = []
+        disconnected = asyncio.Event()
+
+        async def receive():
+            await disconnected.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            sent.append(message)
+
+        task = asyncio.create_task(asgi_app(scope, receive, send))
+        while not asgi_app.hub.subscriptions:
+            await asyncio.sleep(0.01)
+
+        return task, sent, disconnected
+
+    async def wait_for_event(self, sent, text):
+        for _ in range(500):
+            body = b"".join(m.get("body", b"") for m in sent[1:]).decode()
+            if text in body:
+                return body
+            await asyncio.sleep(0.01)
+        self.fail(f"no {text!r} in stream")
+
+    def post_message(self, user_id, text):
+        client = app.test_client()
+        with client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+        client.post("/messages/new", data={"text": text})
+        return Message.query.filter_by(text=text).one().id
+
+    def test_stream_logged_out(self):
+        status, _, _ = self.get("/messages/stream")
+
+        self.assertEqual(status, 401)
+
+    def test_stream_deleted_user(self):
+        # deleted through another worker, so this one's (lru) cache
+        # still has them
+        cached_get(User, self.u1_id)
+        db.session.execute(
+            update(User).where(User.id == self.u1_id)
+            .values(deleted_at=datetime.utcnow()))
+        db.session.commit()
+
+        status, _, _ = self.get("/messages/stream", cookie=self.cookie)
+
+        self.assertEqual(status, 401)
+
+    def test_stream(self):
+        async def stream():
+            task, sent, disconnected = await self.open_stream()
+
+            # posted from another thread, and delivered by LISTEN/NOTIFY
+            msg_id = await asyncio.to_thread(self.post_message, self.u2_id, "new")
+            body = await self.wait_for_event(sent, f"data: {msg_id}\n")
+
+            disconnected.set()
+            await task
+            return sent, body
+
+        sent, body = self.loop.run_until_complete(stream())
+
+        self.assertEqual(sent[0]["status"], 200)
+        self.assertIn((b"content-type", b"text/event-stream"), sent[0]["headers"])
+        self.assertIn(f"id: {self.m1_id + 1}", body)
+        self.assertEqual(asgi_app.hub.subscriptions, {})
+
+    def test_stream_only_followed(self):
+        u3 = User.signup("u3", "u3@email.com", "password", None)
+        db.session.commit()
+        u3_id = u3.id
+
+        async def stream():
+            task, sent, disconnected = await self.open_stream()
+
+            asgi_app.hub.publish(1001, self.u2_id)
+            await self.wait_for_event(sent, "data: 1001\n")
+
+            asgi_app.hub.publish(1000, u3_id)
+            asgi_app.hub.publish(1002, self.u2_id)
+            body = await self.wait_for_event(sent, "data: 1002\n")
+
+            disconnected.set()
+            await task
+            return body
+
+        body = self.loop.run_until_complete(stream())
+
+        self.assertNotIn("data: 1000\n", body)
@@ -0,0 +1,204 @@
+"""Cache tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_cache.py
+
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from unittest import TestCase, skipUnless
+
+from app import create_app
+from cache import (
+    LRUCache, PrefixedCache, RedisCache, SQLiteCache, cached_get, fragment,
+    get_cache, invalidate_tags, memoize)
+from sqlalchemy import event
+
+from models import db, User
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+app = create_app({
+    'SQLALCHEMY_DATABASE_URI': "postgresql:///warbler_test",
+})
+app.app_context().push()
+
+db.drop_all()
+db.create_all()
+
+
+class BackendTests:
+    """Tests run against every backend; subclasses set self.cache."""
+
+    def test_get_set_delete(self):
+        self.assertIsNone(self.cache.get("k"))
+        self.assertEqual(self.cache.get("k", "default"), "default")
+
+        self.cache.set("k", {"a": [1, 2]})
+        self.assertEqual(self.cache.get("k"), {"a": [1, 2]})
+
+        self.cache.delete("k")
+        self.assertIsNone(self.cache.get("k"))
+
+    def test_ttl(self):
+        self.cache.set("k", "v", ttl=0.05)
+        self.assertEqual(self.cache.get("k"), "v")
+
+        time.sleep(0.1)
+        self.assertIsNone(self.cache.get("k"))
+
+    def test_update(self):
+        self.assertEqual(self.cache.update("n", lambda v: (v or 10) * 2), 20)
+        self.assertEqual(self.cache.update("n", lambda v: v + 1), 21)
+        self.assertEqual(self.cache.incr("n"), 22)
+
+    def test_update_many(self):
+        self.cache.set("a", 1)
+        self.assertEqual(
+            self.cache.update_many(["a", "b"], lambda v: (v or 10) + 1),
+            [2, 11])
+        self.assertEqual(self.cache.get("b"), 11)
+
+    def test_concurrent_updates(self):
+        def add():
+            for _ in range(50):
+                self.cache.incr("n")
+
+        threads = [threading.Thread(target=add) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(self.cache.get("n"), 200)
+
+    def test_tags(self):
+        cache = PrefixedCache(self.cache, "test:")
+
+        key = cache.tagged_key("k", ["a", "b"])
+        cache.set(key, "v")
+        self.assertEqual(cache.get(cache.tagged_key("k", ["a", "b"])), "v")
+
+        cache.invalidate_tags("b")
+        self.assertIsNone(cache.get(cache.tagged_key("k", ["a", "b"])))
+
+
+class LRUCacheTestCase(BackendTests, TestCase):
+    def setUp(self):
+        self.cache = LRUCache(max_bytes=10000)
+
+    def test_evicts_least_recently_used(self):
+        cache = LRUCache(max_bytes=300)
+        cache.set("a", b"x" * 100)
+        cache.set("b", b"x" * 100)
+        cache.get("a")
+        cache.set("c", b"x" * 100)
+
+        self.assertIsNotNone(cache.get("a"))
+        self.assertIsNone(cache.get("b"))
+        self.assertIsNotNone(cache.get("c"))
+        self.assertLessEqual(cache.size, 300)
+
+    def test_too_big(self):
+        self.cache.set("k", b"x" * 20000)
+
+        self.assertIsNone(self.cache.get("k"))
+        self.assertEqual(self.cache.size, 0)
+
+
+class SQLiteCacheTestCase(BackendTests, TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix=".sqlite3")
+        os.close(fd)
+        self.addCleanup(os.remove, self.path)
+
+        self.cache = SQLiteCache(self.path, max_entries=1000)
+
+    def test_shared_between_instances(self):
+        other = SQLiteCache(self.path, max_entries=1000)
+
+        self.cache.set("k", "v")
+        self.assertEqual(other.get("k"), "v")
+
+
+@skipUnless(fakeredis, "needs fakeredis")
+class RedisCacheTestCase(BackendTests, TestCase):
+    def setUp(self):
+        self.cache = RedisCache(fakeredis.FakeRedis())
+
+
+class HelpersTestCase(TestCase):
+    def setUp(self):
+        User.query.delete()
+        self.user = User.signup("u1", "u1@email.com", "password", None)
+        db.session.commit()
+
+        get_cache().clear()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def test_memoize(self):
+        calls = []
+
+        @memoize(tags=lambda n: [f"n:{n}"])
+        def double(n):
+            calls.append(n)
+            return n * 2
+
+        self.assertEqual(double(2), 4)
+        self.assertEqual(double(2), 4)
+        self.assertEqual(double(3), 6)
+        self.assertEqual(calls, [2, 3])
+
+        invalidate_tags("n:2")
+        double(2)
+        double(3)
+        self.assertEqual(calls, [2, 3, 2])
+
+    def test_fragment(self):
+        @fragment()
+        def card(name):
+            return f"<b>{name}</b>"
+
+        self.assertEqual(card("<u1>"), "<b><u1></b>")
+        self.assertEqual(card("<u1>").__html__(), "<b><u1></b>")
+
+    def test_cached_get(self):
+        user = cached_get(User, self.user.id)
+        self.assertIs(user, self.user)
+
+        db.session.expunge_all()
+        with self.assertNoQueries():
+            user = cached_get(User, self.user.id)
+        self.assertEqual(user.username, "u1")
+
+        user.bio = "new bio"
+        db.session.commit()
+        db.session.expunge_all()
+
+        self.assertEqual(cached_get(User, self.user.id).bio, "new bio")
+
+    def test_cached_get_missing(self):
+        self.assertIsNone(cached_get(User, 0))
+        self.assertIsNone(cached_get(User, 0))
+
+    @contextmanager
+    def assertNoQueries(self):
+        queries = []
+
+        def record(*args):
+            queries.append(args)
+
+        event.listen(db.engine, "before_cursor_execute", record)
+        try:
+            yield
+        finally:
+            event.remove(db.engine, "before_cursor_execute", record)
+        self.assertEqual(queries, [])
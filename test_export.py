@@ -0,0 +1,118 @@
+"""Data export tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_export.py
+
+import csv
+import json
+import os
+import tempfile
+from unittest import TestCase
+
+from app import create_app, CURR_USER_KEY
+from export import export_tables
+from models import db, Like, Message, User
+
+app = create_app({
+    'SQLALCHEMY_DATABASE_URI': "postgresql:///warbler_test",
+    'WTF_CSRF_ENABLED': False,
+    'EXPORT_BATCH_SIZE': 2,
+})
+app.app_context().push()
+
+db.drop_all()
+db.create_all()
+
+
+class ExportTestCase(TestCase):
+    def setUp(self):
+        # other test modules push their apps' contexts too
+        ctx = app.app_context()
+        ctx.push()
+        self.addCleanup(ctx.pop)
+
+        Like.query.delete()
+        Message.query.delete()
+        User.query.delete()
+
+        u1 = User.signup("u1", "u1@email.com", "password", None)
+        u2 = User.signup("u2", "u2@email.com", "password", None)
+        db.session.flush()
+
+        u1.following.append(u2)
+        u2.following.append(u1)
+        messages = [Message(text=f"m{i}", user_id=u1.id) for i in range(5)]
+        db.session.add_all(messages)
+        db.session.flush()
+        u1.liked_messages.append(Message(text="u2 m", user_id=u2.id))
+        db.session.commit()
+
+        self.u1_id = u1.id
+        self.u2_id = u2.id
+
+        self.client = app.test_client()
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.u1_id
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def test_ndjson(self):
+        resp = self.client.get(f"/users/{self.u1_id}/export")
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.mimetype, "application/x-ndjson")
+        self.assertIn("attachment", resp.headers["Content-Disposition"])
+
+        rows = [json.loads(line) for line in resp.data.splitlines()]
+        types = [row["type"] for row in rows]
+        self.assertEqual(types, ["profile"] + ["messages"] * 5 +
+                         ["likes", "followers", "following"])
+
+        self.assertEqual(rows[0]["username"], "u1")
+        self.assertNotIn("password", rows[0])
+        self.assertEqual([row["text"] for row in rows[1:6]],
+                         [f"m{i}" for i in range(5)])
+        self.assertEqual(rows[-1]["user_id"], self.u2_id)
+
+    def test_csv(self):
+        resp = self.client.get(
+            f"/users/{self.u1_id}/export?format=csv&section=messages")
+
+        self.assertEqual(resp.mimetype, "text/csv")
+        rows = list(csv.DictReader(resp.get_data(as_text=True).splitlines()))
+        self.assertEqual([row["text"] for row in rows],
+                         [f"m{i}" for i in range(5)])
+
+    def test_bad_section(self):
+        resp = self.client.get(f"/users/{self.u1_id}/export?format=csv")
+
+        self.assertEqual(resp.status_code, 400)
+
+    def test_other_user(self):
+        resp = self.client.get(f"/users/{self.u2_id}/export")
+
+        self.assertEqual(resp.status_code, 302)
+
+    def test_cli(self):
+        result = app.test_cli_runner().invoke(
+            args=["export", "user", str(self.u1_id)])
+
+        self.assertEqual(result.exit_code, 0)
+        self.assertEqual(len(result.output.splitlines()), 9)
+
+    def test_tables(self):
+        with tempfile.TemporaryDirectory() as out:
+            counts = export_tables(app, out, "csv", workers=3)
+
+            self.assertEqual(counts["messages"], 6)
+            self.assertEqual(counts["follows"], 2)
+
+            with open(os.path.join(out, "users.csv")) as f:
+                rows = list(csv.DictReader(f))
+            self.assertEqual({row["username"] for row in rows}, {"u1", "u2"})
+            self.assertNotIn("password", rows[0])
+
+            with open(os.path.join(out, "likes.csv")) as f:
+                self.assertEqual(len(f.readlines()), 2)
@@ -0,0 +1,244 @@
+"""Follow graph tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_graph.py
+
+import threading
+from array import array
+from unittest import TestCase
+from unittest.mock import patch
+
+from app import create_app
+from graph import CSR, FollowGraph
+from models import db, User, Follows, FollowEvent
+
+app = create_app({
+    'SQLALCHEMY_DATABASE_URI': "postgresql:///warbler_test",
+    'WTF_CSRF_ENABLED': False,
+    'GRAPH_SYNC_INTERVAL': 0,
+    # built in the request, except in test_background_build
+    'GRAPH_BUILD_IN_BACKGROUND': False,
+})
+app.app_context().push()
+
+db.drop_all()
+db.create_all()
+
+
+class CSRTestCase(TestCase):
+    def test_from_edges(self):
+        csr = CSR.from_edges(array("i", [2, 0, 2, 2]), array("i", [5, 1, 3, 4]))
+
+        self.assertEqual(csr.offsets.tolist(), [0, 1, 1, 4])
+        self.assertEqual(csr.targets.tolist(), [1, 3, 4, 5])
+        self.assertEqual(csr.row(2).tolist(), [3, 4, 5])
+        self.assertTrue(csr.has(2, 4))
+        self.assertFalse(csr.has(2, 2))
+        self.assertEqual(csr.degree(1), 0)
+
+    def test_unknown_user(self):
+        csr = CSR.from_edges(array("i", [0]), array("i", [1]))
+
+        self.assertEqual(csr.degree(99), 0)
+        self.assertFalse(csr.has(99, 0))
+        self.assertEqual(csr.row(-1).tolist(), [])
+
+
+class FollowGraphTestCase(TestCase):
+    def setUp(self):
+        # 1 follows 2 and 3, 2 follows 3
+        self.graph = FollowGraph(array("i", [1, 1, 2]), array("i", [2, 3, 3]))
+
+    def test_queries(self):
+        self.assertTrue(self.graph.is_following(1, 2))
+        self.assertFalse(self.graph.is_following(2, 1))
+        self.assertEqual(self.graph.following_ids(1), [2, 3])
+        self.assertEqual(self.graph.follower_ids(3), [1, 2])
+        self.assertEqual(self.graph.following_count(1), 2)
+        self.assertEqual(self.graph.follower_count(3), 2)
+
+    def test_set_follow(self):
+        self.graph.set_follow(3, 1, True)
+        self.graph.set_follow(1, 2, False)
+
+        self.assertTrue(self.graph.is_following(3, 1))
+        self.assertFalse(self.graph.is_following(1, 2))
+        self.assertEqual(self.graph.following_ids(1), [3])
+        self.assertEqual(self.graph.follower_ids(1), [3])
+        self.assertEqual(self.graph.follower_count(2), 0)
+
+    def test_set_follow_is_idempotent(self):
+        self.graph.set_follow(1, 2, True)
+        self.graph.set_follow(3, 1, False)
+        self.graph.set_follow(2, 1, True)
+        self.graph.set_follow(2, 1, True)
+
+        self.assertEqual(self.graph.following_count(1), 2)
+        self.assertEqual(self.graph.following_count(2), 2)
+        self.assertEqual(self.graph.changes, 1)
+
+    def test_compact(self):
+        self.graph.set_follow(3, 1, True)
+        self.graph.set_follow(1, 2, False)
+
+        graph = self.graph.compact()
+
+        self.assertEqual(graph.changes, 0)
+        self.assertEqual(graph.following.base.targets.tolist(), [3, 3, 1])
+        self.assertEqual(graph.follower_ids(1), [3])
+        self.assertFalse(graph.is_following(1, 2))
+
+
+class FollowGraphIndexTestCase(TestCase):
+    def setUp(self):
+        FollowEvent.query.delete()
+        User.query.delete()
+
+        u1 = User.signup("u1", "u1@email.com", "password", None)
+        u2 = User.signup("u2", "u2@email.com", "password", None)
+        u3 = User.signup("u3", "u3@email.com", "password", None)
+        db.session.flush()
+
+        u1.following.append(u2)
+        db.session.commit()
+
+        self.u1_id = u1.id
+        self.u2_id = u2.id
+        self.u3_id = u3.id
+
+        self.index = app.extensions["follow_graph"]
+        self.index.graph = None
+
+        self.client = app.test_client()
+        with self.client.session_transaction() as sess:
+            sess["curr_user"] = self.u1_id
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def test_build(self):
+        graph = self.index.get()
+
+        self.assertEqual(graph.following_ids(self.u1_id), [self.u2_id])
+        self.assertEqual(graph.follower_ids(self.u2_id), [self.u1_id])
+
+    def test_trigger_logs_events(self):
+        u1 = db.session.get(User, self.u1_id)
+        u1.following = []
+        db.session.commit()
+
+        events = FollowEvent.query.order_by(FollowEvent.id).all()
+
+        self.assertEqual(
+            [(e.follower_id, e.followed_id) for e in events],
+            [(self.u1_id, self.u2_id)] * 2)
+
+    def test_sync(self):
+        self.index.get()
+
+        db.session.add(Follows(
+            user_following_id=self.u3_id, user_being_followed_id=self.u1_id))
+        Follows.query.filter_by(user_following_id=self.u1_id).delete()
+        db.session.commit()
+
+        graph = self.index.get()
+
+        self.assertTrue(graph.is_following(self.u3_id, self.u1_id))
+        self.assertEqual(graph.following_ids(self.u1_id), [])
+        self.assertEqual(self.index.watermark, db.session.scalar(
+            db.select(db.func.max(FollowEvent.id))))
+
+    def test_sync_cascade(self):
+        self.index.get()
+
+        User.query.filter_by(id=self.u2_id).delete()
+        db.session.commit()
+
+        self.assertEqual(self.index.get().following_count(self.u1_id), 0)
+
+    def test_gap_holds_watermark(self):
+        self.index.get()
+        watermark = self.index.watermark
+
+        # a follow whose event id is used up, then rolled back
+        db.session.add(Follows(
+            user_following_id=self.u3_id, user_being_followed_id=self.u1_id))
+        db.session.flush()
+        db.session.rollback()
+
+        db.session.add(Follows(
+            user_following_id=self.u3_id, user_being_followed_id=self.u2_id))
+        db.session.commit()
+
+        graph = self.index.get()
+
+        self.assertTrue(graph.is_following(self.u3_id, self.u2_id))
+        self.assertEqual(self.index.watermark, watermark)
+
+        app.config["GRAPH_EVENT_GAP_TIMEOUT"] = 0
+        self.addCleanup(app.config.__setitem__, "GRAPH_EVENT_GAP_TIMEOUT", 10)
+        self.index.get()
+
+        self.assertEqual(self.index.watermark, watermark + 2)
+
+    def test_follow_route_updates_graph(self):
+        self.index.get()
+        app.config["GRAPH_SYNC_INTERVAL"] = 3600
+        self.addCleanup(app.config.__setitem__, "GRAPH_SYNC_INTERVAL", 0)
+
+        self.client.post(
+            f"/users/follow/{self.u3_id}", data={"curr-url": "/"})
+
+        self.assertEqual(
+            self.index.get().following_ids(self.u1_id),
+            sorted([self.u2_id, self.u3_id]))
+
+        self.client.post(
+            f"/users/stop-following/{self.u2_id}", data={"curr-url": "/"})
+
+        self.assertEqual(
+            self.index.get().following_ids(self.u1_id), [self.u3_id])
+
+    def test_compacts_overlay(self):
+        self.index.get()
+        app.config["GRAPH_OVERLAY_LIMIT"] = 0
+        self.addCleanup(app.config.__setitem__, "GRAPH_OVERLAY_LIMIT", 10000)
+
+        self.index.apply(self.u3_id, self.u1_id, True)
+
+        self.assertEqual(self.index.graph.changes, 0)
+        self.assertTrue(self.index.graph.is_following(self.u3_id, self.u1_id))
+
+    def test_background_build(self):
+        app.config["GRAPH_BUILD_IN_BACKGROUND"] = True
+        self.addCleanup(app.config.update, GRAPH_BUILD_IN_BACKGROUND=False)
+
+        scanned = threading.Event()
+        done = threading.Event()
+
+        def build_slowly(followers, followed_users):
+            scanned.set()
+            done.wait(10)
+            return FollowGraph(followers, followed_users)
+
+        with patch("graph.FollowGraph", build_slowly):
+            try:
+                # read from the database while the graph builds
+                self.assertIsNone(self.index.get())
+                self.assertTrue(scanned.wait(10))
+                u1 = db.session.get(User, self.u1_id)
+                self.assertEqual(u1.following_ids(), [self.u2_id])
+
+                # and follows don't wait for it
+                self.client.post(
+                    f"/users/follow/{self.u3_id}", data={"curr-url": "/"})
+            finally:
+                done.set()
+
+            self.assertTrue(self.index._updating.acquire(timeout=10))
+            self.index._updating.release()
+
+        # the follow made during the build isn't lost
+        self.assertEqual(self.index.graph.following_ids(self.u1_id),
+                         sorted([self.u2_id, self.u3_id]))
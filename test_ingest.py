@@ -0,0 +1,135 @@
+"""Bulk message import tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_ingest.py
+
+import json
+from unittest import TestCase
+
+from app import create_app, CURR_USER_KEY
+from models import db, Like, Message, User
+from timeline import get_timelines
+
+app = create_app({
+    'SQLALCHEMY_DATABASE_URI': "postgresql:///warbler_test",
+    'WTF_CSRF_ENABLED': False,
+    'GRAPH_SYNC_INTERVAL': 0,
+    'INGEST_MAX_MESSAGES': 5,
+    'INGEST_CHUNK_SIZE': 2,
+})
+app.app_context().push()
+
+db.drop_all()
+db.create_all()
+
+
+class IngestTestCase(TestCase):
+    def setUp(self):
+        # other test modules push their apps' contexts too
+        ctx = app.app_context()
+        ctx.push()
+        self.addCleanup(ctx.pop)
+
+        Like.query.delete()
+        Message.query.delete()
+        User.query.delete()
+
+        u1 = User.signup("u1", "u1@email.com", "password", None)
+        u2 = User.signup("u2", "u2@email.com", "password", None)
+        db.session.flush()
+        u2.following.append(u1)
+        db.session.commit()
+
+        self.u1_id = u1.id
+        self.u2 = u2
+
+        self.client = app.test_client()
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.u1_id
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def post_ndjson(self, records):
+        body = "\n".join(json.dumps(record) for record in records)
+        return self.client.post(
+            "/api/messages/import", data=body,
+            content_type="application/x-ndjson")
+
+    def test_ndjson(self):
+        resp = self.post_ndjson([
+            {"text": f"m{i}", "timestamp": f"2019-05-0{i + 1}T12:00:00Z"}
+            for i in range(3)
+        ])
+
+        self.assertEqual(resp.status_code, 201)
+        self.assertEqual(resp.json["created"], 3)
+
+        messages = Message.query.order_by(Message.id).all()
+        self.assertEqual([m.text for m in messages], ["m0", "m1", "m2"])
+        self.assertEqual(messages[2].timestamp.isoformat(),
+                         "2019-05-03T12:00:00")
+        self.assertTrue(all(m.user_id == self.u1_id for m in messages))
+
+    def test_csv(self):
+        body = 'text,timestamp\nhello,\n"with, comma",2019-05-01 12:00:00\n'
+
+        resp = self.client.post(
+            "/api/messages/import", data=body, content_type="text/csv")
+
+        self.assertEqual(resp.status_code, 201)
+        self.assertEqual(
+            {m.text for m in Message.query}, {"hello", "with, comma"})
+
+    def test_rejects_whole_batch(self):
+        resp = self.post_ndjson([
+            {"text": "ok"},
+            {"text": ""},
+            {"text": "x" * 141},
+            {"text": "ok", "timestamp": "yesterday"},
+            {"text": 5},
+        ])
+
+        self.assertEqual(resp.status_code, 400)
+        self.assertEqual([error["line"] for error in resp.json["errors"]],
+                         [2, 3, 4, 5])
+        self.assertIn("text", resp.json["errors"][1]["errors"])
+        self.assertEqual(Message.query.count(), 0)
+
+    def test_not_json(self):
+        resp = self.client.post(
+            "/api/messages/import", data='{"text": "ok"}\n[1]\n{',
+            content_type="application/x-ndjson")
+
+        self.assertEqual([error["line"] for error in resp.json["errors"]],
+                         [2, 3])
+
+    def test_too_many(self):
+        resp = self.post_ndjson([{"text": f"m{i}"} for i in range(6)])
+
+        self.assertEqual(resp.status_code, 400)
+        self.assertEqual(resp.json["errors"][0]["line"], 6)
+        self.assertEqual(Message.query.count(), 0)
+
+    def test_content_type(self):
+        resp = self.client.post(
+            "/api/messages/import", data="text\nhi\n",
+            content_type="text/plain")
+
+        self.assertEqual(resp.status_code, 415)
+
+    def test_logged_out(self):
+        resp = app.test_client().post(
+            "/api/messages/import", data="{}",
+            content_type="application/x-ndjson")
+
+        self.assertEqual(resp.status_code, 401)
+
+    def test_invalidates_followers_timelines(self):
+        timelines = get_timelines()
+        self.assertEqual(timelines.message_ids(self.u2), [])
+
+        self.post_ndjson([{"text": "m0"}, {"text": "m1"}])
+
+        self.assertEqual(len(timelines.message_ids(self.u2)), 2)
@@ -0,0 +1,182 @@
+"""Background job tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_jobs.py
+
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+from app import create_app
+from jobs import TASKS, enqueue, requeue_stale, run_pending, task
+from models import db, Job, Like, LikeBucket, Message, TrendingCount, User
+from trending import PERIODS
+import tasks
+
+app = create_app({
+    'SQLALCHEMY_DATABASE_URI': "postgresql:///warbler_test",
+    'WTF_CSRF_ENABLED': False,
+    'JOB_RETRY_DELAY': 0,
+    'JOB_MAX_ATTEMPTS': 2,
+})
+app.app_context().push()
+
+db.drop_all()
+db.create_all()
+
+calls = []
+
+
+@task
+def record_call(n, fail=0):
+    """Task for these tests: records its calls; raises `fail` times."""
+
+    calls.append(n)
+    if len(calls) <= fail:
+        raise RuntimeError("failed")
+
+
+@task
+def count_down(n):
+    """Task for these tests: runs in `n` chunks."""
+
+    calls.append(n)
+    if n > 1:
+        return {"n": n - 1}
+
+
+class JobsTestCase(TestCase):
+    def setUp(self):
+        Job.query.delete()
+        TrendingCount.query.delete()
+        LikeBucket.query.delete()
+        Like.query.delete()
+        Message.query.delete()
+        User.query.delete()
+        db.session.commit()
+
+        calls.clear()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def test_run(self):
+        job = enqueue("record_call", n=1)
+        db.session.commit()
+
+        self.assertEqual(run_pending(app.config), 1)
+        self.assertEqual(calls, [1])
+        self.assertEqual(job.status, "done")
+        self.assertIsNotNone(job.finished_at)
+
+    def test_unknown_task(self):
+        with self.assertRaises(ValueError):
+            enqueue("no_such_task")
+
+    def test_not_due(self):
+        job = enqueue("record_call", n=1)
+        job.run_at = datetime.utcnow() + timedelta(hours=1)
+        db.session.commit()
+
+        self.assertEqual(run_pending(app.config), 0)
+
+    def test_chunks(self):
+        job = enqueue("count_down", n=3)
+        db.session.commit()
+
+        run_pending(app.config)
+
+        self.assertEqual(calls, [3, 2, 1])
+        self.assertEqual(job.status, "done")
+
+    def test_retry(self):
+        job = enqueue("record_call", n=1, fail=1)
+        db.session.commit()
+
+        run_pending(app.config)
+
+        self.assertEqual(calls, [1, 1])
+        self.assertEqual(job.status, "done")
+        self.assertEqual(job.attempts, 2)
+        self.assertIn("RuntimeError", job.last_error)
+
+    def test_gives_up(self):
+        job = enqueue("record_call", n=1, fail=5)
+        db.session.commit()
+
+        run_pending(app.config)
+
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(job.status, "failed")
+
+    def test_requeue_stale(self):
+        job = enqueue("record_call", n=1)
+        job.status = "running"
+        job.locked_at = datetime.utcnow() - timedelta(hours=1)
+        db.session.commit()
+
+        requeue_stale(60)
+        run_pending(app.config)
+
+        self.assertEqual(job.status, "done")
+
+    def test_delete_user(self):
+        u1 = User.signup("u1", "u1@email.com", "password", None)
+        u2 = User.signup("u2", "u2@email.com", "password", None)
+        db.session.flush()
+
+        messages = [Message(text=f"m{i}", user_id=u1.id) for i in range(5)]
+        db.session.add_all(messages)
+        db.session.flush()
+        u2.liked_messages.append(messages[0])
+        u1.following.append(u2)
+        db.session.commit()
+        u1_id = u1.id
+
+        client = app.test_client()
+        with client.session_transaction() as sess:
+            sess["curr_user"] = u1_id
+
+        resp = client.post("/users/delete")
+
+        self.assertEqual(resp.status_code, 302)
+        self.assertEqual(Job.query.one().task, "delete_user")
+
+        tasks.DELETE_CHUNK_SIZE = 2
+        self.addCleanup(setattr, tasks, "DELETE_CHUNK_SIZE", 1000)
+
+        # like of m0, follow of u2, three chunks of messages, then u1
+        self.assertEqual(run_pending(app.config), 6)
+        self.assertIsNone(db.session.get(User, u1_id))
+        self.assertEqual(Message.query.count(), 0)
+        self.assertEqual(Like.query.count(), 0)
+
+    def test_delete_user_uncounts_likes(self):
+        u1 = User.signup("u1", "u1@email.com", "password", None)
+        u2 = User.signup("u2", "u2@email.com", "password", None)
+        db.session.flush()
+
+        message = Message(text="m", user_id=u2.id)
+        db.session.add(message)
+        db.session.commit()
+        u1_id, message_id = u1.id, message.id
+
+        client = app.test_client()
+        with client.session_transaction() as sess:
+            sess["curr_user"] = u1_id
+
+        client.post(f"/messages/{message_id}/like", data={"curr-url": "/"})
+        self.assertEqual(
+            {c.period: c.like_count for c in TrendingCount.query},
+            dict.fromkeys(PERIODS, 1))
+
+        client.post("/users/delete")
+        run_pending(app.config)
+
+        self.assertEqual(TrendingCount.query.count(), 0)
+        self.assertEqual(LikeBucket.query.one().like_count, 0)
+
+    def test_maintenance_tasks_registered(self):
+        for name in ("prune_follow_events", "expire_trending",
+                     "update_suggestions"):
+            self.assertIn(name, TASKS)
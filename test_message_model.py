@@ -4,13 +4,13 @@
 #
 #    python -m unittest test_message_model.py
 
-from app import app
-import os
 from unittest import TestCase
 from sqlalchemy.exc import IntegrityError
+from app import create_app
 from models import db, User, Message, Like
 
-os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
+app = create_app({'SQLALCHEMY_DATABASE_URI': "postgresql:///warbler_test"})
+app.app_context().push()
 
 db.drop_all()
 db.create_all()
@@ -5,27 +5,22 @@
 #    FLASK_DEBUG=False python -m unittest test_message_views.py
 
 
-import os
 from unittest import TestCase
 
 from models import db, Message, User
+from app import create_app, CURR_USER_KEY
 
-# BEFORE we import our app, let's set an environmental variable
-# to use a different database for tests (we need to do this
-# before we import our app, since that will have already
-# connected to the database
+# Use a different database for tests, and don't have WTForms use CSRF at
+# all, since it's a pain to test
 
-os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
+app = create_app({
+    'SQLALCHEMY_DATABASE_URI': "postgresql:///warbler_test",
+    'WTF_CSRF_ENABLED': False,
 
-# Now we can import app
-
-from app import app, CURR_USER_KEY
-
-app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
-
-# This is a bit of hack, but don't use Flask DebugToolbar
-
-app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+    # see follows changes made outside the routes straight away
+    'GRAPH_SYNC_INTERVAL': 0,
+})
+app.app_context().push()
 
 # Create our tables (we do this here, so we only create the tables
 # once for all tests --- in each test, we'll delete the data
@@ -34,10 +29,6 @@ app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
 db.drop_all()
 db.create_all()
 
-# Don't have WTForms use CSRF at all, since it's a pain to test
-
-app.config['WTF_CSRF_ENABLED'] = False
-
 
 class MessageBaseViewTestCase(TestCase):
     def setUp(self):
@@ -71,3 +62,31 @@ class MessageAddViewTestCase(MessageBaseViewTestCase):
             self.assertEqual(resp.status_code, 302)
 
             Message.query.filter_by(text="Hello").one()
+
+
+class MessageCardsViewTestCase(MessageBaseViewTestCase):
+    def test_cards(self):
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u1_id
+
+            resp = c.get(f"/messages/cards?ids={self.m1_id},0")
+
+            self.assertEqual(resp.status_code, 200)
+            html = resp.get_data(as_text=True)
+            self.assertIn(f'data-message-id="{self.m1_id}"', html)
+            self.assertIn("m1-text", html)
+
+    def test_cards_bad_ids(self):
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u1_id
+
+            resp = c.get("/messages/cards?ids=x")
+
+            self.assertEqual(resp.status_code, 400)
+
+    def test_no_stream_in_sync_mode(self):
+        resp = self.client.get("/messages/stream")
+
+        self.assertEqual(resp.status_code, 204)
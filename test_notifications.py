@@ -0,0 +1,156 @@
+"""Notification tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_notifications.py
+
+from unittest import TestCase
+
+from app import create_app, CURR_USER_KEY
+from models import (
+    db, Follows, Like, Message, Notification, NotificationEvent, User)
+from notifications import aggregate
+
+app = create_app({
+    'SQLALCHEMY_DATABASE_URI': "postgresql:///warbler_test",
+    'WTF_CSRF_ENABLED': False,
+    'GRAPH_SYNC_INTERVAL': 0,
+    'RATELIMIT_ENABLED': False,
+})
+app.app_context().push()
+
+db.drop_all()
+db.create_all()
+
+
+class NotificationsTestCase(TestCase):
+    def setUp(self):
+        # other test modules push their apps' contexts too
+        ctx = app.app_context()
+        ctx.push()
+        self.addCleanup(ctx.pop)
+
+        app.extensions["cache"].clear()
+
+        NotificationEvent.query.delete()
+        Notification.query.delete()
+        Like.query.delete()
+        Follows.query.delete()
+        Message.query.delete()
+        User.query.delete()
+
+        users = [User.signup(f"u{i}", f"u{i}@email.com", "password", None)
+                 for i in range(4)]
+        db.session.flush()
+
+        message = Message(text="hello", user_id=users[0].id)
+        db.session.add(message)
+        db.session.commit()
+
+        self.user_ids = [user.id for user in users]
+        self.message_id = message.id
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def client_for(self, user_id):
+        client = app.test_client()
+        with client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+        return client
+
+    def like(self, user_id):
+        self.client_for(user_id).post(
+            f"/messages/{self.message_id}/like", data={"curr-url": "/"})
+
+    def unlike(self, user_id):
+        self.client_for(user_id).post(
+            f"/messages/{self.message_id}/unlike", data={"curr-url": "/"})
+
+    def follow(self, user_id, other_id):
+        self.client_for(user_id).post(
+            f"/users/follow/{other_id}", data={"curr-url": "/"})
+
+    def unread(self, user_id):
+        db.session.expire_all()
+        return db.session.get(User, user_id).unread_notifications
+
+    def test_grouped(self):
+        u0, u1, u2, u3 = self.user_ids
+
+        for user_id in (u1, u2, u3):
+            self.like(user_id)
+        self.follow(u1, u0)
+        self.follow(u2, u0)
+
+        # queued, not yet notified
+        self.assertEqual(NotificationEvent.query.count(), 5)
+        self.assertEqual(self.unread(u0), 0)
+
+        self.assertEqual(aggregate(batch_size=2), (5, 2))
+        self.assertEqual(NotificationEvent.query.count(), 0)
+        self.assertEqual(self.unread(u0), 2)
+
+        counts = {n.kind: (n.count, n.actor_id, n.message_id)
+                  for n in Notification.query}
+        self.assertEqual(counts, {
+            "like": (3, u3, self.message_id),
+            "follow": (2, u2, None),
+        })
+
+    def test_badge_and_page(self):
+        u0, u1, u2, u3 = self.user_ids
+        client = self.client_for(u0)
+
+        self.like(u1)
+        self.like(u2)
+        aggregate(batch_size=100)
+
+        html = client.get("/messages/new").get_data(as_text=True)
+        self.assertIn('id="unread-notifications"', html)
+
+        html = client.get("/notifications").get_data(as_text=True)
+        self.assertIn("2 people", html)
+        self.assertIn("liked", html)
+        self.assertIn("list-group-item-info", html)
+        self.assertNotIn('id="unread-notifications"', html)
+        self.assertEqual(self.unread(u0), 0)
+
+        # a like after reading starts a new notification
+        self.like(u3)
+        aggregate(batch_size=100)
+        self.assertEqual(self.unread(u0), 1)
+        self.assertEqual(Notification.query.count(), 2)
+
+        html = client.get("/notifications").get_data(as_text=True)
+        self.assertIn("@u3", html)
+
+    def test_same_actor_in_batch(self):
+        u0, u1, _, _ = self.user_ids
+
+        self.like(u1)
+        self.unlike(u1)
+        self.like(u1)
+
+        self.assertEqual(aggregate(batch_size=100), (2, 1))
+        self.assertEqual(Notification.query.one().count, 1)
+
+    def test_failed_like_not_queued(self):
+        _, u1, _, _ = self.user_ids
+
+        self.like(u1)
+        self.like(u1)
+        self.assertEqual(NotificationEvent.query.count(), 1)
+
+    def test_deleted_user(self):
+        u0, u1, _, _ = self.user_ids
+
+        self.follow(u1, u0)
+        self.client_for(u0).post("/users/delete")
+
+        self.assertEqual(aggregate(batch_size=100), (1, 0))
+        self.assertEqual(Notification.query.count(), 0)
+
+    def test_logged_out(self):
+        resp = app.test_client().get("/notifications")
+        self.assertEqual(resp.status_code, 302)
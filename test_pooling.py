@@ -0,0 +1,112 @@
+"""Connection pool settings tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_pooling.py
+
+import logging
+import os
+from unittest import TestCase
+
+from sqlalchemy.pool import NullPool
+
+from app import create_app
+from models import db
+from pooling import (
+    POOL_DEFAULTS, engine_options, log_pool_status, pool_config_from_env,
+    pool_status)
+
+app = create_app({'SQLALCHEMY_DATABASE_URI': "postgresql:///warbler_test"})
+app.app_context().push()
+
+POSTGRES_CONFIG = {
+    **POOL_DEFAULTS,
+    "SQLALCHEMY_DATABASE_URI": "postgresql:///warbler_test",
+}
+
+
+class PoolingTestCase(TestCase):
+    def test_config_from_env(self):
+        config = pool_config_from_env({
+            "DB_POOL_SIZE": "12",
+            "DB_PGBOUNCER": "true",
+            "DB_POOL_PRE_PING": "0",
+            "UNRELATED": "x",
+        })
+
+        self.assertEqual(config, {
+            "DB_POOL_SIZE": 12,
+            "DB_PGBOUNCER": True,
+            "DB_POOL_PRE_PING": False,
+        })
+
+    def test_engine_options(self):
+        options = engine_options({**POSTGRES_CONFIG, "DB_POOL_RECYCLE": 100})
+
+        self.assertEqual(options["pool_size"], 5)
+        self.assertEqual(options["max_overflow"], 10)
+        self.assertTrue(options["pool_pre_ping"])
+        self.assertEqual(options["pool_recycle"], 100)
+        self.assertNotIn("connect_args", options)
+
+    def test_statement_timeout(self):
+        options = engine_options(
+            {**POSTGRES_CONFIG, "DB_STATEMENT_TIMEOUT": 5000})
+
+        self.assertEqual(
+            options["connect_args"],
+            {"options": "-c statement_timeout=5000"})
+
+    def test_pgbouncer_no_startup_options(self):
+        options = engine_options({
+            **POSTGRES_CONFIG,
+            "DB_STATEMENT_TIMEOUT": 5000,
+            "DB_PGBOUNCER": True,
+            "DB_POOL_SIZE": 0,
+        })
+
+        self.assertIs(options["poolclass"], NullPool)
+        self.assertNotIn("connect_args", options)
+
+    def test_pool_status(self):
+        with db.engine.connect():
+            status = pool_status(db.engine)
+
+        self.assertEqual(status["pool"], "QueuePool")
+        self.assertGreaterEqual(status["checked_out"], 1)
+
+    def test_recycle_jitter_per_process(self):
+        # as gunicorn --preload forks workers from a process with the app
+        recycles = []
+        for _ in range(5):
+            read, write = os.pipe()
+            pid = os.fork()
+            if pid == 0:
+                os.write(write, str(db.engine.pool._recycle).encode())
+                os._exit(0)
+            os.close(write)
+            os.waitpid(pid, 0)
+            with os.fdopen(read) as f:
+                recycles.append(int(f.read()))
+
+        self.assertTrue(all(1800 <= r <= 1980 for r in recycles), recycles)
+        self.assertGreater(len(set(recycles)), 1)
+
+    def test_report_interval_enables_info(self):
+        app.logger.setLevel(logging.NOTSET)
+        self.addCleanup(app.logger.setLevel, logging.NOTSET)
+
+        create_app({
+            'SQLALCHEMY_DATABASE_URI': "postgresql:///warbler_test",
+            'DB_POOL_REPORT_INTERVAL': 60,
+            'TEMPLATES_WARMUP': False,
+        })
+
+        self.assertTrue(app.logger.isEnabledFor(logging.INFO))
+
+    def test_log_pool_status(self):
+        with self.assertLogs(app.logger, "INFO") as logs:
+            log_pool_status(app)
+
+        self.assertIn("db pool pid=", logs.output[0])
+        self.assertIn("checked_out=", logs.output[0])
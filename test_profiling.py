@@ -0,0 +1,97 @@
+"""Request profiling tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_profiling.py
+
+import os
+import tempfile
+from unittest import TestCase
+
+from models import db, User
+from app import create_app, CURR_USER_KEY
+from profiling import PROFILE_HEADER, make_profile_token, read_collapsed
+
+app = create_app({
+    'SQLALCHEMY_DATABASE_URI': "postgresql:///warbler_test",
+    'WTF_CSRF_ENABLED': False,
+})
+app.app_context().push()
+
+db.drop_all()
+db.create_all()
+
+
+class ProfilingTestCase(TestCase):
+    def setUp(self):
+        User.query.delete()
+
+        u1 = User.signup("u1", "u1@email.com", "password", None)
+        db.session.commit()
+        self.u1_id = u1.id
+
+        self.profile_dir = tempfile.mkdtemp()
+        app.config['PROFILE_DIR'] = self.profile_dir
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+        db.session.rollback()
+        app.config['PROFILE_FORMAT'] = "collapsed"
+        app.config['PROFILE_SAMPLE_RATE'] = 0
+        app.config['PROFILE_SAMPLE_ENDPOINT'] = None
+
+    def test_no_token_no_profile(self):
+        resp = self.client.get("/login")
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(os.listdir(self.profile_dir), [])
+
+    def test_bad_token_no_profile(self):
+        resp = self.client.get("/login", headers={PROFILE_HEADER: "nope"})
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(os.listdir(self.profile_dir), [])
+
+    def test_header_token_collapsed(self):
+        token = make_profile_token(app)
+
+        resp = self.client.post(
+            "/login",
+            data={"username": "u1", "password": "password"},
+            headers={PROFILE_HEADER: token})
+
+        self.assertEqual(resp.status_code, 302)
+
+        [name] = os.listdir(self.profile_dir)
+        self.assertIn("-warbler.login-", name)
+        self.assertTrue(name.endswith(".collapsed"))
+
+        samples = read_collapsed(os.path.join(self.profile_dir, name))
+        self.assertGreater(sum(samples.values()), 0)
+
+    def test_query_token_pstats(self):
+        app.config['PROFILE_FORMAT'] = "pstats"
+        token = make_profile_token(app)
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u1_id
+            resp = c.get(f"/?_profile={token}")
+
+        self.assertEqual(resp.status_code, 200)
+
+        [name] = os.listdir(self.profile_dir)
+        self.assertIn("-warbler.homepage-", name)
+        self.assertTrue(name.endswith(".prof"))
+
+    def test_aggregate_sampling(self):
+        app.config['PROFILE_SAMPLE_ENDPOINT'] = "warbler.login"
+        app.config['PROFILE_SAMPLE_RATE'] = 2
+
+        for _ in range(4):
+            self.client.get("/login")
+        self.client.get("/signup")
+
+        [name] = os.listdir(self.profile_dir)
+        self.assertTrue(name.startswith("aggregate-warbler.login-"))
@@ -0,0 +1,176 @@
+"""Rate limiting tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_ratelimit.py
+
+from unittest import TestCase
+
+from app import create_app, CURR_USER_KEY
+from cache import LRUCache
+from models import db, Message, User
+from ratelimit import TokenBucket, parse_limit
+
+app = create_app({
+    'SQLALCHEMY_DATABASE_URI': "postgresql:///warbler_test",
+    'WTF_CSRF_ENABLED': False,
+    'GRAPH_SYNC_INTERVAL': 0,
+    'RATELIMITS': {
+        "warbler.login": {"ip": "2/minute"},
+        "warbler.add_message": {"user": "1/minute"},
+        "api.import_messages": {"ip": "5/minute", "user": "1/hour"},
+    },
+})
+app.app_context().push()
+
+db.drop_all()
+db.create_all()
+
+
+class TokenBucketTestCase(TestCase):
+    def test_parse_limit(self):
+        self.assertEqual(parse_limit("10/minute"), (10, 60))
+        with self.assertRaises(ValueError):
+            parse_limit("10/fortnight")
+
+    def test_take(self):
+        cache = LRUCache(1024)
+        bucket = TokenBucket(2, 60)
+
+        self.assertEqual(bucket.take(cache, "k", now=0), 0)
+        self.assertEqual(bucket.take(cache, "k", now=0), 0)
+        self.assertEqual(bucket.take(cache, "k", now=0), 30)
+        self.assertEqual(bucket.take(cache, "k", now=15), 15)
+        self.assertEqual(bucket.take(cache, "k", now=30), 0)
+
+        # never more than `capacity` tokens
+        self.assertEqual(bucket.take(cache, "k", now=1000), 0)
+        self.assertEqual(bucket.take(cache, "k", now=1000), 0)
+        self.assertEqual(bucket.take(cache, "k", now=1000), 30)
+
+
+class RateLimitTestCase(TestCase):
+    def setUp(self):
+        # other test modules push their apps' contexts too
+        ctx = app.app_context()
+        ctx.push()
+        self.addCleanup(ctx.pop)
+
+        app.extensions["cache"].clear()
+
+        Message.query.delete()
+        User.query.delete()
+
+        u1 = User.signup("u1", "u1@email.com", "password", None)
+        u2 = User.signup("u2", "u2@email.com", "password", None)
+        db.session.commit()
+
+        self.u1_id = u1.id
+        self.u2_id = u2.id
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def client_for(self, user_id):
+        client = app.test_client()
+        with client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+        return client
+
+    def login(self, ip="10.0.0.1", **kwargs):
+        return app.test_client().post(
+            "/login",
+            data={"username": "u1", "password": "wrong"},
+            environ_base={"REMOTE_ADDR": ip},
+            **kwargs)
+
+    def test_ip_limit(self):
+        self.assertEqual(self.login().status_code, 200)
+        self.assertEqual(self.login().status_code, 200)
+
+        resp = self.login()
+        self.assertEqual(resp.status_code, 429)
+        self.assertEqual(resp.headers["Retry-After"], "30")
+
+        self.assertEqual(self.login(ip="10.0.0.2").status_code, 200)
+
+    def test_get_not_limited(self):
+        for _ in range(3):
+            resp = app.test_client().get("/login")
+            self.assertEqual(resp.status_code, 200)
+
+    def test_proxies(self):
+        app.config["RATELIMIT_PROXIES"] = 1
+        self.addCleanup(app.config.update, RATELIMIT_PROXIES=0)
+
+        for _ in range(2):
+            self.login(headers={"X-Forwarded-For": "1.2.3.4, 10.0.0.9"})
+        resp = self.login(headers={"X-Forwarded-For": "1.2.3.4, 10.0.0.9"})
+        self.assertEqual(resp.status_code, 429)
+
+        # a client can't pick its own address
+        resp = self.login(headers={"X-Forwarded-For": "1.2.3.4, 10.0.0.8"})
+        self.assertEqual(resp.status_code, 200)
+
+    def test_user_limit(self):
+        c1 = self.client_for(self.u1_id)
+        c2 = self.client_for(self.u2_id)
+
+        resp = c1.post("/messages/new", data={"text": "one"})
+        self.assertEqual(resp.status_code, 302)
+
+        resp = c1.post("/messages/new", data={"text": "two"})
+        self.assertEqual(resp.status_code, 429)
+        self.assertEqual(resp.headers["Retry-After"], "60")
+
+        resp = c2.post("/messages/new", data={"text": "three"})
+        self.assertEqual(resp.status_code, 302)
+
+        self.assertEqual(
+            sorted(m.text for m in Message.query), ["one", "three"])
+
+    def test_disabled(self):
+        app.config["RATELIMIT_ENABLED"] = False
+        self.addCleanup(app.config.update, RATELIMIT_ENABLED=True)
+
+        for _ in range(3):
+            self.assertEqual(self.login().status_code, 200)
+
+    def test_api_json(self):
+        client = self.client_for(self.u1_id)
+
+        def post():
+            return client.post(
+                "/api/messages/import",
+                data='{"text": "hi"}\n',
+                content_type="application/x-ndjson")
+
+        self.assertEqual(post().status_code, 201)
+
+        resp = post()
+        self.assertEqual(resp.status_code, 429)
+        self.assertEqual(resp.headers["Retry-After"], "3600")
+        self.assertIn("error", resp.json)
+
+
+class UnsharedCacheTestCase(TestCase):
+    def create_app(self, **config):
+        return create_app({
+            'SQLALCHEMY_DATABASE_URI': "postgresql:///warbler_test",
+            'GRAPH_SYNC_INTERVAL': 0,
+            'TEMPLATES_WARMUP': False,
+            **config,
+        })
+
+    def test_null_cache(self):
+        # every bucket would always be full
+        with self.assertRaises(ValueError):
+            self.create_app(CACHE_TYPE="null")
+
+        self.create_app(CACHE_TYPE="null", RATELIMIT_ENABLED=False)
+        self.create_app(CACHE_TYPE="null", TESTING=True)
+
+    def test_lru_cache(self):
+        with self.assertLogs("app", "WARNING") as logs:
+            self.create_app(CACHE_TYPE="lru")
+        self.assertIn("per worker", logs.output[0])
@@ -0,0 +1,103 @@
+"""Read-replica routing tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_replicas.py
+#
+# These use two SQLite files, standing in for a primary and a replica, on a
+# small app of their own.
+
+import os
+import tempfile
+from unittest import TestCase
+
+from flask import Flask
+
+from models import db, User
+from replicas import init_replicas, read_only
+
+db_dir = tempfile.mkdtemp()
+
+replica_app = Flask(__name__)
+replica_app.config['SECRET_KEY'] = "replica-test"
+replica_app.config['SQLALCHEMY_DATABASE_URI'] = (
+    f"sqlite:///{os.path.join(db_dir, 'primary.db')}")
+replica_app.config['SQLALCHEMY_REPLICA_URLS'] = [
+    f"sqlite:///{os.path.join(db_dir, 'replica.db')}"]
+replica_app.config['REPLICA_STICKY_SECONDS'] = 60
+
+init_replicas(replica_app)
+db.init_app(replica_app)
+
+
+@replica_app.get('/read/<int:user_id>')
+@read_only
+def read_user(user_id):
+    user = db.session.get(User, user_id)
+    return user.username if user else "missing"
+
+
+@replica_app.get('/read-primary/<int:user_id>')
+def read_user_primary(user_id):
+    user = db.session.get(User, user_id)
+    return user.username if user else "missing"
+
+
+@replica_app.post('/write/<int:user_id>')
+def write_user(user_id):
+    user = db.session.get(User, user_id)
+    user.bio = "updated"
+    db.session.commit()
+    return "ok"
+
+
+class ReplicaRoutingTestCase(TestCase):
+    def setUp(self):
+        with replica_app.app_context():
+            engines = {
+                "primary": db.engine,
+                "replica": replica_app.extensions["warbler_replicas"][0],
+            }
+
+            for name, engine in engines.items():
+                db.metadata.drop_all(engine)
+                db.metadata.create_all(engine)
+
+                # give each database a different username for user #1, so
+                # we can tell which one a query went to
+                with engine.begin() as conn:
+                    conn.execute(User.__table__.insert().values(
+                        id=1,
+                        username=f"from-{name}",
+                        email="u1@email.com",
+                        password="password",
+                    ))
+
+        self.client = replica_app.test_client()
+
+    def test_read_only_view_uses_replica(self):
+        resp = self.client.get("/read/1")
+        self.assertEqual(resp.get_data(as_text=True), "from-replica")
+
+    def test_other_views_use_primary(self):
+        resp = self.client.get("/read-primary/1")
+        self.assertEqual(resp.get_data(as_text=True), "from-primary")
+
+    def test_sticks_to_primary_after_write(self):
+        with self.client as c:
+            c.post("/write/1")
+            resp = c.get("/read/1")
+
+        self.assertEqual(resp.get_data(as_text=True), "from-primary")
+
+    def test_stickiness_expires(self):
+        replica_app.config['REPLICA_STICKY_SECONDS'] = 0
+
+        try:
+            with self.client as c:
+                c.post("/write/1")
+                resp = c.get("/read/1")
+        finally:
+            replica_app.config['REPLICA_STICKY_SECONDS'] = 60
+
+        self.assertEqual(resp.get_data(as_text=True), "from-replica")
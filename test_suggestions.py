@@ -0,0 +1,114 @@
+"""Follow suggestion tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_suggestions.py
+
+from unittest import TestCase
+
+from app import create_app
+from models import db, User, Follows, FollowEvent, FollowSuggestion, Watermark
+from suggestions import run
+
+app = create_app({
+    'SQLALCHEMY_DATABASE_URI': "postgresql:///warbler_test",
+    'WTF_CSRF_ENABLED': False,
+    'GRAPH_SYNC_INTERVAL': 0,
+    'SUGGESTIONS_SETTLE_SECONDS': 0,
+})
+app.app_context().push()
+
+db.drop_all()
+db.create_all()
+
+
+class SuggestionsTestCase(TestCase):
+    def setUp(self):
+        Watermark.query.delete()
+        FollowEvent.query.delete()
+        User.query.delete()
+
+        users = {
+            name: User.signup(name, f"{name}@email.com", "password", None)
+            for name in "abcde"
+        }
+        db.session.flush()
+        self.ids = {name: user.id for name, user in users.items()}
+
+        # a -> b -> c, d; a -> e -> d
+        for follower, followed in ["ab", "bc", "bd", "ae", "ed"]:
+            self.follow(follower, followed)
+        db.session.commit()
+
+        self.client = app.test_client()
+        with self.client.session_transaction() as sess:
+            sess["curr_user"] = self.ids["a"]
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def follow(self, follower, followed):
+        db.session.add(Follows(
+            user_following_id=self.ids[follower],
+            user_being_followed_id=self.ids[followed]))
+
+    def suggestions(self, name):
+        return [
+            (s.rank, s.suggested_user_id, s.score)
+            for s in FollowSuggestion.query
+            .filter_by(user_id=self.ids[name])
+            .order_by(FollowSuggestion.rank)
+        ]
+
+    def test_full(self):
+        self.assertEqual(run(app, full=True), (5, 2))
+
+        self.assertEqual(self.suggestions("a"), [
+            (1, self.ids["d"], 2),
+            (2, self.ids["c"], 1),
+        ])
+        self.assertEqual(self.suggestions("e"), [])
+
+    def test_incremental(self):
+        run(app)
+
+        # now a also gets f from e; b's suggestions don't change
+        db.session.add(User.signup("f", "f@email.com", "password", None))
+        db.session.flush()
+        self.ids["f"] = User.query.filter_by(username="f").one().id
+        self.follow("e", "f")
+        db.session.commit()
+
+        users, _ = run(app)
+
+        self.assertEqual(users, 2)
+        self.assertIn((3, self.ids["f"], 1), self.suggestions("a"))
+
+        self.assertEqual(run(app), (0, 0))
+
+    def test_excludes_followed(self):
+        self.follow("a", "d")
+        db.session.commit()
+
+        run(app, full=True)
+
+        self.assertEqual(self.suggestions("a"), [(1, self.ids["c"], 1)])
+
+    def test_homepage(self):
+        run(app, full=True)
+
+        resp = self.client.get("/")
+        html = resp.get_data(as_text=True)
+
+        self.assertIn("Who to follow", html)
+        self.assertIn("@d", html)
+
+    def test_hides_users_followed_since(self):
+        run(app, full=True)
+
+        self.client.post(
+            f"/users/follow/{self.ids['d']}", data={"curr-url": "/"})
+
+        a = db.session.get(User, self.ids["a"])
+        self.assertEqual(
+            [user.id for user in a.follow_suggestions()], [self.ids["c"]])
@@ -0,0 +1,61 @@
+"""Template cache and warmup tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_templating.py
+
+import os
+import tempfile
+from unittest import TestCase
+
+from app import create_app
+
+
+class TemplatingTestCase(TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.cache_dir = tmp.name
+
+    def create_app(self, **config):
+        return create_app({
+            'SQLALCHEMY_DATABASE_URI': "postgresql:///warbler_test",
+            'TEMPLATES_CACHE_DIR': self.cache_dir,
+            **config,
+        })
+
+    def test_warmup(self):
+        app = self.create_app()
+
+        # every template is loaded, and its bytecode saved
+        names = app.jinja_loader.list_templates()
+        self.assertIn("base.html", names)
+        self.assertIn("users/signup.html", names)
+        app.jinja_env.compile = None
+        for name in names:
+            app.jinja_env.get_template(name)
+        self.assertEqual(len(os.listdir(self.cache_dir)), len(names))
+
+        # and a new worker loads them from there rather than compiling
+        app = self.create_app(TEMPLATES_WARMUP=False)
+        app.jinja_env.compile = None
+        resp = app.test_client().get("/login")
+        self.assertEqual(resp.status_code, 200)
+
+    def test_no_warmup(self):
+        app = self.create_app(TEMPLATES_WARMUP=False)
+        self.assertEqual(os.listdir(self.cache_dir), [])
+
+        app.test_client().get("/login")
+        self.assertNotEqual(os.listdir(self.cache_dir), [])
+
+    def test_compile_command(self):
+        app = self.create_app(TEMPLATES_WARMUP=False)
+
+        result = app.test_cli_runner().invoke(
+            args=["templates", "compile", "--clear"])
+        self.assertEqual(result.exit_code, 0, result.output)
+
+        count = len(app.jinja_loader.list_templates())
+        self.assertIn(f"{count} templates", result.output)
+        self.assertEqual(len(os.listdir(self.cache_dir)), count)
@@ -0,0 +1,182 @@
+"""Timeline cache tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_timeline.py
+
+import os
+import tempfile
+from unittest import TestCase
+from unittest.mock import patch
+
+from sqlalchemy import insert, select
+
+from app import create_app, CURR_USER_KEY
+from jobs import run_pending
+from models import db, Follows, Job, Like, Message, User
+from timeline import get_timelines
+
+# timelines are only cached in a shared cache
+cache_dir = tempfile.TemporaryDirectory()
+
+app = create_app({
+    'SQLALCHEMY_DATABASE_URI': "postgresql:///warbler_test",
+    'WTF_CSRF_ENABLED': False,
+    'GRAPH_SYNC_INTERVAL': 0,
+    'TIMELINE_STATS_INTERVAL': 0,
+    'CACHE_TYPE': "sqlite",
+    'CACHE_SQLITE_PATH': os.path.join(cache_dir.name, "cache.sqlite3"),
+})
+app.app_context().push()
+
+db.drop_all()
+db.create_all()
+
+
+class TimelineTestCase(TestCase):
+    def setUp(self):
+        # other test modules push their apps' contexts too
+        ctx = app.app_context()
+        ctx.push()
+        self.addCleanup(ctx.pop)
+
+        Like.query.delete()
+        Message.query.delete()
+        User.query.delete()
+
+        u1 = User.signup("u1", "u1@email.com", "password", None)
+        u2 = User.signup("u2", "u2@email.com", "password", None)
+        u3 = User.signup("u3", "u3@email.com", "password", None)
+        db.session.flush()
+
+        u1.following.append(u2)
+        db.session.add(Message(text="u2 first", user_id=u2.id))
+        db.session.commit()
+
+        self.u1 = u1
+        self.u2_id = u2.id
+        self.u3_id = u3.id
+
+        self.timelines = get_timelines()
+        self.client = app.test_client()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def login(self, user_id):
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+
+    def texts(self):
+        ids = self.timelines.message_ids(self.u1)
+        return [db.session.get(Message, id).text for id in ids]
+
+    def test_cached(self):
+        before = self.timelines.stats()
+
+        self.assertEqual(self.texts(), ["u2 first"])
+
+        # not invalidated by changes made outside the routes
+        db.session.add(Message(text="u2 second", user_id=self.u2_id))
+        db.session.commit()
+        self.assertEqual(self.texts(), ["u2 first"])
+
+        stats = self.timelines.stats()
+        self.assertEqual(stats["misses"] - before["misses"], 1)
+        self.assertEqual(stats["hits"] - before["hits"], 1)
+        self.assertGreater(stats["hit_rate"], 0)
+
+    def test_unshared_cache(self):
+        self.texts()
+
+        # another worker's post would never reach this worker's lru cache
+        with patch.dict(app.config, CACHE_TYPE="lru"):
+            db.session.add(Message(text="u2 second", user_id=self.u2_id))
+            db.session.commit()
+            self.assertEqual(self.texts(), ["u2 second", "u2 first"])
+
+    def test_followed_user_posts(self):
+        self.texts()
+
+        self.login(self.u2_id)
+        self.client.post("/messages/new", data={"text": "u2 second"})
+
+        self.assertEqual(self.texts(), ["u2 second", "u2 first"])
+
+    def test_followed_user_deletes(self):
+        self.texts()
+        msg_id = Message.query.one().id
+
+        self.login(self.u2_id)
+        self.client.post(f"/messages/{msg_id}/delete")
+
+        self.assertEqual(self.texts(), [])
+
+    def test_other_user_posts(self):
+        self.texts()
+
+        self.login(self.u3_id)
+        self.client.post("/messages/new", data={"text": "u3 first"})
+        db.session.add(Message(text="u2 second", user_id=self.u2_id))
+        db.session.commit()
+
+        # u3's post didn't invalidate u1's timeline
+        self.assertEqual(self.texts(), ["u2 first"])
+
+    def test_follow_and_unfollow(self):
+        db.session.add(Message(text="u3 first", user_id=self.u3_id))
+        db.session.commit()
+        self.texts()
+
+        self.login(self.u1.id)
+        self.client.post(f"/users/follow/{self.u3_id}",
+                         data={"curr-url": "/"})
+        self.assertEqual(self.texts(), ["u3 first", "u2 first"])
+
+        self.client.post(f"/users/stop-following/{self.u3_id}",
+                         data={"curr-url": "/"})
+        self.assertEqual(self.texts(), ["u2 first"])
+
+    def test_homepage(self):
+        self.login(self.u1.id)
+
+        resp = self.client.get("/")
+
+        self.assertIn("u2 first", resp.get_data(as_text=True))
+
+    def test_many_followers(self):
+        # u2 gets thousands more followers, all with cached timelines
+        db.session.execute(insert(User), [
+            {"username": f"f{i}", "email": f"f{i}@email.com",
+             "password": "x"}
+            for i in range(5000)])
+        follower_ids = db.session.scalars(
+            select(User.id).where(User.username.startswith("f"))).all()
+        db.session.execute(insert(Follows), [
+            {"user_being_followed_id": self.u2_id, "user_following_id": id}
+            for id in follower_ids])
+        db.session.commit()
+        Job.query.delete()
+        db.session.commit()
+
+        follower = db.session.get(User, follower_ids[-1])
+        self.timelines.message_ids(follower)
+        self.texts()
+
+        # posting bumps a constant number of cache keys
+        backend = app.extensions["cache"].backend
+        with patch.object(backend, "update",
+                          wraps=backend.update) as update, \
+                patch.object(backend, "update_many",
+                             wraps=backend.update_many) as update_many:
+            self.login(self.u2_id)
+            self.client.post("/messages/new", data={"text": "u2 second"})
+        self.assertLessEqual(update.call_count + update_many.call_count, 3)
+
+        self.assertEqual(Job.query.one().task, "invalidate_timelines")
+        self.assertEqual(run_pending(app.config), 1)
+
+        texts = [db.session.get(Message, id).text
+                 for id in self.timelines.message_ids(follower)]
+        self.assertEqual(texts, ["u2 second", "u2 first"])
+        self.assertEqual(self.texts(), ["u2 second", "u2 first"])
@@ -0,0 +1,149 @@
+"""Trending messages tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_trending.py
+
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+from app import create_app
+from models import db, User, Message, Like, LikeBucket, TrendingCount, Watermark
+from trending import expire, rebuild, record_like, trending_messages
+
+app = create_app({
+    'SQLALCHEMY_DATABASE_URI': "postgresql:///warbler_test",
+    'WTF_CSRF_ENABLED': False,
+    'RATELIMIT_ENABLED': False,
+})
+app.app_context().push()
+
+db.drop_all()
+db.create_all()
+
+BUCKET = app.config["TRENDING_BUCKET_SECONDS"]
+
+
+class TrendingTestCase(TestCase):
+    def setUp(self):
+        Watermark.query.delete()
+        Like.query.delete()
+        Message.query.delete()
+        User.query.delete()
+
+        u1 = User.signup("u1", "u1@email.com", "password", None)
+        u2 = User.signup("u2", "u2@email.com", "password", None)
+        db.session.flush()
+
+        m1 = Message(text="m1-text", user_id=u2.id)
+        m2 = Message(text="m2-text", user_id=u2.id)
+        db.session.add_all([m1, m2])
+        db.session.commit()
+
+        self.u1_id = u1.id
+        self.u2_id = u2.id
+        self.m1_id = m1.id
+        self.m2_id = m2.id
+
+        self.client = app.test_client()
+        with self.client.session_transaction() as sess:
+            sess["curr_user"] = self.u1_id
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def like(self, message_id, user_id, liked_at):
+        """Add a like as the like route would, at `liked_at`."""
+
+        db.session.add(
+            Like(message_id=message_id, user_id=user_id, liked_at=liked_at))
+        record_like(message_id, liked_at, BUCKET)
+        db.session.commit()
+
+    def counts(self, period):
+        return {
+            message.id: count
+            for message, count in trending_messages(period, 10)
+        }
+
+    def test_like_and_unlike_routes(self):
+        self.client.post(
+            f"/messages/{self.m1_id}/like", data={"curr-url": "/"})
+
+        self.assertEqual(self.counts("hour"), {self.m1_id: 1})
+        self.assertEqual(self.counts("week"), {self.m1_id: 1})
+
+        self.client.post(
+            f"/messages/{self.m1_id}/unlike", data={"curr-url": "/"})
+
+        self.assertEqual(self.counts("hour"), {})
+        self.assertEqual(Like.query.count(), 0)
+
+        # expiry is left to cron or the jobs worker
+        self.assertEqual(Watermark.query.count(), 0)
+
+    def test_unlike_twice(self):
+        self.client.post(
+            f"/messages/{self.m1_id}/like", data={"curr-url": "/"})
+        self.client.post(
+            f"/messages/{self.m1_id}/unlike", data={"curr-url": "/"})
+        resp = self.client.post(
+            f"/messages/{self.m1_id}/unlike", data={"curr-url": "/"})
+
+        self.assertEqual(resp.status_code, 302)
+        self.assertEqual(self.counts("day"), {})
+
+    def test_expire(self):
+        now = datetime.utcnow()
+        self.like(self.m1_id, self.u1_id, now - timedelta(hours=3))
+        self.like(self.m2_id, self.u1_id, now)
+
+        expire(now, BUCKET)
+
+        self.assertEqual(self.counts("hour"), {self.m2_id: 1})
+        self.assertEqual(self.counts("day"), {self.m1_id: 1, self.m2_id: 1})
+
+        expire(now + timedelta(days=2), BUCKET)
+
+        self.assertEqual(self.counts("hour"), {})
+        self.assertEqual(self.counts("day"), {})
+        self.assertEqual(self.counts("week"), {self.m1_id: 1, self.m2_id: 1})
+
+        expire(now + timedelta(days=8), BUCKET)
+
+        self.assertEqual(self.counts("week"), {})
+        self.assertEqual(LikeBucket.query.count(), 0)
+
+    def test_unlike_after_expiry(self):
+        now = datetime.utcnow()
+        self.like(self.m1_id, self.u1_id, now - timedelta(hours=3))
+        expire(now, BUCKET)
+
+        # the like has already left the hour, so only day and week change
+        self.client.post(
+            f"/messages/{self.m1_id}/unlike", data={"curr-url": "/"})
+
+        self.assertEqual(TrendingCount.query.count(), 0)
+
+    def test_rebuild(self):
+        now = datetime.utcnow()
+        self.like(self.m1_id, self.u1_id, now - timedelta(hours=3))
+        self.like(self.m2_id, self.u1_id, now)
+        expire(now, BUCKET)
+        counts = {period: self.counts(period) for period in ("hour", "day")}
+
+        rebuild(now, BUCKET)
+
+        self.assertEqual(
+            {period: self.counts(period) for period in ("hour", "day")},
+            counts)
+
+    def test_trending_page(self):
+        self.like(self.m2_id, self.u1_id, datetime.utcnow())
+
+        resp = self.client.get("/messages/trending?period=hour")
+        html = resp.get_data(as_text=True)
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn("m2-text", html)
+        self.assertNotIn("m1-text", html)
@@ -0,0 +1,210 @@
+"""Signup uniqueness check tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_uniqueness.py
+
+import threading
+from unittest import TestCase
+from unittest.mock import patch
+
+from app import create_app, CURR_USER_KEY
+from models import db, bcrypt, User
+from uniqueness import BloomFilter, taken_fields
+
+app = create_app({
+    'SQLALCHEMY_DATABASE_URI': "postgresql:///warbler_test",
+    'WTF_CSRF_ENABLED': False,
+    'GRAPH_SYNC_INTERVAL': 0,
+    'RATELIMIT_ENABLED': False,
+    # synced by hand below
+    'UNIQUENESS_SYNC_INTERVAL': 3600,
+    # built in the request, except in test_background_build
+    'UNIQUENESS_BUILD_IN_BACKGROUND': False,
+})
+app.app_context().push()
+
+db.drop_all()
+db.create_all()
+
+
+class BloomFilterTestCase(TestCase):
+    def test_filter(self):
+        names = BloomFilter(1000, 0.01)
+        for i in range(1000):
+            names.add(f"user{i}")
+
+        # never a false negative, and about 1% false positives
+        self.assertTrue(all(f"user{i}" in names for i in range(1000)))
+        false_positives = sum(f"other{i}" in names for i in range(10000))
+        self.assertLess(false_positives, 300)
+        self.assertLess(names.nbytes, 1300)
+
+
+class UniquenessTestCase(TestCase):
+    def setUp(self):
+        # other test modules push their apps' contexts too
+        ctx = app.app_context()
+        ctx.push()
+        self.addCleanup(ctx.pop)
+
+        User.query.delete()
+
+        u1 = User.signup("Alice", "Alice@email.com", "password", None)
+        u2 = User.signup("bob", "bob@email.com", "password", None)
+        db.session.commit()
+
+        self.u1_id = u1.id
+        self.u2_id = u2.id
+
+        self.index = app.extensions["uniqueness"]
+        self.index.filter = None
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def test_taken_fields(self):
+        self.assertEqual(taken_fields(username="alice"), {"username"})
+        self.assertEqual(
+            taken_fields(username="BOB", email="alice@EMAIL.com "),
+            {"username", "email"})
+        self.assertEqual(taken_fields(username="carol", email="c@email.com"),
+                         set())
+
+        # a user's own names aren't taken
+        self.assertEqual(
+            taken_fields(self.u1_id, username="alice", email="bob@email.com"),
+            {"email"})
+
+    def test_filter_skips_query(self):
+        self.assertIsNotNone(self.index.get())
+
+        with patch.object(db.session, "execute") as execute:
+            self.assertEqual(taken_fields(username="carol"), set())
+        execute.assert_not_called()
+
+    def test_before_built(self):
+        # a thread that can't wait for the filter to be built asks the
+        # database
+        locked = threading.Event()
+        done = threading.Event()
+
+        def build_slowly():
+            with self.index._updating:
+                locked.set()
+                done.wait()
+
+        thread = threading.Thread(target=build_slowly)
+        thread.start()
+        locked.wait()
+        try:
+            self.assertEqual(taken_fields(username="alice"), {"username"})
+            self.assertIsNone(self.index.filter)
+        finally:
+            done.set()
+            thread.join()
+
+    def test_background_build(self):
+        app.config["UNIQUENESS_BUILD_IN_BACKGROUND"] = True
+        self.addCleanup(
+            app.config.update, UNIQUENESS_BUILD_IN_BACKGROUND=False)
+
+        scanned = threading.Event()
+        done = threading.Event()
+
+        class SlowFilter(BloomFilter):
+            def add(self, key):
+                # the scan's query has run: hold it up there
+                scanned.set()
+                done.wait(10)
+                super().add(key)
+
+        with patch("uniqueness.BloomFilter", SlowFilter):
+            try:
+                # answered from the database while the filter builds
+                self.assertEqual(taken_fields(username="alice"), {"username"})
+                self.assertTrue(scanned.wait(10))
+                self.assertIsNone(self.index.filter)
+
+                # a signup meanwhile isn't lost
+                app.test_client().post("/signup", data={
+                    "username": "carol", "email": "carol@email.com",
+                    "password": "password"})
+            finally:
+                done.set()
+
+            self.assertTrue(self.index._updating.acquire(timeout=10))
+            self.index._updating.release()
+
+        self.assertIsNotNone(self.index.filter)
+        self.assertTrue(self.index.might_have("username", "carol"))
+        self.assertTrue(self.index.might_have("username", "alice"))
+
+    def test_sync(self):
+        self.index.get()
+
+        # signed up through another worker
+        User.signup("carol", "carol@email.com", "password", None)
+        db.session.commit()
+
+        self.assertEqual(taken_fields(username="carol"), set())
+        self.index.sync()
+        self.assertEqual(taken_fields(username="carol"), {"username"})
+
+    def test_signup_taken_skips_hash(self):
+        self.index.get()
+
+        with patch.object(bcrypt, "generate_password_hash") as generate:
+            resp = app.test_client().post("/signup", data={
+                "username": "ALICE", "email": "new@email.com",
+                "password": "password"})
+        generate.assert_not_called()
+
+        html = resp.get_data(as_text=True)
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn("Username and/or email already taken", html)
+        self.assertIn("Already taken.", html)
+        self.assertEqual(User.query.count(), 2)
+
+    def test_signup_updates_filter(self):
+        self.index.get()
+
+        app.test_client().post("/signup", data={
+            "username": "carol", "email": "carol@email.com",
+            "password": "password"})
+        self.assertEqual(taken_fields(username="Carol"), {"username"})
+        self.assertEqual(taken_fields(email="carol@email.com"), {"email"})
+
+    def test_profile_taken(self):
+        client = app.test_client()
+        with client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.u2_id
+
+        with patch.object(bcrypt, "check_password_hash") as check:
+            resp = client.post("/users/profile", data={
+                "username": "alice", "email": "bob@email.com",
+                "password": "password"})
+        check.assert_not_called()
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn("Username and/or email already taken",
+                      resp.get_data(as_text=True))
+        self.assertEqual(db.session.get(User, self.u2_id).username, "bob")
+
+        # changing the case of your own username is fine
+        resp = client.post("/users/profile", data={
+            "username": "Bob", "email": "bob@email.com",
+            "password": "password"})
+        self.assertEqual(resp.status_code, 302)
+
+    def test_available(self):
+        client = app.test_client()
+
+        resp = client.get("/signup/available?username=alice")
+        self.assertEqual(resp.json, {"available": False})
+
+        resp = client.get("/signup/available?username=carol")
+        self.assertEqual(resp.json, {"available": True})
+
+        resp = client.get("/signup/available")
+        self.assertEqual(resp.status_code, 400)
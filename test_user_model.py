@@ -5,16 +5,19 @@
 #    python -m unittest test_user_model.py
 
 
-import os
 from sqlalchemy.exc import IntegrityError
 from unittest import TestCase
 from flask_bcrypt import Bcrypt
 
 from models import db, User, Follows, Like, Message
-
-os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
-
-from app import app
+from app import create_app
+
+app = create_app({
+    'SQLALCHEMY_DATABASE_URI': "postgresql:///warbler_test",
+    # see follows changes made outside the routes straight away
+    'GRAPH_SYNC_INTERVAL': 0,
+})
+app.app_context().push()
 
 # instantiate Bcrypt to create hashed passwords for test data
 bcrypt = Bcrypt()
@@ -4,30 +4,35 @@
 #
 #    python -m unittest test_user_views.py
 
-from app import app
-import os
 from unittest import TestCase
 
+from datetime import datetime, timedelta
+
 from flask import session
 from flask_bcrypt import Bcrypt
+from sqlalchemy import event, update
 from sqlalchemy.exc import IntegrityError
-from models import db, User, Message, Like
-
-# BEFORE we import our app, let's set an environmental variable
-# to use a different database for tests (we need to do this
-# before we import our app, since that will have already
-# connected to the database
+from app import create_app, FOLLOWS_PER_PAGE, LIKES_PER_PAGE
+from cache import cached_get
+from models import db, User, Message, Like, Follows, Job
 
-os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
+app = create_app({
+    # use a different database for tests
+    'SQLALCHEMY_DATABASE_URI': "postgresql:///warbler_test",
 
+    # Don't req CSRF for testing
+    'WTF_CSRF_ENABLED': False,
 
-app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+    # Make Flask errors be real errors, rather than HTML pages with error info
+    'TESTING': True,
 
-# Don't req CSRF for testing
-app.config['WTF_CSRF_ENABLED'] = False
+    # see follows changes made outside the routes straight away
+    'GRAPH_SYNC_INTERVAL': 0,
 
-# Make Flask errors be real errors, rather than HTML pages with error info
-app.config['TESTING'] = True
+    # tested in test_ratelimit.py
+    'RATELIMIT_ENABLED': False,
+})
+app.app_context().push()
 
 
 # Create our tables (we do this here, so we only create the tables
@@ -53,6 +58,8 @@ class UserRoutesTestCase(TestCase):
     def setUp(self):
         """Make demo data."""
 
+        Job.query.delete()
+        Like.query.delete()
         User.query.delete()
 
         u1 = User.signup("u1", "u1@email.com", "password", None)
@@ -197,4 +204,202 @@ class UserRoutesTestCase(TestCase):
             self.assertEqual(resp.location, "/")
             self.assertEqual(session.get("curr_user"), None)
 
+    def test_liked_messages_pages(self):
+        start = datetime(2023, 1, 1)
+        for i in range(LIKES_PER_PAGE + 5):
+            msg = Message(text=f"msg-{i}", user_id=self.u2_id)
+            db.session.add(msg)
+            db.session.flush()
+            db.session.add(Like(
+                message_id=msg.id,
+                user_id=self.u1_id,
+                liked_at=start + timedelta(minutes=i)))
+        db.session.commit()
+
+        with app.test_client() as client:
+            with client.session_transaction() as sess:
+                sess["curr_user"] = self.u1_id
+
+            resp = client.get(f"/users/{self.u1_id}/likes")
+            html = resp.get_data(as_text=True)
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn(f"msg-{LIKES_PER_PAGE + 4}<", html)
+            self.assertIn("msg-5<", html)
+            self.assertNotIn("msg-4<", html)
+            self.assertIn(str(LIKES_PER_PAGE + 5), html)
+            self.assertIn("Older", html)
+
+            resp = client.get(
+                f"/users/{self.u1_id}/likes",
+                query_string={
+                    "before": (start + timedelta(minutes=5)).isoformat(),
+                    "before_id": "0",
+                })
+            html = resp.get_data(as_text=True)
+
+            self.assertIn("msg-4<", html)
+            self.assertIn("msg-0<", html)
+            self.assertNotIn("msg-5<", html)
+            self.assertNotIn("Older", html)
+
+    def test_liked_messages_like_counts(self):
+        msg = Message(text="popular", user_id=self.u2_id)
+        likers = [
+            User(username=f"liker{i}", email=f"liker{i}@email.com",
+                 password="x")
+            for i in range(30)
+        ]
+        db.session.add(msg)
+        db.session.add_all(likers)
+        db.session.flush()
+        db.session.add_all(
+            Like(message_id=msg.id, user_id=user.id)
+            for user in likers + [db.session.get(User, self.u1_id)])
+        db.session.commit()
+        db.session.expunge_all()
+
+        loaded = []
+
+        def on_load(target, context):
+            loaded.append(target)
+
+        event.listen(User, "load", on_load)
+        try:
+            with app.test_client() as client:
+                with client.session_transaction() as sess:
+                    sess["curr_user"] = self.u1_id
+
+                resp = client.get(f"/users/{self.u1_id}/likes")
+                html = resp.get_data(as_text=True)
+        finally:
+            event.remove(User, "load", on_load)
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn('<span class="text-muted">31</span>', html)
+        # the page's users and the message's author, not its likers
+        self.assertFalse(any(user.username.startswith("liker")
+                             for user in loaded))
+
+    def test_followers_pages(self):
+        followers = [
+            User(username=f"f{i}", email=f"f{i}@email.com", password="x")
+            for i in range(FOLLOWS_PER_PAGE + 2)
+        ]
+        db.session.add_all(followers)
+        db.session.flush()
+
+        for follower in followers:
+            db.session.add(Follows(
+                user_following_id=follower.id,
+                user_being_followed_id=self.u2_id))
+
+        # u1 follows the last follower back
+        db.session.add(Follows(
+            user_following_id=self.u1_id,
+            user_being_followed_id=followers[-1].id))
+        db.session.commit()
+
+        with app.test_client() as client:
+            with client.session_transaction() as sess:
+                sess["curr_user"] = self.u1_id
+
+            resp = client.get(f"/users/{self.u2_id}/followers")
+            html = resp.get_data(as_text=True)
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("@f0<", html)
+            self.assertNotIn(f"@f{FOLLOWS_PER_PAGE}<", html)
+            self.assertNotIn("Unfollow", html)
+            self.assertIn(
+                f"?after={followers[FOLLOWS_PER_PAGE - 1].id}", html)
+
+            resp = client.get(
+                f"/users/{self.u2_id}/followers"
+                f"?after={followers[FOLLOWS_PER_PAGE - 1].id}")
+            html = resp.get_data(as_text=True)
+
+            self.assertNotIn("@f0<", html)
+            self.assertIn(f"@f{FOLLOWS_PER_PAGE}<", html)
+            self.assertEqual(html.count("Unfollow"), 1)
+            self.assertNotIn("?after=", html)
+
+    def test_following_page(self):
+        db.session.add(Follows(
+            user_following_id=self.u2_id, user_being_followed_id=self.u1_id))
+        db.session.commit()
+
+        with app.test_client() as client:
+            with client.session_transaction() as sess:
+                sess["curr_user"] = self.u1_id
+
+            resp = client.get(f"/users/{self.u2_id}/following")
+            html = resp.get_data(as_text=True)
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("@u1<", html)
+
+    def test_delete_user_hides_user(self):
+        msg = Message(text="u2-message", user_id=self.u2_id)
+        db.session.add(msg)
+        db.session.add(Follows(
+            user_following_id=self.u1_id, user_being_followed_id=self.u2_id))
+        db.session.commit()
+
+        with app.test_client() as client:
+            with client.session_transaction() as sess:
+                sess["curr_user"] = self.u2_id
+
+            resp = client.post("/users/delete")
+            self.assertEqual(resp.status_code, 302)
+
+            with client.session_transaction() as sess:
+                sess["curr_user"] = self.u2_id
+
+            # a deleted user's old session no longer logs them in
+            resp = client.get("/")
+            self.assertIn("New to Warbler?", resp.get_data(as_text=True))
+
+            with client.session_transaction() as sess:
+                sess["curr_user"] = self.u1_id
+
+            resp = client.get("/")
+            self.assertNotIn("u2-message", resp.get_data(as_text=True))
+
+            resp = client.get(f"/users/{self.u2_id}")
+            self.assertEqual(resp.status_code, 404)
+
+            resp = client.get(f"/messages/{msg.id}")
+            self.assertEqual(resp.status_code, 404)
+
+            resp = client.get(f"/users/{self.u1_id}/following")
+            self.assertNotIn("@u2<", resp.get_data(as_text=True))
+
+        self.assertFalse(User.authenticate("u2", "password"))
+
+    def test_changes_from_other_workers(self):
+        # another worker renames u1 and deletes u2: this one's cache (lru)
+        # never hears of it
+        for user_id in (self.u1_id, self.u2_id):
+            cached_get(User, user_id)
+        db.session.execute(
+            update(User).where(User.id == self.u1_id).values(username="new"))
+        db.session.execute(
+            update(User).where(User.id == self.u2_id)
+            .values(deleted_at=datetime.utcnow()))
+        db.session.commit()
+
+        with app.test_client() as client:
+            with client.session_transaction() as sess:
+                sess["curr_user"] = self.u2_id
+            resp = client.get("/")
+            self.assertIn("New to Warbler?", resp.get_data(as_text=True))
+
+            with client.session_transaction() as sess:
+                sess["curr_user"] = self.u1_id
+            resp = client.post("/users/profile", data={
+                "username": "new", "email": "u1@email.com",
+                "password": "password"})
+            self.assertEqual(resp.status_code, 302)
+
     # TODO: next --> test general user routes
@@ -0,0 +1,211 @@
+"""Username autocomplete tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_usernames.py
+
+import threading
+from datetime import datetime
+from unittest import TestCase
+from unittest.mock import patch
+
+from sqlalchemy import update
+
+from app import create_app, CURR_USER_KEY
+from models import db, User
+from usernames import SortedNames, UsernameIndex
+
+app = create_app({
+    'SQLALCHEMY_DATABASE_URI': "postgresql:///warbler_test",
+    'WTF_CSRF_ENABLED': False,
+    'GRAPH_SYNC_INTERVAL': 0,
+    'RATELIMIT_ENABLED': False,
+    # synced by hand below
+    'USERNAMES_SYNC_INTERVAL': 3600,
+    # built in the request, except in test_background_build
+    'USERNAMES_BUILD_IN_BACKGROUND': False,
+})
+app.app_context().push()
+
+db.drop_all()
+db.create_all()
+
+
+class UsernameIndexTestCase(TestCase):
+    def setUp(self):
+        self.index = UsernameIndex(None)
+        self.index.names = SortedNames([
+            ("bob", 1), ("Alice", 2), ("alfred", 3), ("al", 4), ("zed", 5),
+        ])
+
+    def test_complete(self):
+        self.assertEqual(self.index.complete("al"),
+                         [(4, "al"), (3, "alfred"), (2, "Alice")])
+        self.assertEqual(self.index.complete("ALI"), [(2, "Alice")])
+        self.assertEqual(self.index.complete("al", limit=1), [(4, "al")])
+        self.assertEqual(self.index.complete("x"), [])
+        self.assertEqual(self.index.complete("zz"), [])
+
+    def test_changes(self):
+        self.index.add(6, "Alan")
+        self.index.add(3, "bobby")
+        self.index.remove(4)
+
+        self.assertEqual(self.index.complete("al"),
+                         [(6, "Alan"), (2, "Alice")])
+        self.assertEqual(self.index.complete("bo"),
+                         [(1, "bob"), (3, "bobby")])
+
+        self.index.add(6, "zach")
+        self.assertEqual(self.index.complete("al"), [(2, "Alice")])
+
+
+class AutocompleteViewsTestCase(TestCase):
+    def setUp(self):
+        # other test modules push their apps' contexts too
+        ctx = app.app_context()
+        ctx.push()
+        self.addCleanup(ctx.pop)
+
+        User.query.delete()
+
+        u1 = User.signup("alice", "u1@email.com", "password", None)
+        u2 = User.signup("Alfred", "u2@email.com", "password", None)
+        db.session.commit()
+
+        self.u1_id = u1.id
+        self.u2_id = u2.id
+
+        self.index = app.extensions["usernames"]
+        self.index.names = None
+
+        self.client = app.test_client()
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.u1_id
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def complete(self, q, client=None):
+        resp = (client or self.client).get(f"/api/users/autocomplete?q={q}")
+        self.assertEqual(resp.status_code, 200)
+        return [user["username"] for user in resp.json["users"]]
+
+    def test_autocomplete(self):
+        self.assertEqual(self.complete("al"), ["Alfred", "alice"])
+        self.assertIsNotNone(self.index.names)
+        self.assertEqual(self.complete("ALI"), ["alice"])
+        self.assertEqual(self.complete(""), [])
+
+    def test_before_built(self):
+        # the first request builds the index; a thread that can't wait
+        # for it reads the database instead
+        locked = threading.Event()
+        done = threading.Event()
+
+        def build_slowly():
+            with self.index._updating:
+                locked.set()
+                done.wait()
+
+        thread = threading.Thread(target=build_slowly)
+        thread.start()
+        locked.wait()
+        try:
+            self.assertEqual(self.complete("al%"), [])
+            self.assertEqual(self.complete("al"), ["Alfred", "alice"])
+            self.assertIsNone(self.index.names)
+        finally:
+            done.set()
+            thread.join()
+
+    def test_background_build(self):
+        app.config["USERNAMES_BUILD_IN_BACKGROUND"] = True
+        self.addCleanup(
+            app.config.update, USERNAMES_BUILD_IN_BACKGROUND=False)
+
+        scanned = threading.Event()
+        done = threading.Event()
+
+        def build_slowly(entries):
+            names = SortedNames(entries)
+            scanned.set()
+            done.wait(10)
+            return names
+
+        with patch("usernames.SortedNames", build_slowly):
+            try:
+                # answered from the database while the index builds
+                self.assertEqual(self.complete("al"), ["Alfred", "alice"])
+                scanned.wait(10)
+
+                # and signups don't wait for it
+                app.test_client().post("/signup", data={
+                    "username": "alan", "email": "u3@email.com",
+                    "password": "password"})
+                self.assertEqual(
+                    self.complete("al"), ["alan", "Alfred", "alice"])
+                self.assertIsNone(self.index.names)
+            finally:
+                done.set()
+
+            self.assertTrue(self.index._updating.acquire(timeout=10))
+            self.index._updating.release()
+
+        # the signup made during the build isn't lost
+        self.assertIsNotNone(self.index.names)
+        self.assertEqual(self.complete("al"), ["alan", "Alfred", "alice"])
+        self.assertNotIn("alan", [
+            self.index.names.username(i)
+            for i in range(len(self.index.names))])
+
+    def test_logged_out(self):
+        resp = app.test_client().get("/api/users/autocomplete?q=al")
+        self.assertEqual(resp.status_code, 401)
+
+    def test_signup_and_rename(self):
+        self.complete("a")
+
+        client = app.test_client()
+        client.post("/signup", data={
+            "username": "alan", "email": "u3@email.com",
+            "password": "password"})
+        self.assertEqual(self.complete("al"), ["alan", "Alfred", "alice"])
+
+        client.post("/users/profile", data={
+            "username": "zed", "email": "u3@email.com",
+            "password": "password"})
+        self.assertEqual(self.complete("al"), ["Alfred", "alice"])
+        self.assertEqual(self.complete("z"), ["zed"])
+
+        client.post("/users/delete")
+        self.assertEqual(self.complete("z"), [])
+
+    def test_other_workers_changes(self):
+        self.complete("a")
+
+        # renamed and deleted through another worker
+        db.session.execute(
+            update(User).where(User.id == self.u1_id)
+            .values(username="zed"))
+        db.session.execute(
+            update(User).where(User.id == self.u2_id)
+            .values(deleted_at=datetime.utcnow()))
+        db.session.commit()
+
+        self.assertEqual(self.complete("al"), [])
+        self.assertEqual(self.complete("z"), ["zed"])
+        # and the index is fixed up
+        self.assertEqual(self.index.complete("al"), [])
+        self.assertEqual(self.index.complete("z"), [(self.u1_id, "zed")])
+
+    def test_sync(self):
+        self.complete("a")
+
+        # signed up through another worker
+        User.signup("albert", "u3@email.com", "password", None)
+        db.session.commit()
+
+        self.assertEqual(self.complete("alb"), [])
+        self.index.sync()
+        self.assertEqual(self.complete("alb"), ["albert"])
@@ -0,0 +1,207 @@
+"""Cached home timelines.
+
+The homepage shows the newest messages by the user and the users they
+follow. `message_ids(user)` caches the ids of those messages per user, for
+TIMELINE_TTL seconds, so a refresh only has to load the messages by id
+(their likes, and so on, are always fresh). Newest is by id, the order the
+API pages in, so imported messages with old timestamps aren't left out.
+
+A user's timeline is invalidated when they follow or unfollow someone, and
+when they or anyone they follow posts, imports or deletes messages, via the
+signals those routes send. Invalidation bumps a cache tag, and the tag's
+version is read before the timeline is queried, so a timeline computed
+before a change can't be stored over it.
+
+A post's author's followers come from the follow graph. Up to
+TIMELINE_INLINE_FANOUT of them are invalidated in the request; beyond
+that, an `invalidate_timelines` job does it, in batches, so posting costs
+the same however many followers the author has.
+
+Invalidations have to reach every worker, and the jobs worker, so
+timelines are only cached when the cache is shared ("sqlite" or "redis");
+with "lru" they're read from the database every time.
+
+Hits, misses and invalidations are counted per process and added to totals
+in the cache every TIMELINE_STATS_INTERVAL seconds; see
+`flask timeline stats`.
+"""
+
+import threading
+import time
+from collections import Counter
+
+import click
+from flask import current_app
+from sqlalchemy import select
+
+from cache import cache_is_shared, get_cache, invalidate_tags
+from jobs import enqueue
+from models import db, follow_graph, Follows, Message, User
+from signals import (
+    followed, message_deleted, message_posted, messages_imported, unfollowed)
+
+DEFAULT_CONFIG = {
+    "TIMELINE_LENGTH": 100,
+    "TIMELINE_TTL": 300,
+    "TIMELINE_STATS_INTERVAL": 10,
+    "TIMELINE_INLINE_FANOUT": 100,
+}
+
+STATS_KEY = "timeline:stats"
+
+
+def timeline_tag(user_id):
+    return f"timeline:{user_id}"
+
+
+def query_message_ids(user, limit):
+    """Ids of the newest `limit` messages on `user`'s timeline.
+
+    Newest by id, i.e. most recently posted or imported, as the API pages
+    them: an imported message can have an old timestamp.
+    """
+
+    user_ids = user.following_ids()
+    user_ids.append(user.id)
+
+    return db.session.scalars(
+        select(Message.id)
+        .join(Message.user)
+        .where(Message.user_id.in_(user_ids), User.deleted_at.is_(None))
+        .order_by(Message.id.desc())
+        .limit(limit)).all()
+
+
+def follower_ids(user_id):
+    """Ids of `user_id`'s followers, from the follow graph if it's built."""
+
+    graph = follow_graph()
+    if graph:
+        return list(graph.follower_ids(user_id))
+
+    return db.session.scalars(
+        select(Follows.user_following_id)
+        .where(Follows.user_being_followed_id == user_id)).all()
+
+
+class TimelineCache:
+    """Per-user timeline message ids, in the app's cache."""
+
+    def __init__(self, config):
+        self.config = config
+        self._counts = Counter()
+        self._lock = threading.Lock()
+        self._flushed_at = time.monotonic()
+
+    def message_ids(self, user):
+        """Ids of the messages on `user`'s timeline, newest first."""
+
+        if not cache_is_shared(self.config):
+            return query_message_ids(user, self.config["TIMELINE_LENGTH"])
+
+        cache = get_cache()
+        key = cache.tagged_key(
+            f"timeline:{user.id}", [timeline_tag(user.id)])
+
+        ids = cache.get(key)
+        if ids is None:
+            self._count("misses")
+            ids = query_message_ids(user, self.config["TIMELINE_LENGTH"])
+            cache.set(key, ids, self.config["TIMELINE_TTL"])
+        else:
+            self._count("hits")
+
+        return ids
+
+    def invalidate(self, *user_ids):
+        invalidate_tags(*[timeline_tag(user_id) for user_id in user_ids])
+        self._count("invalidations", len(user_ids))
+
+    def author_changed(self, user_id):
+        """Invalidate `user_id`'s timeline and their followers', or queue
+        a job for the followers if there are many.
+        """
+
+        if not cache_is_shared(self.config):
+            return
+
+        followers = follower_ids(user_id)
+        if len(followers) <= self.config["TIMELINE_INLINE_FANOUT"]:
+            self.invalidate(user_id, *followers)
+            return
+
+        self.invalidate(user_id)
+        enqueue("invalidate_timelines", user_id=user_id)
+        db.session.commit()
+
+    def _count(self, name, n=1):
+        with self._lock:
+            self._counts[name] += n
+
+            if (time.monotonic() - self._flushed_at <
+                    self.config["TIMELINE_STATS_INTERVAL"]):
+                return
+
+            counts = self._counts
+            self._counts = Counter()
+            self._flushed_at = time.monotonic()
+
+        get_cache().update(
+            STATS_KEY, lambda totals: (totals or Counter()) + counts, ttl=0)
+
+    def stats(self):
+        """Hits, misses and invalidations so far, and the hit rate."""
+
+        with self._lock:
+            counts = get_cache().get(STATS_KEY, Counter()) + self._counts
+
+        lookups = counts["hits"] + counts["misses"]
+        return {
+            "hits": counts["hits"],
+            "misses": counts["misses"],
+            "invalidations": counts["invalidations"],
+            "hit_rate": counts["hits"] / lookups if lookups else 0.0,
+        }
+
+
+def get_timelines():
+    """Return the current app's TimelineCache."""
+
+    return current_app.extensions["timeline"]
+
+
+def init_timeline(app):
+    """Set up `app`'s timeline cache, its signal receivers and CLI."""
+
+    for key, value in DEFAULT_CONFIG.items():
+        app.config.setdefault(key, value)
+
+    timelines = app.extensions["timeline"] = TimelineCache(app.config)
+
+    @message_posted.connect_via(app, weak=False)
+    @message_deleted.connect_via(app, weak=False)
+    def on_message(sender, message_id, user_id):
+        timelines.author_changed(user_id)
+
+    @messages_imported.connect_via(app, weak=False)
+    def on_messages_imported(sender, user_id, message_ids):
+        timelines.author_changed(user_id)
+
+    @followed.connect_via(app, weak=False)
+    @unfollowed.connect_via(app, weak=False)
+    def on_follow(sender, follower_id, followed_id):
+        timelines.invalidate(follower_id)
+
+    @app.cli.group("timeline")
+    def timeline_cli():
+        """Timeline cache commands."""
+
+    @timeline_cli.command("stats")
+    def stats_command():
+        """Print the timeline cache's hit rate."""
+
+        stats = timelines.stats()
+        click.echo(f"hits: {stats['hits']}")
+        click.echo(f"misses: {stats['misses']}")
+        click.echo(f"invalidations: {stats['invalidations']}")
+        click.echo(f"hit rate: {stats['hit_rate']:.1%}")
@@ -0,0 +1,254 @@
+"""Trending messages: the most liked in the last hour, day and week.
+
+Likes are counted in time buckets (`like_buckets`, TRENDING_BUCKET_SECONDS
+long) and in a running total per message and period (`trending_counts`),
+both updated in the same transaction as the like or unlike. Reading the top
+K messages of a period is then an index scan of K rows.
+
+As time passes, buckets slide out of each period: `expire` subtracts them
+from that period's totals, moving the period's watermark (in `watermarks`)
+up to the first bucket still inside it. It isn't run by the like routes, so
+it never holds up a request: run `flask trending expire`, or queue the
+`expire_trending` job, from cron every few minutes. A period covers up to
+one bucket more than its length, plus however long since expiry last ran.
+"""
+
+from collections import Counter
+from datetime import datetime
+
+from sqlalchemy import bindparam, delete, func, insert, select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import selectinload
+
+from models import (
+    db, Like, LikeBucket, Message, TrendingCount, User, Watermark)
+
+DEFAULT_CONFIG = {
+    "TRENDING_BUCKET_SECONDS": 300,
+}
+
+PERIODS = {
+    "hour": 3600,
+    "day": 24 * 3600,
+    "week": 7 * 24 * 3600,
+}
+
+
+def watermark_name(period):
+    return f"trending:{period}"
+
+
+def bucket_of(when, bucket_seconds):
+    """Return the start of `when`'s bucket, in seconds since the epoch."""
+
+    epoch = int((when - datetime(1970, 1, 1)).total_seconds())
+    return epoch - epoch % bucket_seconds
+
+
+def add_count(model, values, key, delta):
+    """Add `delta` to `model.like_count` for the row with `values`."""
+
+    stmt = pg_insert(model).values(**values, like_count=delta)
+    db.session.execute(stmt.on_conflict_do_update(
+        index_elements=key,
+        set_={"like_count": model.like_count + delta}))
+
+
+def record_like(message_id, liked_at, bucket_seconds):
+    """Count a new like of `message_id` in its bucket and every period."""
+
+    add_count(
+        LikeBucket,
+        {"message_id": message_id,
+         "bucket": bucket_of(liked_at, bucket_seconds)},
+        ["message_id", "bucket"],
+        1)
+
+    for period in PERIODS:
+        add_count(
+            TrendingCount,
+            {"period": period, "message_id": message_id},
+            ["period", "message_id"],
+            1)
+
+
+def lock_watermarks(read=False):
+    """Lock the periods' watermarks; return {period: watermark}.
+
+    Always locked in the same order, so that expire() and record_unlike()
+    can't deadlock.
+    """
+
+    names = {watermark_name(period): period for period in PERIODS}
+
+    watermarks = db.session.scalars(
+        select(Watermark)
+        .where(Watermark.name.in_(names))
+        .order_by(Watermark.name)
+        .with_for_update(read=read)).all()
+
+    return {names[watermark.name]: watermark for watermark in watermarks}
+
+
+def record_unlike(like, bucket_seconds):
+    """Uncount `like` from its bucket and the periods it's still in."""
+
+    record_unlikes([(like.message_id, like.liked_at)], bucket_seconds)
+
+
+def record_unlikes(likes, bucket_seconds):
+    """Uncount `likes`, (message id, liked at)s, as `record_unlike` does."""
+
+    if not likes:
+        return
+
+    buckets = Counter(
+        (message_id, bucket_of(liked_at, bucket_seconds))
+        for message_id, liked_at in likes)
+
+    # keep expire() from subtracting these buckets meanwhile
+    watermarks = lock_watermarks(read=True)
+
+    like_buckets = LikeBucket.__table__
+    db.session.execute(
+        update(like_buckets)
+        .where(like_buckets.c.message_id == bindparam("b_message_id"),
+               like_buckets.c.bucket == bindparam("b_bucket"))
+        .values(like_count=like_buckets.c.like_count - bindparam("b_count")),
+        [{"b_message_id": message_id, "b_bucket": bucket, "b_count": count}
+         for (message_id, bucket), count in sorted(buckets.items())])
+
+    # likes per (period, message), for the periods each is still in
+    counts = Counter()
+    for (message_id, bucket), count in buckets.items():
+        for period in PERIODS:
+            if period not in watermarks or bucket >= watermarks[period].value:
+                counts[period, message_id] += count
+
+    trending_counts = TrendingCount.__table__
+    if counts:
+        db.session.execute(
+            update(trending_counts)
+            .where(trending_counts.c.period == bindparam("b_period"),
+                   trending_counts.c.message_id == bindparam("b_message_id"))
+            .values(like_count=(
+                trending_counts.c.like_count - bindparam("b_count"))),
+            [{"b_period": period, "b_message_id": message_id, "b_count": count}
+             for (period, message_id), count in sorted(counts.items())])
+    db.session.execute(
+        delete(TrendingCount)
+        .where(TrendingCount.message_id.in_(
+                   {message_id for message_id, _ in buckets}),
+               TrendingCount.like_count <= 0))
+
+
+def expire(now, bucket_seconds):
+    """Subtract buckets that have slid out of each period."""
+
+    db.session.execute(
+        pg_insert(Watermark)
+        .values([{"name": watermark_name(p), "value": 0} for p in PERIODS])
+        .on_conflict_do_nothing())
+    watermarks = lock_watermarks()
+
+    for period, seconds in PERIODS.items():
+        watermark = watermarks[period]
+
+        start = bucket_of(now, bucket_seconds) - seconds
+        if start <= watermark.value:
+            continue
+
+        expired = (select(LikeBucket.message_id,
+                          func.sum(LikeBucket.like_count).label("like_count"))
+                   .where(LikeBucket.bucket >= watermark.value,
+                          LikeBucket.bucket < start)
+                   .group_by(LikeBucket.message_id)
+                   .subquery())
+
+        db.session.execute(
+            update(TrendingCount)
+            .where(TrendingCount.period == period,
+                   TrendingCount.message_id == expired.c.message_id)
+            .values(like_count=TrendingCount.like_count - expired.c.like_count))
+        db.session.execute(
+            delete(TrendingCount)
+            .where(TrendingCount.period == period,
+                   TrendingCount.like_count <= 0))
+
+        watermark.value = start
+
+    oldest = min(watermark.value for watermark in watermarks.values())
+    db.session.execute(delete(LikeBucket).where(LikeBucket.bucket < oldest))
+
+    db.session.commit()
+
+
+def rebuild(now, bucket_seconds):
+    """Recount buckets and period totals from `likes`."""
+
+    db.session.execute(delete(TrendingCount))
+    db.session.execute(delete(LikeBucket))
+    db.session.execute(delete(Watermark).where(
+        Watermark.name.in_([watermark_name(p) for p in PERIODS])))
+
+    epoch = func.floor(func.extract("epoch", Like.liked_at))
+    bucket = (epoch - func.mod(epoch, bucket_seconds)).cast(db.BigInteger)
+    oldest = bucket_of(now, bucket_seconds) - max(PERIODS.values())
+
+    buckets = (select(Like.message_id,
+                      bucket.label("bucket"),
+                      func.count().label("like_count"))
+               .group_by(Like.message_id, bucket)
+               .having(bucket >= oldest))
+    db.session.execute(insert(LikeBucket).from_select(
+        ["message_id", "bucket", "like_count"], buckets))
+
+    for period, seconds in PERIODS.items():
+        start = bucket_of(now, bucket_seconds) - seconds
+        db.session.add(Watermark(name=watermark_name(period), value=start))
+
+        counts = (select(db.literal(period),
+                         LikeBucket.message_id,
+                         func.sum(LikeBucket.like_count))
+                  .where(LikeBucket.bucket >= start)
+                  .group_by(LikeBucket.message_id))
+        db.session.execute(insert(TrendingCount).from_select(
+            ["period", "message_id", "like_count"], counts))
+
+    db.session.commit()
+
+
+def trending_messages(period, limit):
+    """Return the top `limit` (message, like count) pairs for `period`."""
+
+    return db.session.execute(
+        select(Message, TrendingCount.like_count)
+        .join(TrendingCount, TrendingCount.message_id == Message.id)
+        .join(Message.user)
+        .where(TrendingCount.period == period, User.deleted_at.is_(None))
+        .options(selectinload(Message.user))
+        .order_by(TrendingCount.like_count.desc(), TrendingCount.message_id)
+        .limit(limit)).all()
+
+
+def init_trending(app):
+    """Set up `app`'s trending settings and CLI."""
+
+    for key, value in DEFAULT_CONFIG.items():
+        app.config.setdefault(key, value)
+
+    @app.cli.group("trending")
+    def trending_cli():
+        """Trending messages commands."""
+
+    @trending_cli.command("expire")
+    def expire_command():
+        """Subtract likes that are no longer in each trending period."""
+
+        expire(datetime.utcnow(), app.config["TRENDING_BUCKET_SECONDS"])
+
+    @trending_cli.command("rebuild")
+    def rebuild_command():
+        """Recount trending likes from the likes table."""
+
+        rebuild(datetime.utcnow(), app.config["TRENDING_BUCKET_SECONDS"])
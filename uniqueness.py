@@ -0,0 +1,245 @@
+"""Checks for taken usernames and emails, before hashing a password.
+
+Signing up, or changing a username or email, used to find out that the name
+was taken only when the INSERT or UPDATE failed, after paying for a bcrypt
+hash. `taken_fields()` checks first.
+
+Each worker keeps a Bloom filter of every username and email in `users`
+(lowercased), so most checks -- for names nobody has -- are answered from
+memory. Names the filter might have are looked up with a case-insensitive
+query on the lower(username) and lower(email) indexes. The filter is kept
+current like the username index (usernames.py): by signals for this
+worker's changes, a check for new users every UNIQUENESS_SYNC_INTERVAL
+seconds, and a rebuild, sized for the number of users, every
+UNIQUENESS_MAX_AGE seconds. Builds run in a background thread
+(UNIQUENESS_BUILD_IN_BACKGROUND), with every check going to the database
+until the first is done; names added meanwhile are replayed onto the new
+filter. A name taken so recently that the filter hasn't seen it is still
+caught by the unique constraints.
+"""
+
+import hashlib
+import math
+import threading
+import time
+
+from flask import current_app
+from sqlalchemy import func, or_, select
+
+from models import db, User
+from signals import user_email_changed, user_renamed, user_signed_up
+
+DEFAULT_CONFIG = {
+    "UNIQUENESS_SYNC_INTERVAL": 1.0,
+    "UNIQUENESS_MAX_AGE": 3600,
+    "UNIQUENESS_ERROR_RATE": 0.01,
+    "UNIQUENESS_BUILD_IN_BACKGROUND": True,
+}
+
+# room for at least this many names, and twice as many as there are
+MIN_CAPACITY = 10000
+
+FIELDS = ("username", "email")
+
+
+class BloomFilter:
+    """A set of strings that can have false positives, but no false
+    negatives, in about 1.2 bytes an item at a 1% error rate.
+    """
+
+    def __init__(self, capacity, error_rate):
+        self.size = math.ceil(
+            -capacity * math.log(error_rate) / math.log(2) ** 2)
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        a = int.from_bytes(digest[:8], "little")
+        b = int.from_bytes(digest[8:], "little") | 1
+        return [(a + i * b) % self.size for i in range(self.hashes)]
+
+    def add(self, key):
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, key):
+        return all(self.bits[position >> 3] & (1 << (position & 7))
+                   for position in self._positions(key))
+
+    @property
+    def nbytes(self):
+        return len(self.bits)
+
+
+def filter_key(field, value):
+    return f"{field}:{value.strip().lower()}"
+
+
+class TakenNames:
+    """A worker's Bloom filter of usernames and emails, kept in sync."""
+
+    def __init__(self, app):
+        self.app = app
+        self.filter = None
+        self.max_id = 0
+        self.built_at = 0
+        self.synced_at = 0
+        # names added during a build, as {field: value}s
+        self.changes = None
+        # guards the fields above; only held briefly
+        self._lock = threading.Lock()
+        # held by whichever thread is building or syncing
+        self._updating = threading.Lock()
+
+    def build(self):
+        """Build the filter from a scan of `users`, and swap it in."""
+
+        # start logging names first: anything committed before then is in
+        # the scan (see UsernameIndex.build)
+        with self._lock:
+            self.changes = []
+
+        try:
+            count = db.session.scalar(select(func.count(User.id)))
+            names = BloomFilter(
+                max(2 * count, MIN_CAPACITY),
+                self.app.config["UNIQUENESS_ERROR_RATE"])
+
+            max_id = 0
+            for user_id, username, email in db.session.execute(
+                    select(User.id, User.username, User.email)
+                    .execution_options(yield_per=10000)):
+                names.add(filter_key("username", username))
+                names.add(filter_key("email", email))
+                max_id = max(max_id, user_id)
+        except BaseException:
+            with self._lock:
+                self.changes = None
+            raise
+
+        with self._lock:
+            changes, self.changes = self.changes, None
+            for values in changes:
+                for field, value in values.items():
+                    names.add(filter_key(field, value))
+
+            self.filter = names
+            self.max_id = max(self.max_id, max_id)
+            self.built_at = self.synced_at = time.monotonic()
+
+    def build_in_background(self):
+        """`build`, in the app's context, then let the next update start."""
+
+        try:
+            with self.app.app_context():
+                self.build()
+        except Exception:
+            self.app.logger.exception("Building the taken names filter failed")
+        finally:
+            self._updating.release()
+
+    def sync(self):
+        """Add users who signed up through other workers."""
+
+        self.synced_at = time.monotonic()
+        for user_id, username, email in db.session.execute(
+                select(User.id, User.username, User.email)
+                .where(User.id > self.max_id)):
+            self.add(username=username, email=email)
+            self.max_id = max(self.max_id, user_id)
+
+    def get(self):
+        """Return this index, up to date, or None if it isn't built yet.
+
+        Never waits for another thread that's building or syncing it, and
+        with UNIQUENESS_BUILD_IN_BACKGROUND on, builds don't hold up the
+        request that starts them either.
+        """
+
+        config = self.app.config
+        now = time.monotonic()
+
+        if self.filter is None or now - self.built_at > config[
+                "UNIQUENESS_MAX_AGE"]:
+            if self._updating.acquire(blocking=False):
+                if config["UNIQUENESS_BUILD_IN_BACKGROUND"]:
+                    threading.Thread(
+                        target=self.build_in_background, daemon=True).start()
+                else:
+                    try:
+                        self.build()
+                    finally:
+                        self._updating.release()
+
+        elif now - self.synced_at >= config["UNIQUENESS_SYNC_INTERVAL"]:
+            if self._updating.acquire(blocking=False):
+                try:
+                    self.sync()
+                finally:
+                    self._updating.release()
+
+        return self if self.filter is not None else None
+
+    def add(self, **values):
+        with self._lock:
+            if self.changes is not None:
+                self.changes.append(values)
+            names = self.filter
+            if names is None:
+                return
+            for field, value in values.items():
+                names.add(filter_key(field, value))
+
+    def might_have(self, field, value):
+        return filter_key(field, value) in self.filter
+
+
+def taken_fields(user_id=None, **values):
+    """Return which of `values` (a username and/or email) are taken by a
+    user other than `user_id`, ignoring case.
+    """
+
+    values = {field: value.strip().lower()
+              for field, value in values.items() if value}
+
+    index = current_app.extensions["uniqueness"].get()
+    if index is not None:
+        values = {field: value for field, value in values.items()
+                  if index.might_have(field, value)}
+    if not values:
+        return set()
+
+    columns = {field: func.lower(getattr(User, field)) for field in values}
+    query = (select(*columns.values())
+             .where(or_(*[column == values[field]
+                          for field, column in columns.items()])))
+    if user_id is not None:
+        query = query.where(User.id != user_id)
+
+    taken = set()
+    for row in db.session.execute(query):
+        taken.update(field for field, value in zip(columns, row)
+                     if value == values[field])
+    return taken
+
+
+def init_uniqueness(app):
+    """Set up `app`'s taken names filter and its signal receivers."""
+
+    for key, value in DEFAULT_CONFIG.items():
+        app.config.setdefault(key, value)
+
+    index = app.extensions["uniqueness"] = TakenNames(app)
+
+    @user_signed_up.connect_via(app, weak=False)
+    def on_signed_up(sender, user_id, username, email):
+        index.add(username=username, email=email)
+
+    @user_renamed.connect_via(app, weak=False)
+    def on_renamed(sender, user_id, username):
+        index.add(username=username)
+
+    @user_email_changed.connect_via(app, weak=False)
+    def on_email_changed(sender, user_id, email):
+        index.add(email=email)
@@ -0,0 +1,319 @@
+"""In-memory username index, for prefix autocomplete.
+
+Each worker keeps every active user's username, sorted case-insensitively
+and packed into one bytes object plus two arrays (about 20 bytes a user),
+so `complete(prefix)` is a binary search and a short scan. Its matches are
+then checked with one primary key lookup, so a user renamed or deleted
+through another worker is never suggested under a name they don't have.
+
+The index is built from a scan of `users` on first use, in a background
+thread (USERNAMES_BUILD_IN_BACKGROUND), with requests completing from the
+database until it's ready. It's then kept current by:
+
+- the `user_signed_up`, `user_renamed` and `user_deleted` signals, for
+  changes made by this worker
+- a check for new users every USERNAMES_SYNC_INTERVAL seconds, for
+  signups handled by other workers
+
+Changes since the build are held in a small overlay, merged into results
+as they're read. The index is rebuilt every USERNAMES_MAX_AGE seconds;
+until then, other workers' renames and deletions are found by that check,
+which fixes up the index and answers from the database instead. A build scans
+without holding the index's lock, so signups and renames aren't held up
+by it; the changes they make meanwhile are replayed onto the new index.
+"""
+
+import heapq
+import threading
+import time
+from array import array
+from bisect import bisect_left, insort
+
+import click
+from flask import current_app
+from sqlalchemy import func, select
+
+from models import db, User
+from signals import user_deleted, user_renamed, user_signed_up
+
+DEFAULT_CONFIG = {
+    "USERNAMES_SYNC_INTERVAL": 1.0,
+    "USERNAMES_MAX_AGE": 3600,
+    "USERNAMES_BUILD_IN_BACKGROUND": True,
+}
+
+COMPLETE_LIMIT = 10
+
+
+class SortedNames:
+    """(username, user id) pairs, sorted by lowercased username, packed."""
+
+    def __init__(self, entries):
+        entries = sorted(entries, key=lambda e: (e[0].lower(), e[1]))
+
+        self.offsets = array("q", [0])
+        self.ids = array("i")
+        data = []
+        for username, user_id in entries:
+            encoded = username.encode()
+            data.append(encoded)
+            self.offsets.append(self.offsets[-1] + len(encoded))
+            self.ids.append(user_id)
+        self.data = b"".join(data)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def username(self, i):
+        return self.data[self.offsets[i]:self.offsets[i + 1]].decode()
+
+    def starting_with(self, prefix):
+        """Yield (lowercased username, user id, username) for each entry
+        starting with `prefix` (lowercase), in order.
+        """
+
+        i = bisect_left(range(len(self)), prefix,
+                        key=lambda i: self.username(i).lower())
+
+        while i < len(self):
+            username = self.username(i)
+            key = username.lower()
+            if not key.startswith(prefix):
+                return
+            yield key, self.ids[i], username
+            i += 1
+
+    @property
+    def nbytes(self):
+        return (len(self.data) + self.offsets.itemsize * len(self.offsets) +
+                self.ids.itemsize * len(self.ids))
+
+
+class UsernameIndex:
+    """A worker's usernames, built on first use and kept in sync."""
+
+    def __init__(self, app):
+        self.app = app
+        self.names = None
+        self.max_id = 0
+        self.built_at = 0
+        self.synced_at = 0
+        # changes since the build: (lowercased username, id, username)s,
+        # sorted, and the ids whose entries in `names` are out of date
+        self.added = []
+        self.removed = set()
+        # changes made during a build, as (user id, username or None)s
+        self.changes = None
+        # guards the fields above; only held briefly
+        self._lock = threading.RLock()
+        # held by whichever thread is building or syncing
+        self._updating = threading.Lock()
+
+    def build(self):
+        """Build the index from a scan of `users`, and swap it in."""
+
+        # start logging changes first: anything committed before then is
+        # in the scan, and replaying one that the scan already saw is
+        # harmless
+        with self._lock:
+            self.changes = []
+
+        try:
+            result = db.session.execute(
+                select(User.username, User.id)
+                .where(User.deleted_at.is_(None))
+                .execution_options(yield_per=10000))
+            names = SortedNames(result.tuples())
+        except BaseException:
+            with self._lock:
+                self.changes = None
+            raise
+
+        with self._lock:
+            changes, self.changes = self.changes, None
+            self.names = names
+            self.max_id = max(names.ids, default=0)
+            self.added = []
+            self.removed = set()
+            self.built_at = self.synced_at = time.monotonic()
+
+            for user_id, username in changes:
+                if username is None:
+                    self.remove(user_id)
+                else:
+                    self.add(user_id, username)
+
+    def build_in_background(self):
+        """`build`, in the app's context, then let the next update start."""
+
+        try:
+            with self.app.app_context():
+                self.build()
+        except Exception:
+            self.app.logger.exception("Building the username index failed")
+        finally:
+            self._updating.release()
+
+    def sync(self):
+        """Add users who signed up through other workers."""
+
+        self.synced_at = time.monotonic()
+        for username, user_id in db.session.execute(
+                select(User.username, User.id)
+                .where(User.id > self.max_id, User.deleted_at.is_(None))):
+            self.add(user_id, username)
+
+    def get(self):
+        """Return this index, up to date, or None if it isn't built yet.
+
+        Like the follow graph, never waits for another thread that's
+        building or syncing it. With USERNAMES_BUILD_IN_BACKGROUND on,
+        builds don't hold up the request that starts them either.
+        """
+
+        config = self.app.config
+        now = time.monotonic()
+
+        if self.names is None or now - self.built_at > config[
+                "USERNAMES_MAX_AGE"]:
+            if self._updating.acquire(blocking=False):
+                if config["USERNAMES_BUILD_IN_BACKGROUND"]:
+                    threading.Thread(
+                        target=self.build_in_background, daemon=True).start()
+                else:
+                    try:
+                        self.build()
+                    finally:
+                        self._updating.release()
+
+        elif now - self.synced_at >= config["USERNAMES_SYNC_INTERVAL"]:
+            if self._updating.acquire(blocking=False):
+                try:
+                    self.sync()
+                finally:
+                    self._updating.release()
+
+        return self if self.names is not None else None
+
+    def add(self, user_id, username):
+        with self._lock:
+            if self.changes is not None:
+                self.changes.append((user_id, username))
+            self._remove(user_id)
+            insort(self.added, (username.lower(), user_id, username))
+            self.max_id = max(self.max_id, user_id)
+
+    def remove(self, user_id):
+        with self._lock:
+            if self.changes is not None:
+                self.changes.append((user_id, None))
+            self._remove(user_id)
+
+    def _remove(self, user_id):
+        self.removed.add(user_id)
+        self.added = [entry for entry in self.added if entry[1] != user_id]
+
+    def complete(self, prefix, limit=COMPLETE_LIMIT):
+        """Return up to `limit` (user id, username)s for usernames starting
+        with `prefix`, ignoring case, in order.
+        """
+
+        prefix = prefix.lower()
+        names, added, removed = self.names, self.added, self.removed
+
+        base = (entry for entry in names.starting_with(prefix)
+                if entry[1] not in removed)
+        start = bisect_left(added, (prefix,))
+        recent = (entry for entry in added[start:]
+                  if entry[0].startswith(prefix))
+
+        matches = []
+        for _, user_id, username in heapq.merge(base, recent):
+            if len(matches) == limit:
+                break
+            matches.append((user_id, username))
+        return matches
+
+
+def query_completions(prefix, limit=COMPLETE_LIMIT):
+    """`UsernameIndex.complete` from the database, until it's built."""
+
+    key = func.lower(User.username)
+    return [tuple(row) for row in (
+        User.active()
+        .with_entities(User.id, User.username)
+        .filter(key.startswith(prefix.lower(), autoescape=True))
+        .order_by(key, User.id)
+        .limit(limit))]
+
+
+def complete_username(prefix, limit=COMPLETE_LIMIT):
+    """Return up to `limit` (user id, username)s starting with `prefix`."""
+
+    index = current_app.extensions["usernames"].get()
+    if index is None:
+        return query_completions(prefix, limit)
+
+    matches = index.complete(prefix, limit)
+    if not matches:
+        return matches
+
+    # other workers' renames and deletions aren't in the index until it's
+    # rebuilt
+    current = dict(db.session.execute(
+        select(User.id, User.username)
+        .where(User.id.in_([user_id for user_id, _ in matches]),
+               User.deleted_at.is_(None))).all())
+    if all(current.get(user_id) == username for user_id, username in matches):
+        return matches
+
+    for user_id, username in matches:
+        if user_id not in current:
+            index.remove(user_id)
+        elif current[user_id] != username:
+            index.add(user_id, current[user_id])
+    return query_completions(prefix, limit)
+
+
+def init_usernames(app):
+    """Set up `app`'s username index, its signal receivers and CLI."""
+
+    for key, value in DEFAULT_CONFIG.items():
+        app.config.setdefault(key, value)
+
+    index = app.extensions["usernames"] = UsernameIndex(app)
+
+    # changes before the first build are only needed if it's running
+    def tracking():
+        return index.names is not None or index.changes is not None
+
+    @user_signed_up.connect_via(app, weak=False)
+    def on_signed_up(sender, user_id, username, email):
+        if tracking():
+            index.add(user_id, username)
+
+    @user_renamed.connect_via(app, weak=False)
+    def on_renamed(sender, user_id, username):
+        if tracking():
+            index.add(user_id, username)
+
+    @user_deleted.connect_via(app, weak=False)
+    def on_deleted(sender, user_id):
+        if tracking():
+            index.remove(user_id)
+
+    @app.cli.group("usernames")
+    def usernames_cli():
+        """Username index commands."""
+
+    @usernames_cli.command("stats")
+    def stats_command():
+        """Build the username index and print its size."""
+
+        start = time.perf_counter()
+        index.build()
+        elapsed = time.perf_counter() - start
+
+        click.echo(f"users: {len(index.names)}")
+        click.echo(f"memory: {index.names.nbytes / 1024 / 1024:.1f} MB")
+        click.echo(f"build time: {elapsed:.2f}s")